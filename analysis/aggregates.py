@@ -0,0 +1,181 @@
+import math
+
+from analysis.estimators import student_quantile
+
+
+class Moments:
+    """ Count, mean, sum of squared deviations, minimum and maximum of a stream of values.
+
+    Partial moments of separate streams merge exactly (Chan et al.), so they can be computed in parallel
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: 'Moments') -> 'Moments':
+        """ Adds the values of other moments to these ones """
+
+        if other.count == 0:
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def variance(self) -> float:
+        """float: Sample variance. Read only"""
+        return self.m2 / (self.count - 1) if self.count > 1 else math.nan
+
+    def confidence_interval(self, confidence: float = 0.95) -> tuple[float, float, float]:
+        """ Confidence interval of the mean, same as estimators.confidence_interval """
+
+        if self.count < 2:
+            return self.mean, -math.inf, math.inf
+        half_width = student_quantile(confidence, self.count - 1) * math.sqrt(self.variance / self.count)
+        return self.mean, self.mean - half_width, self.mean + half_width
+
+
+class Histogram:
+    """ Counts of values in equal bins between low and high, with values below and above the range
+    counted separately
+    """
+
+    def __init__(self, low: float, high: float, bins: int):
+        """
+        Parameters
+        ----------
+        low
+            Lower edge of the first bin
+        high
+            Upper edge of the last bin
+        bins
+            Number of bins
+        """
+
+        if high <= low or bins < 1:
+            raise AttributeError('Histogram needs high > low and at least one bin')
+        self.low = low
+        self.high = high
+        self.bins = bins
+        self.counts = [0] * bins
+        self.below = 0
+        self.above = 0
+
+    def add(self, value: float):
+        if value < self.low:
+            self.below += 1
+        elif value >= self.high:
+            self.above += 1
+        else:
+            i = int((value - self.low) / (self.high - self.low) * self.bins)
+            self.counts[min(i, self.bins - 1)] += 1
+
+    def merge(self, other: 'Histogram') -> 'Histogram':
+        if (self.low, self.high, self.bins) != (other.low, other.high, other.bins):
+            raise AttributeError('Histograms have different bins')
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.below += other.below
+        self.above += other.above
+        return self
+
+    def edges(self) -> list[float]:
+        return [self.low + (self.high - self.low) * i / self.bins for i in range(self.bins + 1)]
+
+    def quantile(self, q: float) -> float:
+        """ Quantile estimated by linear interpolation inside the bin. Edges of the range if it falls outside """
+
+        total = self.below + sum(self.counts) + self.above
+        rank = q * total
+        if rank <= self.below:
+            return self.low
+        cumulative = self.below
+        width = (self.high - self.low) / self.bins
+        for i, count in enumerate(self.counts):
+            if count > 0 and cumulative + count >= rank:
+                return self.low + width * (i + (rank - cumulative) / count)
+            cumulative += count
+        return self.high
+
+
+class ReplicationSummary:
+    """ Fixed-size summary of replication results: moments of every scalar metric and histograms of the chosen
+    ones. Its size does not depend on the number of replications or the horizon
+    """
+
+    def __init__(self, histograms: dict[str, tuple[float, float, int]] = None):
+        """
+        Parameters
+        ----------
+        histograms
+            Metric name -> (low, high, bins) of its histogram
+        """
+
+        self._histogram_specs = dict(histograms) if histograms is not None else dict()
+        self.moments = dict()
+        self.histograms = dict((name, Histogram(*spec)) for name, spec in self._histogram_specs.items())
+
+    def add(self, metrics: dict):
+        """ Adds a replication result. Nested dicts (e.g. peak_oil) become metrics named 'key/inner key' """
+
+        for name, value in _flatten(metrics):
+            if name not in self.moments:
+                self.moments[name] = Moments()
+            self.moments[name].add(value)
+            if name in self.histograms:
+                self.histograms[name].add(value)
+
+    def merge(self, other: 'ReplicationSummary') -> 'ReplicationSummary':
+        for name, moments in other.moments.items():
+            self.moments.setdefault(name, Moments()).merge(moments)
+        for name, histogram in other.histograms.items():
+            if name in self.histograms:
+                self.histograms[name].merge(histogram)
+            else:
+                self.histograms[name] = histogram
+        return self
+
+    @property
+    def count(self) -> int:
+        """int: Number of replications. Read only"""
+        return max([moments.count for moments in self.moments.values()], default=0)
+
+
+def _flatten(metrics: dict, prefix: str = ''):
+    for name, value in metrics.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f'{prefix}{name}/')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f'{prefix}{name}', value
+
+
+def tree_merge(summaries: list) -> object:
+    """ Merges partial summaries pairwise, level by level, so rounding errors grow with the depth of the tree
+    rather than with the number of summaries. Summaries need a merge method
+    """
+
+    if len(summaries) == 0:
+        raise AttributeError('Nothing to merge')
+    level = list(summaries)
+    while len(level) > 1:
+        merged = [level[i].merge(level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2 == 1:
+            merged.append(level[-1])
+        level = merged
+    return level[0]
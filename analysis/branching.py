@@ -0,0 +1,123 @@
+import os
+import pickle
+import random
+import traceback
+from typing import Any, Callable
+
+from analysis.run_metrics import RunMetrics
+from modeler import Modeler
+
+
+def run_branches(modeler: Modeler,
+                 branches: dict[str, Callable[[Modeler], None]],
+                 logger_factory: Callable[[], Any] = RunMetrics,
+                 collect: Callable[[Any], Any] = lambda logger: logger.result(),
+                 use_fork: bool = None,
+                 workers: int = None) -> dict[str, Any]:
+    """ Forks a running simulation into branches with different modifications and runs them to the end.
+
+    The shared prefix is simulated once: run the modeler to the decision point with simulate(until=...)
+    and pass it here. With os.fork every branch is a child process sharing the parent memory
+    copy-on-write, so forking costs the same whatever the prefix length, and branches run in parallel.
+    Without fork every branch runs on a structural clone (Modeler.clone) in the current process.
+    The modeler itself is not changed in both cases, so it can be forked again or continued
+
+    Parameters
+    ----------
+    modeler
+        Running simulation
+    branches
+        Branch name -> modification applied to the branch modeler before it continues, e.g.
+        lambda branch: branch.station_manager.get_station('Полярный').add_tracks(1).
+        None runs the branch without modifications
+    logger_factory
+        Creates the logger of a branch
+    collect
+        Turns the branch logger into the branch result after the simulation. Result must be picklable
+    use_fork
+        Run branches in forked processes. Used when available if None
+    workers
+        Maximum number of branches running at the same time with fork. Number of CPUs if None
+
+    Returns
+    -------
+    dict[str, Any]
+        Branch name -> result
+    """
+
+    if use_fork is None:
+        use_fork = hasattr(os, 'fork')
+    if not use_fork:
+        results = dict()
+        for name, modification in branches.items():
+            results[name] = _run_branch(modeler.clone(), modification, logger_factory, collect)
+        return results
+
+    workers = workers if workers is not None else os.cpu_count() or 1
+    names = list(branches.keys())
+    results = dict()
+    running = []
+    for name in names:
+        if len(running) >= workers:
+            results.update([_wait_child(*running.pop(0))])
+        running.append((name, *_fork_branch(modeler, branches[name], logger_factory, collect)))
+    while running:
+        results.update([_wait_child(*running.pop(0))])
+    return dict((name, results[name]) for name in names)
+
+
+def _run_branch(modeler: Modeler, modification: Callable[[Modeler], None],
+                logger_factory: Callable[[], Any], collect: Callable[[Any], Any]) -> Any:
+    logger = logger_factory()
+    modeler.logger = logger
+    if modification is not None:
+        modification(modeler)
+    modeler.simulate()
+    return collect(logger)
+
+
+def _fork_branch(modeler: Modeler, modification: Callable[[Modeler], None],
+                 logger_factory: Callable[[], Any], collect: Callable[[Any], Any]) -> tuple[int, int]:
+    """ Starts the branch in a child process
+
+    Returns
+    -------
+    tuple[int, int]
+        Child process id and the read end of the pipe with its pickled result
+    """
+
+    random_state = random.getstate()
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid != 0:
+        os.close(write_fd)
+        return pid, read_fd
+
+    # Child process: never returns to the caller
+    exit_code = 0
+    try:
+        os.close(read_fd)
+        # The global random module is reseeded in forked children. Terminals without their own stream
+        # must continue with the parent draws
+        random.setstate(random_state)
+        try:
+            payload = (True, _run_branch(modeler, modification, logger_factory, collect))
+        except BaseException:
+            payload = (False, traceback.format_exc())
+            exit_code = 1
+        with os.fdopen(write_fd, 'wb') as pipe:
+            pickle.dump(payload, pipe)
+    finally:
+        os._exit(exit_code)
+
+
+def _wait_child(name: str, pid: int, read_fd: int) -> tuple[str, Any]:
+    with os.fdopen(read_fd, 'rb') as pipe:
+        data = pipe.read()
+    os.waitpid(pid, 0)
+    if len(data) == 0:
+        raise RuntimeError(f'Branch {name} terminated without result')
+    is_ok, result = pickle.loads(data)
+    if not is_ok:
+        raise RuntimeError(f'Branch {name} failed:\n{result}')
+    return name, result
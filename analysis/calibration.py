@@ -0,0 +1,375 @@
+import csv
+import math
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from analysis.sensitivity import parameter_values
+from scenario.scenario_builder import apply_overrides, build_modeler
+from station_logic.production_random import create_production_rngs
+
+# Columns of the terminal log tables (radugnii, zvezda) and of the train table, as written by db_logger.Logger
+TERMINAL_COLUMNS = ('date', 'terminal_oil', 'oil_mined', 'train_name', 'oil_collected', 'train_oil')
+TRAIN_COLUMNS = ('train_name', 'station_name', 'arrival_date', 'departure_date')
+_DATE_COLUMNS = ('date', 'arrival_date', 'departure_date')
+_NUMBER_COLUMNS = ('terminal_oil', 'oil_mined', 'oil_collected', 'train_oil')
+
+
+class TableLogger:
+    """ Keeps terminal and train rows in memory in the shape of the database log tables.
+
+    Can be passed to Modeler as a logger. Terminal rows are kept per terminal name, like the radugnii and zvezda
+    tables, train rows in one list, like the train table
+    """
+
+    def __init__(self):
+        self.terminal_tables = dict()
+        self.train_table = []
+
+    def insert_data(self, station_data: list[dict], train_data: list[dict], time: datetime):
+        for elem in station_data:
+            for name, info in elem.items():
+                if 'oil_mined' not in info:  # entrepot
+                    continue
+                self.terminal_tables.setdefault(name, []).append({'date': time,
+                                                                  'terminal_oil': info['oil_amt'],
+                                                                  'oil_mined': info['oil_mined'],
+                                                                  'train_name': info['train_name'],
+                                                                  'oil_collected': info['oil_collected'],
+                                                                  'train_oil': info['train_storage']})
+        # Same dates as db_logger.Logger
+        for info in train_data:
+            self.train_table.append({'train_name': info['train_name'],
+                                     'station_name': info['station_name'],
+                                     'arrival_date': time,
+                                     'departure_date': time + timedelta(hours=info['cargo_time'])})
+
+
+def read_table(path: str) -> list[dict]:
+    """ Reads a CSV export of a log table with a header row of column names. Dates are parsed in ISO format,
+    oil amounts as numbers and empty cells as None
+    """
+
+    rows = []
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        for record in csv.DictReader(f):
+            row = dict()
+            for column, value in record.items():
+                if value is None or value == '':
+                    row[column] = None
+                elif column in _DATE_COLUMNS:
+                    row[column] = datetime.fromisoformat(value)
+                elif column in _NUMBER_COLUMNS:
+                    row[column] = float(value)
+                else:
+                    row[column] = value
+            rows.append(row)
+    return rows
+
+
+def summary_statistics(terminal_tables: dict[str, list[dict]], train_table: list[dict],
+                       until: datetime = None) -> dict[str, float]:
+    """ Summary statistics of log tables
+
+    Parameters
+    ----------
+    terminal_tables
+        Terminal name -> rows with TERMINAL_COLUMNS
+    train_table
+        Rows with TRAIN_COLUMNS
+    until
+        Only rows dated before this time are used. All rows if None
+
+    Returns
+    -------
+    dict[str, float]
+        Per terminal: <name/mined_mean>, <name/mined_std> oil mined per step, <name/oil_mean> mean storage and
+        <name/busy_share> share of steps with a train on the track.
+        Per station of the train table: <name/departures> number of departures, <name/cargo_mean> mean hours
+        on the track and <name/cycle_mean> mean hours between visits of the same train
+    """
+
+    statistics = dict()
+    for name, rows in terminal_tables.items():
+        rows = [row for row in rows if until is None or row['date'] < until]
+        mined = [row['oil_mined'] for row in rows if row['oil_mined'] is not None]
+        statistics[f'{name}/mined_mean'] = float(np.mean(mined)) if len(mined) > 0 else 0.0
+        statistics[f'{name}/mined_std'] = float(np.std(mined)) if len(mined) > 0 else 0.0
+        statistics[f'{name}/oil_mean'] = float(np.mean([row['terminal_oil'] for row in rows])) if len(rows) > 0 else 0.0
+        statistics[f'{name}/busy_share'] = (sum(row['train_name'] is not None for row in rows) / len(rows)
+                                            if len(rows) > 0 else 0.0)
+
+    visits = dict()
+    for row in train_table:
+        if until is None or row['arrival_date'] < until:
+            visits.setdefault(row['station_name'], []).append(row)
+    for name, rows in sorted(visits.items()):
+        cargo = [(row['departure_date'] - row['arrival_date']).total_seconds() / 3600 for row in rows]
+        cycles = []
+        last_arrivals = dict()
+        for row in sorted(rows, key=lambda r: r['arrival_date']):
+            if row['train_name'] in last_arrivals:
+                cycles.append((row['arrival_date'] - last_arrivals[row['train_name']]).total_seconds() / 3600)
+            last_arrivals[row['train_name']] = row['arrival_date']
+        statistics[f'{name}/departures'] = float(len(rows))
+        statistics[f'{name}/cargo_mean'] = float(np.mean(cargo))
+        statistics[f'{name}/cycle_mean'] = float(np.mean(cycles)) if len(cycles) > 0 else 0.0
+    return statistics
+
+
+class _Projection:
+    """ Quadratic regression of parameters in [0, 1] on summary statistics, fitted to simulations. Projected
+    statistics estimate the parameters, so statistics that do not depend on them get small weights
+    (semi-automatic ABC, Fearnhead and Prangle 2012)
+    """
+
+    def __init__(self, names: list[str], statistics: list[dict[str, float]], points: np.ndarray):
+        self._names = names
+        values = self.__values(statistics)
+        self._center = values.mean(axis=0)
+        scale = values.std(axis=0)
+        self._scale = np.where(scale > 0, scale, 1.0)
+        design = self.__design(values)
+        # Small ridge term keeps the fit defined with constant or collinear statistics
+        self._coef = np.linalg.solve(design.T @ design + 1e-6 * np.eye(design.shape[1]), design.T @ points)
+
+    def __values(self, statistics: list[dict[str, float]]) -> np.ndarray:
+        return np.array([[elem.get(name, 0.0) for name in self._names] for elem in statistics], dtype=np.float64)
+
+    def __design(self, values: np.ndarray) -> np.ndarray:
+        scaled = (values - self._center) / self._scale
+        return np.column_stack([np.ones(len(values)), scaled, scaled ** 2])
+
+    def __call__(self, statistics: dict[str, float]) -> np.ndarray:
+        return (self.__design(self.__values([statistics])) @ self._coef)[0]
+
+
+def _simulate_particle(scenario: dict, seed: int, starting_time: datetime, end_time: datetime,
+                       checkpoints: list[datetime], projections: list[_Projection], observed_points: list[np.ndarray],
+                       threshold: float) -> tuple[list[dict[str, float]], int]:
+    """ Simulates the observed period and returns summary statistics at every checkpoint and at the end, and
+    simulated hours. With projections, stops at a checkpoint if the projected statistics so far are further than
+    the threshold from the observed ones, then the statistics are None
+    """
+
+    rngs = create_production_rngs(seed, [param['station_name'] for param in scenario['terminals']])
+    logger = TableLogger()
+    modeler = build_modeler(scenario, starting_time, end_time, logger=logger, production_rngs=rngs)
+    stages = []
+    for i, until in enumerate(checkpoints):
+        modeler.simulate(until=until)
+        stages.append(summary_statistics(logger.terminal_tables, logger.train_table, until))
+        if projections is not None and np.linalg.norm(projections[i](stages[-1]) - observed_points[i]) > threshold:
+            return None, int((until - starting_time).total_seconds() // 3600)
+    modeler.simulate()
+    stages.append(summary_statistics(logger.terminal_tables, logger.train_table))
+    return stages, int((end_time - starting_time).total_seconds() // 3600)
+
+
+def calibrate(scenario: dict,
+              parameters: dict[str, tuple[float, float]],
+              terminal_tables: dict[str, list[dict]],
+              train_table: list[dict],
+              particles: int = 100,
+              acceptance: float = 0.2,
+              rounds: int = 4,
+              checkpoints: list[float] = (0.25, 0.5),
+              reject_factor: float = 2.0,
+              workers: int = None,
+              seed: int = 0) -> dict:
+    """ Fits scenario parameters to historical log tables by approximate Bayesian computation.
+
+    Population Monte Carlo ABC (Beaumont et al. 2009) with uniform priors on the parameter ranges. Every round
+    simulates particles / acceptance proposals over the observed period in parallel and keeps the closest
+    particles. Closeness is measured on summary statistics (see summary_statistics) projected to parameter
+    estimates by a quadratic regression fitted to the first round, which samples the prior. Later rounds propose
+    by perturbing kept particles with a Gaussian kernel of twice their covariance truncated to the prior range
+    and weight them by prior over proposal density. A proposal is stopped early at a checkpoint when its statistics
+    so far are further from the observed statistics of the same period than reject_factor times the acceptance
+    distance of the previous round.
+
+    The simulation starts at the first observed date from the initial state of the scenario
+
+    Parameters
+    ----------
+    scenario
+        Scenario parameters in the init data format
+    parameters
+        Parameter path (see apply_overrides) -> (low, high) prior range, e.g.
+        {'terminals/Радужный/mean_prod_speed': (100, 200), 'trains/Радужный/velocity': (30, 50)}
+    terminal_tables
+        Observed terminal name -> rows with TERMINAL_COLUMNS (the radugnii and zvezda tables)
+    train_table
+        Observed rows with TRAIN_COLUMNS (the train table)
+    particles
+        Number of particles kept per round
+    acceptance
+        Share of proposals kept per round
+    rounds
+        Number of rounds
+    checkpoints
+        Shares of the observed period where proposals can be stopped
+    reject_factor
+        Distance factor of early rejection
+    workers
+        Number of worker processes. Runs in the current process if 1
+    seed
+        Seed of proposals and production streams
+
+    Returns
+    -------
+    dict
+        <estimates> dict: parameter path -> (posterior mean, 2.5% quantile, 97.5% quantile)
+        <posterior> list: (overrides, weight, distance) of the kept particles of the last round
+        <thresholds> list: acceptance distance of every round, in parameter range shares
+        <observed> dict: observed summary statistics
+        <simulated_hours> int: simulated hours spent
+        <early_rejected> int: number of proposals stopped at a checkpoint
+    """
+
+    if not 0 < acceptance <= 1:
+        raise AttributeError('Acceptance must be in (0, 1]')
+    dates = [row['date'] for rows in terminal_tables.values() for row in rows]
+    if len(dates) == 0:
+        raise AttributeError('No observed terminal rows')
+    starting_time = min(dates)
+    end_time = max(dates)
+    checkpoint_times = [starting_time + (end_time - starting_time) * share for share in checkpoints]
+    observed_stages = [summary_statistics(terminal_tables, train_table, until) for until in checkpoint_times]
+    observed_stages.append(summary_statistics(terminal_tables, train_table))
+
+    paths = list(parameters.keys())
+    low = np.array([parameters[path][0] for path in paths], dtype=np.float64)
+    high = np.array([parameters[path][1] for path in paths], dtype=np.float64)
+    if np.any(high <= low):
+        raise AttributeError('Parameter ranges need high > low')
+    is_integer = [isinstance(value, int) for value in parameter_values(scenario, paths)]
+
+    def to_overrides(point: np.ndarray) -> dict:
+        values = low + point * (high - low)
+        return dict((path, int(round(value)) if integer else float(value))
+                    for path, value, integer in zip(paths, values.tolist(), is_integer))
+
+    rnd = np.random.default_rng(seed)
+    proposals_num = math.ceil(particles / acceptance)
+    next_seed = seed
+    projections, observed_points = None, None
+    threshold = math.inf
+    points, weights, distances = None, None, None
+    thresholds = []
+    simulated_hours = 0
+    early_rejected = 0
+
+    executor = None
+    if workers != 1:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        for _ in range(rounds):
+            if points is None:
+                proposals = rnd.random((proposals_num, len(paths)))
+            else:
+                proposals = _perturb(points, weights, proposals_num, rnd)
+            args = [(apply_overrides(scenario, to_overrides(point)), next_seed + i, starting_time, end_time,
+                     checkpoint_times, projections, observed_points, reject_factor * threshold)
+                    for i, point in enumerate(proposals)]
+            next_seed += proposals_num
+            if executor is None:
+                results = [_simulate_particle(*arg) for arg in args]
+            else:
+                results = list(executor.map(_simulate_particle, *zip(*args),
+                                            chunksize=max(1, proposals_num // (4 * (workers or 8)))))
+            simulated_hours += sum(hours for _, hours in results)
+            early_rejected += sum(stages is None for stages, _ in results)
+
+            if projections is None:
+                # Rounded integer parameters move the points, so the simulated values are regressed
+                simulated = np.array([(np.array(list(to_overrides(point).values()), dtype=np.float64) - low)
+                                      / (high - low) for point in proposals])
+                projections = [_Projection(sorted(observed), [stages[i] for stages, _ in results], simulated)
+                               for i, observed in enumerate(observed_stages)]
+                observed_points = [projection(observed) for projection, observed in zip(projections, observed_stages)]
+            round_distances = np.array([np.linalg.norm(projections[-1](stages[-1]) - observed_points[-1])
+                                        if stages is not None else math.inf for stages, _ in results])
+
+            kept = np.argsort(round_distances)[:particles]
+            kept = kept[np.isfinite(round_distances[kept])]
+            if len(kept) == 0:
+                raise AttributeError('No proposal passed early rejection, increase reject_factor')
+            threshold = float(round_distances[kept].max())
+            thresholds.append(threshold)
+            if points is None:
+                new_weights = np.ones(len(kept))
+            else:
+                new_weights = 1 / _proposal_density(proposals[kept], points, weights, rnd)
+            points, weights, distances = proposals[kept], new_weights / new_weights.sum(), round_distances[kept]
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    estimates = dict()
+    values = low + points * (high - low)
+    for i, path in enumerate(paths):
+        order = np.argsort(values[:, i])
+        cumulative = np.cumsum(weights[order])
+        estimates[path] = (float(weights @ values[:, i]),
+                           float(values[order[np.searchsorted(cumulative, 0.025)], i]),
+                           float(values[order[min(np.searchsorted(cumulative, 0.975), len(order) - 1)], i]))
+    return {'estimates': estimates,
+            'posterior': [(to_overrides(point), float(weight), float(distance))
+                          for point, weight, distance in zip(points, weights, distances)],
+            'thresholds': thresholds,
+            'observed': observed_stages[-1],
+            'simulated_hours': simulated_hours,
+            'early_rejected': early_rejected}
+
+
+def _kernel_covariance(points: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    mean = weights @ points
+    centered = points - mean
+    covariance = 2 * (centered * weights[:, None]).T @ centered
+    # Keeps the kernel proper when a parameter has collapsed
+    return covariance + 1e-8 * np.eye(points.shape[1])
+
+
+def _perturb(points: np.ndarray, weights: np.ndarray, proposals_num: int, rnd: np.random.Generator) -> np.ndarray:
+    """ Proposals from the kept particles moved by the Gaussian kernel, redrawn until they are inside the prior.
+    So every parent proposes from its kernel truncated to the prior range, see _proposal_density
+    """
+
+    covariance = _kernel_covariance(points, weights)
+    proposals = np.empty((0, points.shape[1]))
+    while len(proposals) < proposals_num:
+        parents = rnd.choice(len(points), proposals_num, p=weights)
+        moved = points[parents] + rnd.multivariate_normal(np.zeros(points.shape[1]), covariance, proposals_num)
+        moved = moved[np.all((moved >= 0) & (moved <= 1), axis=1)]
+        proposals = np.concatenate([proposals, moved])
+    return proposals[:proposals_num]
+
+
+def _proposal_density(proposals: np.ndarray, points: np.ndarray, weights: np.ndarray,
+                      rnd: np.random.Generator) -> np.ndarray:
+    """ Density of the truncated perturbation mixture at the proposals, up to a constant factor. Every kernel term
+    is divided by the mass of its kernel inside the prior range, which is estimated by sampling the kernel
+    """
+
+    covariance = _kernel_covariance(points, weights)
+    inverse = np.linalg.inv(covariance)
+    diffs = proposals[:, None, :] - points[None, :, :]
+    exponents = -0.5 * np.einsum('pki,ij,pkj->pk', diffs, inverse, diffs)
+    return np.exp(exponents) @ (weights / _in_prior_mass(points, covariance, rnd))
+
+
+def _in_prior_mass(points: np.ndarray, covariance: np.ndarray, rnd: np.random.Generator,
+                   draws: int = 4096) -> np.ndarray:
+    """ Share of the Gaussian kernel around every point that is inside the prior range. The same kernel draws
+    are used for all points, so the ratios between them are estimated more accurately than the masses
+    """
+
+    moves = rnd.multivariate_normal(np.zeros(points.shape[1]), covariance, draws)
+    mass = np.empty(len(points))
+    for i, point in enumerate(points):
+        moved = point + moves
+        mass[i] = np.count_nonzero(np.all((moved >= 0) & (moved <= 1), axis=1))
+    # A point is inside the prior range, so at least a part of its kernel is too
+    return np.maximum(mass, 1) / draws
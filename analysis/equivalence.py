@@ -0,0 +1,249 @@
+import math
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Iterator
+
+import numpy as np
+
+from analysis.replication import STARTING_TIME
+from manager.vectorized_station_manager import VectorizedStationManager, reference_production_rngs
+from modeler import Modeler
+from scenario.scenario_builder import apply_overrides, build_modeler
+from scenario.scenario_generator import generate_scenario
+from snapshot_logic.snapshot_buffer import SnapshotBuffer
+
+# Engine factory: (scenario, seed, starting time, end time) -> simulation
+Engine = Callable[[dict, int, datetime, datetime], Modeler]
+
+# Fields that describe the last step rather than the state. They are compared only for steps of equal length
+STEP_FIELDS = {'stations': ['oil_mined'], 'tracks': ['oil_collected'], 'trains': ['cargo_time']}
+STATE_FIELDS = {'stations': ['oil_amt'], 'tracks': ['train', 'storage'], 'trains': ['state', 'direction', 'oil', 'coord']}
+
+
+def reference_engine(scenario: dict, seed: int, starting_time: datetime, end_time: datetime) -> Modeler:
+    """ Reference semantics: Modeler with StationManager and TrainManager, hour steps.
+    Terminals share one numpy stream, so engines drawing from numpy in the terminal order can match exactly
+    """
+
+    return build_modeler(scenario, starting_time, end_time, production_rngs=reference_production_rngs(scenario, seed),
+                         log_steps=False)
+
+
+def vectorized_engine(scenario: dict, seed: int, starting_time: datetime, end_time: datetime) -> Modeler:
+    return build_modeler(scenario, starting_time, end_time,
+                         station_manager=VectorizedStationManager.from_scenario(scenario, seed), log_steps=False)
+
+
+def adaptive_engine(scenario: dict, seed: int, starting_time: datetime, end_time: datetime) -> Modeler:
+    """ Modeler with adaptive steps. A step of several hours draws production once, so runs match
+    the reference only without production noise, see without_production_noise
+    """
+
+    return build_modeler(scenario, starting_time, end_time, production_rngs=reference_production_rngs(scenario, seed),
+                         adaptive=True, log_steps=False)
+
+
+def generated_scenarios(count: int, seed: int = 0, max_terminals: int = 20, max_entrepots: int = 3) -> list[dict]:
+    """ Random scenarios of different sizes for equivalence checks """
+
+    rnd = np.random.default_rng(seed)
+    return [generate_scenario(int(rnd.integers(1, max_terminals + 1)), int(rnd.integers(1, max_entrepots + 1)),
+                              seed=seed * 1000 + i)
+            for i in range(count)]
+
+
+def without_production_noise(scenarios: list[dict]) -> list[dict]:
+    """ Copies of the scenarios with zero standard deviation of production, where engines that draw
+    production differently must give the same results
+    """
+
+    return [apply_overrides(scenario, dict((f'terminals/{param["station_name"]}/std_prod_speed', 0)
+                                           for param in scenario['terminals']))
+            for scenario in scenarios]
+
+
+def compare_engines(candidate: Engine,
+                    scenarios: list[dict],
+                    seeds: list[int],
+                    horizon_hours: int = 24 * 30,
+                    reference: Engine = reference_engine,
+                    atol: float = 1e-9) -> dict:
+    """ Runs the reference and the candidate engine side by side on every scenario and seed and compares
+    station, track and train snapshots field by field at the simulation times both engines step through.
+
+    Engines with other step lengths are compared at common times, and fields of the last step (mined and
+    collected oil, cargo time) only when both steps had the same length. Each engine is timed on its own
+    steps, including writing snapshots
+
+    Parameters
+    ----------
+    candidate
+        Engine under test
+    scenarios
+        Scenarios in the init data format, e.g. from generated_scenarios
+    seeds
+        Seeds to run every scenario with
+    horizon_hours
+        Simulation length in hours
+    reference
+        Engine with reference semantics
+    atol
+        Absolute tolerance of numeric fields
+
+    Returns
+    -------
+    dict
+        <equivalent> bool: no run diverged
+        <runs> list: per run -
+            <scenario> int: scenario index
+            <seed> int: seed
+            <ticks> int: number of compared times
+            <divergence> dict: first divergence, None if there is none -
+                <time> datetime: simulation time of the reference step, as in its log
+                <diff> list: (entity kind, entity name, field, reference value, candidate value) of every field
+                    that differs at that time
+            <reference_seconds> float: time of reference steps
+            <candidate_seconds> float: time of candidate steps
+            <speedup> float: reference time divided by candidate time
+        <speedup> float: total reference time divided by total candidate time
+    """
+
+    runs = []
+    for scenario_id, scenario in enumerate(scenarios):
+        for seed in seeds:
+            run = _compare_run(reference, candidate, scenario, seed, horizon_hours, atol)
+            run['scenario'] = scenario_id
+            run['seed'] = seed
+            runs.append(run)
+    reference_seconds = sum(run['reference_seconds'] for run in runs)
+    candidate_seconds = sum(run['candidate_seconds'] for run in runs)
+    return {'equivalent': all(run['divergence'] is None for run in runs),
+            'runs': runs,
+            'speedup': reference_seconds / candidate_seconds if candidate_seconds > 0 else math.inf}
+
+
+def _timed(steps: Iterator[SnapshotBuffer], timer: list[float]) -> Iterator[SnapshotBuffer]:
+    """ Adds the time spent inside the steps iterator to timer[0] """
+
+    while True:
+        started = time.perf_counter()
+        try:
+            buffer = next(steps)
+        except StopIteration:
+            timer[0] += time.perf_counter() - started
+            return
+        timer[0] += time.perf_counter() - started
+        yield buffer
+
+
+def _compare_run(reference: Engine, candidate: Engine, scenario: dict, seed: int, horizon_hours: int,
+                 atol: float) -> dict:
+    end_time = STARTING_TIME + timedelta(hours=horizon_hours)
+    reference_modeler = reference(scenario, seed, STARTING_TIME, end_time)
+    candidate_modeler = candidate(scenario, seed, STARTING_TIME, end_time)
+    reference_buffer = reference_modeler.create_snapshot_buffer()
+    candidate_buffer = candidate_modeler.create_snapshot_buffer()
+    order = _Order(reference_buffer, candidate_buffer)
+
+    reference_timer = [0.0]
+    candidate_timer = [0.0]
+    reference_steps = _timed(reference_modeler.iter_snapshots(reference_buffer), reference_timer)
+    candidate_steps = _timed(candidate_modeler.iter_snapshots(candidate_buffer), candidate_timer)
+    ticks = 0
+    divergence = None
+    reference_buffer = next(reference_steps, None)
+    candidate_buffer = next(candidate_steps, None)
+    while reference_buffer is not None and candidate_buffer is not None:
+        reference_end = reference_buffer.time + timedelta(hours=reference_buffer.hours)
+        candidate_end = candidate_buffer.time + timedelta(hours=candidate_buffer.hours)
+        if reference_end == candidate_end:
+            ticks += 1
+            diff = order.diff(reference_buffer, candidate_buffer, atol)
+            if len(diff) > 0:
+                divergence = {'time': reference_buffer.time, 'diff': diff}
+                break
+        # Advance the engine that is behind, both if they are at the same time
+        if reference_end <= candidate_end:
+            reference_buffer = next(reference_steps, None)
+        if candidate_end <= reference_end:
+            candidate_buffer = next(candidate_steps, None)
+
+    if divergence is None and ticks == 0:
+        divergence = {'time': None, 'diff': [('simulation', None, 'time', 'no common steps', None)]}
+    reference_seconds = reference_timer[0]
+    candidate_seconds = candidate_timer[0]
+    return {'ticks': ticks,
+            'divergence': divergence,
+            'reference_seconds': reference_seconds,
+            'candidate_seconds': candidate_seconds,
+            'speedup': reference_seconds / candidate_seconds if candidate_seconds > 0 else math.inf}
+
+
+class _Order:
+    """ Row correspondence between snapshot buffers of two engines, matched by station and train names """
+
+    def __init__(self, reference: SnapshotBuffer, candidate: SnapshotBuffer):
+        if sorted(reference.station_names) != sorted(candidate.station_names):
+            raise AttributeError('Engines have different stations')
+        if sorted(reference.train_names) != sorted(candidate.train_names):
+            raise AttributeError('Engines have different trains')
+        station_ids = dict((name, i) for i, name in enumerate(candidate.station_names))
+        self._stations = np.array([station_ids[name] for name in reference.station_names], dtype=np.int64)
+        self._trains = np.array([candidate.train_ids[name] for name in reference.train_names], dtype=np.int64)
+        tracks = []
+        for i, name in enumerate(reference.station_names):
+            reference_rows = reference.track_rows(i)
+            candidate_rows = candidate.track_rows(station_ids[name])
+            if reference_rows.stop - reference_rows.start != candidate_rows.stop - candidate_rows.start:
+                raise AttributeError(f'Engines have different number of tracks at {name}')
+            tracks.extend(range(candidate_rows.start, candidate_rows.stop))
+        self._tracks = np.array(tracks, dtype=np.int64)
+        self._station_names = reference.station_names
+        self._train_names = reference.train_names
+        # Candidate train id -> reference train id, to compare trains on tracks
+        self._train_map = np.empty(len(self._trains), dtype=np.int64)
+        self._train_map[self._trains] = np.arange(len(self._trains))
+        self._track_names = [f'{reference.station_names[station]} #{track}'
+                             for station, track in zip(reference.tracks['station'], reference.tracks['track'])]
+
+    def diff(self, reference: SnapshotBuffer, candidate: SnapshotBuffer, atol: float) -> list[tuple]:
+        """ Fields that differ between the snapshots """
+
+        is_same_step = reference.hours == candidate.hours
+        tables = {'stations': (reference.stations, candidate.stations[self._stations], self._station_names),
+                  'tracks': (reference.tracks, self.__mapped_tracks(candidate), self._track_names),
+                  'trains': (reference.trains, candidate.trains[self._trains], self._train_names)}
+        diff = []
+        for kind, (reference_rows, candidate_rows, names) in tables.items():
+            fields = STATE_FIELDS[kind] + (STEP_FIELDS[kind] if is_same_step else [])
+            for field in fields:
+                reference_values = reference_rows[field]
+                candidate_values = candidate_rows[field]
+                is_close = np.isclose(reference_values, candidate_values, rtol=0, atol=atol, equal_nan=True)
+                for i in np.flatnonzero(~is_close).tolist():
+                    diff.append((kind, names[i], field, reference_values[i].item(), candidate_values[i].item()))
+        return diff
+
+    def __mapped_tracks(self, candidate: SnapshotBuffer) -> np.ndarray:
+        """ Candidate track rows in the reference order with train ids of the reference """
+
+        tracks = candidate.tracks[self._tracks]
+        is_train = tracks['train'] >= 0
+        tracks['train'][is_train] = self._train_map[tracks['train'][is_train]]
+        return tracks
+
+
+def format_report(report: dict) -> str:
+    """ Formats compare_engines result as text """
+
+    lines = [f'{"scenario":>10}{"seed":>8}{"ticks":>8}{"speedup":>10}  result']
+    for run in report['runs']:
+        result = 'ok'
+        if run['divergence'] is not None:
+            result = f'diverged at {run["divergence"]["time"]}'
+        lines.append(f'{run["scenario"]:>10}{run["seed"]:>8}{run["ticks"]:>8}{run["speedup"]:>10.2f}  {result}')
+        if run['divergence'] is not None:
+            for kind, name, field, reference_value, candidate_value in run['divergence']['diff']:
+                lines.append(f'    {kind} {name} {field}: reference {reference_value}, candidate {candidate_value}')
+    lines.append(f'equivalent: {report["equivalent"]}, total speedup: {report["speedup"]:.2f}x')
+    return '\n'.join(lines)
@@ -0,0 +1,47 @@
+import math
+from statistics import NormalDist, mean, stdev
+
+
+def student_quantile(confidence: float, dof: int) -> float:
+    """ Two-sided Student's t quantile.
+
+    Uses the Cornish-Fisher expansion around the normal quantile, which is accurate to ~1% from 3 degrees of freedom
+
+    Parameters
+    ----------
+    confidence
+        Confidence level, e.g. 0.95
+    dof
+        Degrees of freedom
+    """
+
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    if dof <= 0:
+        return math.inf
+    return (z
+            + (z ** 3 + z) / (4 * dof)
+            + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * dof ** 2)
+            + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * dof ** 3))
+
+
+def confidence_interval(values: list[float], confidence: float = 0.95) -> tuple[float, float, float]:
+    """ Confidence interval of the mean
+
+    Parameters
+    ----------
+    values
+        Sample values
+    confidence
+        Confidence level
+
+    Returns
+    -------
+    tuple[float, float, float]
+        Mean, lower bound and upper bound. Bounds are infinite for less than 2 values
+    """
+
+    avg = mean(values)
+    if len(values) < 2:
+        return avg, -math.inf, math.inf
+    half_width = student_quantile(confidence, len(values) - 1) * stdev(values) / math.sqrt(len(values))
+    return avg, avg - half_width, avg + half_width
@@ -0,0 +1,240 @@
+import math
+
+
+def erlang_c(servers: float, offered_load: float) -> float:
+    """ Probability that an arriving train has to wait (Erlang C formula)
+
+    Parameters
+    ----------
+    servers
+        Number of tracks. Fractional values are rounded down, but not below 1
+    offered_load
+        Arrival rate times service time
+    """
+
+    c = max(1, int(servers))
+    if offered_load >= c:
+        return 1.0
+    term = 1.0
+    total = 1.0
+    for k in range(1, c):
+        term *= offered_load / k
+        total += term
+    term *= offered_load / c
+    last = term * c / (c - offered_load)
+    return last / (total + last)
+
+
+def queue_wait(servers: float, arrival_rate: float, service_time: float, arrival_scv: float,
+               service_scv: float, trains: int, other_time: float) -> tuple[float, float]:
+    """ Mean waiting time and queue length of a G/G/c queue (Allen-Cunneen approximation) with a closed fleet.
+    A saturated queue moves at the station capacity: every train waits until the fleet arrives no faster
+    than c / service_time
+
+    Parameters
+    ----------
+    servers
+        Number of tracks
+    arrival_rate
+        Trains per hour
+    service_time
+        Mean time on the track in hours
+    arrival_scv
+        Squared coefficient of variation of interarrival times
+    service_scv
+        Squared coefficient of variation of service times
+    trains
+        Number of trains that use the station. Queue length can not exceed the trains that are not served
+    other_time
+        Shortest hours of a train cycle apart from this queue
+
+    Returns
+    -------
+    tuple[float, float]
+        Waiting time in hours and queue length
+    """
+
+    if arrival_rate <= 0:
+        return 0.0, 0.0
+    c = max(1, int(servers))
+    max_queue = max(trains - c, 0)
+    offered_load = arrival_rate * service_time
+    if offered_load >= c or arrival_rate >= c / service_time:
+        # Saturated: a train is served once per trains * service_time / c hours, and its cycle is not shorter
+        return max(trains * service_time / c - other_time, 0.0), max_queue
+    wait = erlang_c(c, offered_load) / (c / service_time - arrival_rate) * (arrival_scv + service_scv) / 2
+    queue = min(arrival_rate * wait, max_queue)
+    return queue / arrival_rate, queue
+
+
+def fast_estimate(scenario: dict, arrival_scv: float = 0.25, iterations: int = 100) -> dict:
+    """ Quick analytical estimate of the system without simulation.
+
+    Trains run in closed loops: the throughput of a train is one trip per cycle time, and cycle time
+    includes waiting in the station queues, which depends on the throughput of all trains. The fixed point
+    is found by damped iterations. Stations are G/G/c queues, a terminal that produces less oil than its
+    trains could take serves trains at the production rate, and unloader trains take their share of
+    entrepot tracks (fluid approximation). Oil taken from a terminal is bounded by its production and by
+    its pumping capacity
+
+    Parameters
+    ----------
+    scenario
+        Scenario parameters in the init data format
+    arrival_scv
+        Squared coefficient of variation of train interarrival times at stations.
+        Trains of a closed fleet arrive much more regularly than a Poisson stream (1.0)
+    iterations
+        Number of fixed point iterations
+
+    Returns
+    -------
+    dict
+        <trains> dict: train name ->
+            <travel_time> int: hours of travel in both directions
+            <cycle_time> float: hours per trip including loading, unloading and waiting
+            <throughput> float: tons per hour delivered by the train
+        <terminals> dict: terminal name ->
+            <capacity> float: tons per hour the terminal can give, the least of production and pumping capacity
+            <throughput> float: tons per hour taken by its trains, not above capacity
+        <stations> dict: station name ->
+            <utilization> float: mean share of busy tracks
+            <queue_length> float: mean number of trains in the station queue
+            <wait_time> float: mean hours in the queue
+        <entrepots> dict: entrepot name ->
+            <inflow> float: tons per hour unloaded from trains
+            <unloader_rate> float: unloader trains per hour
+            <unloader_utilization> float: mean number of tracks taken by unloader trains
+            <overflow_risk> bool: inflow exceeds unloader capacity, the storage will fill up
+        <delivered_oil_rate> float: tons per hour delivered to entrepots
+    """
+
+    terminals = dict((param['station_name'], param) for param in scenario['terminals'])
+    entrepots = dict((param['station_name'], param) for param in scenario['entrepots'])
+    distances = dict()
+    for param in scenario['distances']:
+        distances[(param['point_a_name'], param['point_b_name'])] = param['distance']
+        distances[(param['point_b_name'], param['point_a_name'])] = param['distance']
+
+    trains = scenario['trains']
+    travel_time = dict()
+    load_time = dict()
+    unload_time = dict()
+    for train in trains:
+        distance = distances[(train['load_station_name'], train['unload_station_name'])]
+        travel_time[train['name']] = 2 * math.ceil(distance / train['velocity'])
+        terminal = terminals[train['load_station_name']]
+        load_time[train['name']] = math.ceil(train['storage_volume'] / terminal['emptying_speed'])
+        entrepot = entrepots[train['unload_station_name']]
+        unload_time[train['name']] = math.ceil(train['storage_volume'] / entrepot['filling_speed'])
+
+    base_time = dict((train['name'], travel_time[train['name']] + load_time[train['name']]
+                      + unload_time[train['name']]) for train in trains)
+    waits = dict((name, 0.0) for name in [*terminals, *entrepots])
+    rates = dict((train['name'], 0.0) for train in trains)
+    stations = dict()
+    terminals_info = dict()
+    entrepots_info = dict()
+    for iteration in range(iterations):
+        # Trip rates of trains given the current waiting times
+        for train in trains:
+            cycle_time = (base_time[train['name']] + waits[train['load_station_name']]
+                          + waits[train['unload_station_name']])
+            rate = 1 / cycle_time
+            rates[train['name']] = rate if iteration == 0 else (rates[train['name']] + rate) / 2
+
+        # Terminals
+        for name, terminal in terminals.items():
+            users = [train for train in trains if train['load_station_name'] == name]
+            arrival_rate = sum(rates[train['name']] for train in users)
+            if arrival_rate == 0:
+                stations[name] = {'utilization': 0.0, 'queue_length': 0.0, 'wait_time': 0.0}
+                terminals_info[name] = {'capacity': float(terminal['mean_prod_speed']), 'throughput': 0.0}
+                continue
+            volume = sum(rates[train['name']] * train['storage_volume'] for train in users) / arrival_rate
+            service_time = sum(rates[train['name']] * load_time[train['name']] for train in users) / arrival_rate
+            production = max(terminal['mean_prod_speed'], 1)
+            # Damped rates can overshoot: trains can not take more oil than is produced or pumped
+            capacity = min(production, volume / service_time)
+            throughput = arrival_rate * volume
+            if throughput > capacity:
+                for train in users:
+                    rates[train['name']] *= capacity / throughput
+                arrival_rate *= capacity / throughput
+                throughput = capacity
+            terminals_info[name] = {'capacity': capacity, 'throughput': throughput}
+            other_time = min(base_time[train['name']] + waits[train['unload_station_name']] for train in users)
+            # Pumping rate is shared by all loading tracks, so the terminal loads like a single server
+            track_wait, track_queue = queue_wait(1, arrival_rate, service_time, arrival_scv, 0.0, len(users),
+                                                 other_time)
+            # Oil can not be taken faster than it is produced: production is a single server
+            # which needs volume / production hours per train, and its time varies with production
+            supply_scv = terminal['std_prod_speed'] ** 2 / (production * volume)
+            supply_wait, supply_queue = queue_wait(1, arrival_rate, volume / production, arrival_scv, supply_scv,
+                                                   len(users), other_time)
+            wait, queue = max((track_wait, track_queue), (supply_wait, supply_queue))
+            waits[name] = wait
+            stations[name] = {'utilization': min(1.0, arrival_rate * service_time),
+                              'queue_length': queue,
+                              'wait_time': wait}
+
+        # Entrepots
+        for name, entrepot in entrepots.items():
+            users = [train for train in trains if train['unload_station_name'] == name]
+            arrival_rate = sum(rates[train['name']] for train in users)
+            inflow = sum(rates[train['name']] * train['storage_volume'] for train in users)
+            unloader_rate = inflow / entrepot['unload_limit']
+            unloader_utilization = unloader_rate * math.ceil(entrepot['unload_limit'] / entrepot['emptying_speed'])
+            entrepots_info[name] = {'inflow': inflow,
+                                    'unloader_rate': unloader_rate,
+                                    'unloader_utilization': unloader_utilization,
+                                    'overflow_risk': inflow > entrepot['emptying_speed']}
+            if arrival_rate == 0:
+                stations[name] = {'utilization': unloader_utilization / entrepot['tracks_num'],
+                                  'queue_length': 0.0, 'wait_time': 0.0}
+                continue
+            # Unloader trains take a share of tracks, and the storage can not take oil faster than it is shipped
+            tracks = max(entrepot['tracks_num'] - unloader_utilization, 1.0)
+            service_time = sum(rates[train['name']] * unload_time[train['name']] for train in users) / arrival_rate
+            other_time = min(base_time[train['name']] + waits[train['load_station_name']] for train in users)
+            track_wait, track_queue = queue_wait(tracks, arrival_rate, service_time, arrival_scv, 0.0, len(users),
+                                                 other_time)
+            # The storage can not take oil faster than unloader trains ship it
+            shipping_time = inflow / arrival_rate / entrepot['emptying_speed']
+            storage_wait, storage_queue = queue_wait(1, arrival_rate, shipping_time, arrival_scv, 0.0, len(users),
+                                                     other_time)
+            wait, queue = max((track_wait, track_queue), (storage_wait, storage_queue))
+            waits[name] = wait
+            stations[name] = {'utilization': min(1.0, (arrival_rate * service_time + unloader_utilization)
+                                                 / entrepot['tracks_num']),
+                              'queue_length': queue,
+                              'wait_time': wait}
+
+    trains_info = dict()
+    for train in trains:
+        trains_info[train['name']] = {'travel_time': travel_time[train['name']],
+                                      'cycle_time': 1 / rates[train['name']],
+                                      'throughput': rates[train['name']] * train['storage_volume']}
+    return {'trains': trains_info,
+            'terminals': terminals_info,
+            'stations': stations,
+            'entrepots': entrepots_info,
+            'delivered_oil_rate': sum(info['throughput'] for info in trains_info.values())}
+
+
+def format_estimate(estimate: dict) -> str:
+    """ Formats fast_estimate result as text tables """
+
+    lines = [f'{"train":<16}{"travel, h":>12}{"cycle, h":>12}{"tons/h":>12}']
+    for name, info in estimate['trains'].items():
+        lines.append(f'{name:<16}{info["travel_time"]:>12}{info["cycle_time"]:>12.1f}{info["throughput"]:>12.1f}')
+    lines.append('')
+    lines.append(f'{"station":<16}{"utilization":>12}{"queue":>12}{"wait, h":>12}')
+    for name, info in estimate['stations'].items():
+        lines.append(f'{name:<16}{info["utilization"]:>12.2f}{info["queue_length"]:>12.2f}{info["wait_time"]:>12.1f}')
+    lines.append('')
+    for name, info in estimate['entrepots'].items():
+        lines.append(f'{name}: inflow {info["inflow"]:.1f} t/h, unloader trains {info["unloader_rate"] * 24:.2f} per day, '
+                     f'overflow risk: {info["overflow_risk"]}')
+    lines.append(f'delivered oil: {estimate["delivered_oil_rate"]:.1f} t/h')
+    return '\n'.join(lines)
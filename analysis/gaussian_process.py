@@ -0,0 +1,129 @@
+import math
+
+import numpy as np
+
+
+class GaussianProcess:
+    """ Gaussian process regression with a squared exponential kernel with a length scale per input.
+
+    Outputs are standardized, the kernel variance is 1 and length scales and noise variance are chosen by
+    maximizing the log marginal likelihood: random search followed by coordinate refinement. Meant for up to a
+    few thousand points with inputs scaled to [0, 1]
+    """
+
+    def __init__(self, search_points: int = 64, refine_rounds: int = 3, seed: int = 0):
+        """
+        Parameters
+        ----------
+        search_points
+            Number of random hyperparameter candidates
+        refine_rounds
+            Number of coordinate refinement rounds after the random search
+        seed
+            Seed of the random search
+        """
+
+        self._search_points = search_points
+        self._refine_rounds = refine_rounds
+        self._seed = seed
+        self._x = None
+        self._y_mean = 0.0
+        self._y_std = 1.0
+        self._length_scales = None
+        self._noise = None
+        self._alpha = None
+        self._inv_chol = None
+
+    @property
+    def length_scales(self) -> np.ndarray:
+        """np.ndarray: Fitted length scales. Read only"""
+        return self._length_scales
+
+    @property
+    def noise(self) -> float:
+        """float: Fitted noise variance of standardized outputs. Read only"""
+        return self._noise
+
+    def __kernel(self, a: np.ndarray, b: np.ndarray, length_scales: np.ndarray) -> np.ndarray:
+        a = a / length_scales
+        b = b / length_scales
+        distances = (a ** 2).sum(axis=1)[:, None] + (b ** 2).sum(axis=1)[None, :] - 2 * a @ b.T
+        return np.exp(-0.5 * np.maximum(distances, 0))
+
+    def __log_likelihood(self, x: np.ndarray, y: np.ndarray, length_scales: np.ndarray, noise: float) -> float:
+        k = self.__kernel(x, x, length_scales) + (noise + 1e-8) * np.eye(len(x))
+        try:
+            chol = np.linalg.cholesky(k)
+        except np.linalg.LinAlgError:
+            return -math.inf
+        alpha = np.linalg.solve(chol.T, np.linalg.solve(chol, y))
+        return float(-0.5 * y @ alpha - np.log(np.diag(chol)).sum() - 0.5 * len(x) * math.log(2 * math.pi))
+
+    def fit(self, x: np.ndarray, y: np.ndarray) -> 'GaussianProcess':
+        """
+        Parameters
+        ----------
+        x
+            Inputs, (points, inputs)
+        y
+            Outputs, (points,)
+        """
+
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if len(x) < 2:
+            raise AttributeError('At least 2 points are needed')
+        self._y_mean = float(y.mean())
+        self._y_std = float(y.std()) if y.std() > 0 else 1.0
+        y = (y - self._y_mean) / self._y_std
+        d = x.shape[1]
+
+        # Hyperparameters are searched in log10 scale: length scales in [0.03, 10], noise in [1e-6, 1]
+        rnd = np.random.default_rng(self._seed)
+        candidates = np.column_stack([rnd.uniform(-1.5, 1, (self._search_points, d)),
+                                      rnd.uniform(-6, 0, self._search_points)])
+        if self._length_scales is not None:
+            # Previous fit is a good start after adding a few points
+            candidates[0] = np.append(np.log10(self._length_scales), math.log10(self._noise))
+        scores = [self.__log_likelihood(x, y, 10 ** c[:d], 10 ** c[d]) for c in candidates]
+        best = candidates[int(np.argmax(scores))].copy()
+        best_score = max(scores)
+        for step in [0.5, 0.25, 0.1][:self._refine_rounds]:
+            for i in range(d + 1):
+                for sign in [-1, 1]:
+                    candidate = best.copy()
+                    candidate[i] += sign * step
+                    score = self.__log_likelihood(x, y, 10 ** candidate[:d], 10 ** candidate[d])
+                    if score > best_score:
+                        best, best_score = candidate, score
+
+        self._length_scales = 10 ** best[:d]
+        self._noise = float(10 ** best[d])
+        k = self.__kernel(x, x, self._length_scales) + (self._noise + 1e-8) * np.eye(len(x))
+        chol = np.linalg.cholesky(k)
+        self._inv_chol = np.linalg.inv(chol)
+        self._alpha = self._inv_chol.T @ (self._inv_chol @ y)
+        self._x = x
+        return self
+
+    def predict(self, x: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """ Predictive mean and standard deviation of the latent function, without observation noise
+
+        Parameters
+        ----------
+        x
+            Inputs, (points, inputs)
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray]
+            Mean and standard deviation per point
+        """
+
+        if self._x is None:
+            raise AttributeError('Gaussian process is not fitted')
+        k = self.__kernel(np.atleast_2d(np.asarray(x, dtype=np.float64)), self._x, self._length_scales)
+        mean = k @ self._alpha
+        v = k @ self._inv_chol.T
+        variance = np.maximum(1 - (v ** 2).sum(axis=1), 0)
+        return mean * self._y_std + self._y_mean, np.sqrt(variance) * self._y_std
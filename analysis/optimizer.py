@@ -0,0 +1,173 @@
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+
+from analysis.estimators import confidence_interval
+from analysis.replication import run_replications
+from analysis.result_cache import ResultCache
+from scenario.scenario_builder import apply_overrides
+
+
+def delivered_oil_objective(metrics: dict, overflow_weight: float = 1.0, stockout_weight: float = 100.0) -> float:
+    """ Default objective: oil delivered to entrepots minus penalties for overflow and terminal stock-outs
+
+    Parameters
+    ----------
+    metrics
+        RunMetrics result
+    overflow_weight
+        Penalty per ton-step of oil above storage volume
+    stockout_weight
+        Penalty per terminal step with empty storage
+    """
+
+    return (metrics['delivered_oil']
+            - overflow_weight * metrics['overflow_oil']
+            - stockout_weight * metrics['stockout_steps'])
+
+
+class FleetOptimizer:
+    """ Searches the best scenario configuration using simulation as a black-box objective.
+
+    Candidates are raced: every round each surviving candidate gets one more replication with a common seed,
+    and candidates that are significantly worse than the leader (paired confidence interval) are dropped
+    """
+
+    def __init__(self,
+                 scenario: dict,
+                 search_space: dict[str, list],
+                 horizon_hours: int = 24 * 30,
+                 objective: Callable[[dict], float] = delivered_oil_objective,
+                 min_replications: int = 3,
+                 max_replications: int = 20,
+                 confidence: float = 0.95,
+                 indifference: float = 0.0,
+                 workers: int = None,
+                 cache: ResultCache = None,
+                 terminal_volumes: dict[str, int] = None):
+        """
+        Parameters
+        ----------
+        scenario
+            Base scenario parameters in the init data format
+        search_space
+            Mapping of parameter path (see apply_overrides) to list of values to try
+        horizon_hours
+            Simulation length of one replication in hours
+        objective
+            Function of RunMetrics result to maximize
+        min_replications
+            Number of replications before a candidate can be dropped
+        max_replications
+            Maximum number of replications per candidate
+        confidence
+            Confidence level of the elimination test
+        indifference
+            Objective difference that is not worth distinguishing. Race stops when all survivors are
+            within this distance from the leader
+        workers
+            Number of worker processes. Runs in the current process if 1
+        cache
+            Result cache shared between runs
+        terminal_volumes
+            Optional terminal storage limits used for overflow metrics
+        """
+
+        if min_replications < 2:
+            raise AttributeError('At least 2 replications are needed to compare candidates')
+        self._scenario = scenario
+        self._search_space = search_space
+        self._horizon_hours = horizon_hours
+        self._objective = objective
+        self._min_replications = min_replications
+        self._max_replications = max(max_replications, min_replications)
+        self._confidence = confidence
+        self._indifference = indifference
+        self._workers = workers
+        self._cache = cache if cache is not None else ResultCache()
+        self._terminal_volumes = terminal_volumes
+
+    def candidates(self) -> list[dict]:
+        """ Full grid of the search space """
+
+        paths = list(self._search_space.keys())
+        return [dict(zip(paths, values)) for values in itertools.product(*self._search_space.values())]
+
+    def optimize(self) -> dict:
+        """ Races grid candidates
+
+        Returns
+        -------
+        dict
+            <best> dict: overrides of the best candidate
+            <objective> tuple: mean objective of the best candidate with confidence bounds
+            <candidates> list: per candidate overrides, objective values and elimination round (None if survived)
+            <simulated_hours> int: simulated hours spent, excluding cached results
+            <grid_hours> int: simulated hours the full grid with max_replications would take
+        """
+
+        candidates = self.candidates()
+        scenarios = [apply_overrides(self._scenario, overrides) for overrides in candidates]
+        values = [[] for _ in candidates]
+        eliminated = [None] * len(candidates)
+        alive = list(range(len(candidates)))
+        simulated_hours = 0
+
+        executor = None
+        if self._workers != 1:
+            executor = ProcessPoolExecutor(max_workers=self._workers)
+        try:
+            for seed in range(self._max_replications):
+                # One more replication for every survivor. The same seed makes comparisons paired
+                cache_size = len(self._cache)
+                results = run_replications([(scenarios[i], seed) for i in alive], self._horizon_hours,
+                                           cache=self._cache, executor=executor,
+                                           terminal_volumes=self._terminal_volumes)
+                simulated_hours += (len(self._cache) - cache_size) * self._horizon_hours
+                for i, metrics in zip(alive, results):
+                    values[i].append(self._objective(metrics))
+
+                if seed + 1 < self._min_replications:
+                    continue
+                alive, is_settled = self.__race_round(alive, values)
+                for i in range(len(candidates)):
+                    if eliminated[i] is None and i not in alive:
+                        eliminated[i] = seed + 1
+                if is_settled:
+                    break
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        best = max(alive, key=lambda i: sum(values[i]) / len(values[i]))
+        return {'best': candidates[best],
+                'objective': confidence_interval(values[best], self._confidence),
+                'candidates': [{'overrides': overrides, 'values': values[i], 'eliminated': eliminated[i]}
+                               for i, overrides in enumerate(candidates)],
+                'simulated_hours': simulated_hours,
+                'grid_hours': len(candidates) * self._max_replications * self._horizon_hours}
+
+    def __race_round(self, alive: list[int], values: list[list[float]]) -> tuple[list[int], bool]:
+        """ Drops candidates that are significantly worse than the leader
+
+        Returns
+        -------
+        tuple[list[int], bool]
+            Surviving candidates and whether the race can stop
+        """
+
+        leader = max(alive, key=lambda i: sum(values[i]) / len(values[i]))
+        survivors = [leader]
+        is_settled = True
+        for i in alive:
+            if i == leader:
+                continue
+            diffs = [a - b for a, b in zip(values[leader], values[i])]
+            _, low, high = confidence_interval(diffs, self._confidence)
+            if low > 0:
+                # Leader is significantly better
+                continue
+            survivors.append(i)
+            if high > self._indifference:
+                is_settled = False
+        return survivors, is_settled
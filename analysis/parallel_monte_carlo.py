@@ -0,0 +1,207 @@
+import math
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from analysis.aggregates import ReplicationSummary, tree_merge
+from analysis.replication import run_replication
+
+# Scenarios attached by this process: shared memory name -> scenario. Entries are removed when the block is closed
+_attached_scenarios = dict()
+
+
+class SharedScenario:
+    """ Scenario in a shared memory block that worker processes attach to by name.
+
+    Every section (terminals, entrepots, trains, distances) is a structured numpy array with a column per field,
+    strings are fixed width. Tasks carry only the block name and the layout, so the scenario is neither pickled
+    nor parsed per task: a process views the arrays in the block without copying them and builds the scenario
+    from them once. Use as a context manager: the block is freed on exit
+    """
+
+    def __init__(self, scenario: dict):
+        """
+        Parameters
+        ----------
+        scenario
+            Scenario parameters in the init data format
+        """
+
+        arrays = dict((section, _section_array(section, rows)) for section, rows in scenario.items())
+        # Section -> (field names, dtype description, offset in bytes, number of rows)
+        self.layout = dict()
+        offset = 0
+        for section, array in arrays.items():
+            self.layout[section] = (list(array.dtype.names or ()), array.dtype.descr, offset, len(array))
+            offset += array.nbytes
+        self.size = offset
+        self._memory = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        self.name = self._memory.name
+        for section, array in arrays.items():
+            _section_view(self._memory, self.layout[section])[:] = array
+
+    def close(self):
+        _attached_scenarios.pop(self.name, None)
+        if self._memory is not None:
+            self._memory.close()
+            self._memory.unlink()
+            self._memory = None
+
+    def __enter__(self) -> 'SharedScenario':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def attach_scenario(name: str, layout: dict) -> dict:
+    """ Scenario of a SharedScenario block. Built once per process """
+
+    scenario = _attached_scenarios.get(name)
+    if scenario is None:
+        memory = shared_memory.SharedMemory(name=name)
+        scenario = dict()
+        for section, section_layout in layout.items():
+            fields = section_layout[0]
+            scenario[section] = [dict(zip(fields, row)) for row in _section_view(memory, section_layout).tolist()]
+        memory.close()
+        _attached_scenarios[name] = scenario
+    return scenario
+
+
+def _section_array(section: str, rows: list[dict]) -> np.ndarray:
+    """ Structured array of the section rows with a column per field """
+
+    if not isinstance(rows, list) or any(not isinstance(row, dict) for row in rows):
+        raise AttributeError(f'Scenario section {section} must be a list of dicts')
+    fields = list(rows[0].keys()) if len(rows) > 0 else []
+    if any(list(row.keys()) != fields for row in rows):
+        raise AttributeError(f'Rows of scenario section {section} must have the same fields')
+    dtypes = []
+    for field in fields:
+        values = [row[field] for row in rows]
+        if all(isinstance(value, bool) for value in values):
+            dtypes.append((field, np.bool_))
+        elif all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+            dtypes.append((field, np.int64))
+        elif all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+            dtypes.append((field, np.float64))
+        elif all(isinstance(value, str) for value in values):
+            dtypes.append((field, f'U{max(1, max(len(value) for value in values))}'))
+        else:
+            raise AttributeError(f'Field {field} of scenario section {section} must have values of one type')
+    return np.array([tuple(row[field] for field in fields) for row in rows], dtype=dtypes)
+
+
+def _section_view(memory: shared_memory.SharedMemory, section_layout: tuple) -> np.ndarray:
+    """ Array of the section in the shared memory block, not a copy """
+
+    _, descr, offset, rows = section_layout
+    return np.ndarray((rows,), dtype=np.dtype(descr), buffer=memory.buf, offset=offset)
+
+
+def run_monte_carlo(scenario: dict,
+                    replications: int,
+                    horizon_hours: int = 24 * 30,
+                    histograms: dict[str, tuple[float, float, int]] = None,
+                    workers: int = None,
+                    chunk_size: int = None,
+                    first_seed: int = 0,
+                    terminal_volumes: dict[str, int] = None,
+                    antithetic: bool = False,
+                    confidence: float = 0.95) -> dict:
+    """ Runs replications in parallel and returns aggregated statistics of their metrics.
+
+    Workers attach to the scenario in shared memory, run chunks of seeds and reduce the results locally
+    into fixed-size summaries (moments and histograms). The parent merges the summaries pairwise. A task sends
+    the shared memory name with the layout and a seed range, and gets a summary back, so IPC does not depend
+    on the horizon
+
+    Parameters
+    ----------
+    scenario
+        Scenario parameters in the init data format
+    replications
+        Number of replications. Replication i uses seed first_seed + i, same as run_replication
+    horizon_hours
+        Simulation length in hours
+    histograms
+        Metric name -> (low, high, bins) of its histogram, e.g. {'delivered_oil': (0, 1e6, 50)}.
+        Metrics of nested results are named 'key/inner key', e.g. 'peak_oil/Полярный'
+    workers
+        Number of worker processes. Runs in the current process if 1
+    chunk_size
+        Replications per task. About four tasks per worker if None
+    first_seed
+        Seed of the first replication
+    terminal_volumes
+        Optional terminal storage limits used for overflow metrics
+    antithetic
+        Use antithetic production streams
+    confidence
+        Confidence level
+
+    Returns
+    -------
+    dict
+        <replications> int: number of replications
+        <metrics> dict: metric name ->
+            <mean> tuple: mean with confidence bounds
+            <std> float: sample standard deviation
+            <min> float: minimum
+            <max> float: maximum
+            <histogram> dict: only for metrics with histograms -
+                <edges> list: bin edges
+                <counts> list: bin counts
+                <below> int: values below the range
+                <above> int: values above the range
+        <ipc_bytes> int: pickled size of task arguments and results
+    """
+
+    if replications < 1:
+        raise AttributeError('At least 1 replication is needed')
+    workers = workers if workers is not None else os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = max(1, math.ceil(replications / (workers * 4)))
+    chunks = [(start, min(chunk_size, replications - (start - first_seed)))
+              for start in range(first_seed, first_seed + replications, chunk_size)]
+
+    with SharedScenario(scenario) as shared:
+        tasks = [(shared.name, shared.layout, start, count, horizon_hours, histograms, terminal_volumes, antithetic)
+                 for start, count in chunks]
+        if workers == 1:
+            summaries = [_run_chunk(*task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                summaries = list(executor.map(_run_chunk, *zip(*tasks)))
+    ipc_bytes = sum(len(pickle.dumps(task)) for task in tasks) + sum(len(pickle.dumps(s)) for s in summaries)
+
+    summary = tree_merge(summaries)
+    metrics = dict()
+    for name, moments in summary.moments.items():
+        metrics[name] = {'mean': moments.confidence_interval(confidence),
+                         'std': math.sqrt(moments.variance) if moments.count > 1 else math.nan,
+                         'min': moments.min,
+                         'max': moments.max}
+        if name in summary.histograms:
+            histogram = summary.histograms[name]
+            metrics[name]['histogram'] = {'edges': histogram.edges(),
+                                          'counts': list(histogram.counts),
+                                          'below': histogram.below,
+                                          'above': histogram.above}
+    return {'replications': summary.count,
+            'metrics': metrics,
+            'ipc_bytes': ipc_bytes}
+
+
+def _run_chunk(name: str, layout: dict, first_seed: int, count: int, horizon_hours: int,
+               histograms: dict[str, tuple[float, float, int]], terminal_volumes: dict[str, int],
+               antithetic: bool) -> ReplicationSummary:
+    scenario = attach_scenario(name, layout)
+    summary = ReplicationSummary(histograms)
+    for seed in range(first_seed, first_seed + count):
+        summary.add(run_replication(scenario, seed, horizon_hours, terminal_volumes, antithetic))
+    return summary
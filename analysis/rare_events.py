@@ -0,0 +1,237 @@
+import math
+import random
+from datetime import timedelta
+from statistics import variance
+from typing import Callable
+
+from analysis.estimators import confidence_interval
+from analysis.replication import STARTING_TIME
+from modeler import Modeler
+from scenario.scenario_builder import build_modeler
+from station_logic.entrepot import Entrepot
+from station_logic.production_random import create_production_rngs
+from station_logic.terminal import Terminal
+
+
+def overflow_score(modeler: Modeler) -> float:
+    """ Danger of entrepot overflow: the largest share of storage volume filled with oil.
+    The event happens when it reaches 1
+    """
+
+    station_manager = modeler.station_manager
+    score = 0.0
+    for name in station_manager.get_station_names():
+        station = station_manager.get_station(name)
+        if isinstance(station, Entrepot):
+            score = max(score, station.oil_volume / station.storage_volume)
+    return score
+
+
+def stranded_trains_score(modeler: Modeler, wait_hours: float = 48, reserve_hours: float = 24) -> float:
+    """ Danger of trains stranded at a dry terminal. The event happens when the score reaches 1: a train has
+    been waiting in a station queue for wait_hours while a terminal has no oil.
+
+    The score is the smaller of the longest queue wait divided by wait_hours and the dryness of the driest
+    terminal, which goes from 0 with reserve_hours of mean production in storage to 1 with empty storage
+
+    Parameters
+    ----------
+    modeler
+        Running simulation
+    wait_hours
+        Waiting time of the event
+    reserve_hours
+        Hours of mean production in storage considered safe
+    """
+
+    station_manager = modeler.station_manager
+    dryness = 0.0
+    for name in station_manager.get_station_names():
+        station = station_manager.get_station(name)
+        if isinstance(station, Terminal):
+            reserve = max(station.mean_prod_speed * reserve_hours, 1)
+            dryness = max(dryness, 1 - min(max(station.oil_volume, 0) / reserve, 1))
+    max_wait = max([max(waits, default=0) for waits in modeler.train_manager.get_queue_waits().values()],
+                   default=0)
+    return min(max_wait / wait_hours, 1.0, dryness)
+
+
+def estimate_rare_event(scenario: dict,
+                        score: Callable[[Modeler], float],
+                        horizon_hours: int = 24 * 30,
+                        particles: int = 100,
+                        level_fraction: float = 0.2,
+                        level_step: float = 0.05,
+                        repetitions: int = 5,
+                        confidence: float = 0.95,
+                        seed: int = 0) -> dict:
+    """ Estimates the probability that the danger score reaches 1 within the horizon by multilevel splitting.
+
+    Fixed effort splitting with adaptive levels: a stage runs its particles from their starting states to the
+    horizon and keeps a clone of every particle when it first crosses each level of the grid (multiples of
+    level_step). The next level is the highest grid level reached by at least level_fraction of the particles,
+    and the share of particles that reached it estimates the conditional probability of the stage. The next
+    stage starts from clones resampled among the states at that level with fresh production streams.
+    The probability is the product of the stage probabilities. Confidence interval comes from independent
+    repetitions of the whole procedure
+
+    Parameters
+    ----------
+    scenario
+        Scenario parameters in the init data format
+    score
+        Danger score of the simulation state. The event is score >= 1.
+        See overflow_score and stranded_trains_score
+    horizon_hours
+        Simulation length in hours
+    particles
+        Number of trajectories per stage
+    level_fraction
+        Target share of particles reaching the next level
+    level_step
+        Distance between the grid levels
+    repetitions
+        Number of independent repetitions of the estimate
+    confidence
+        Confidence level
+    seed
+        Base seed of production streams
+
+    Returns
+    -------
+    dict
+        <probability> tuple: mean estimate with confidence bounds
+        <estimates> list: estimate of every repetition
+        <levels> list: levels and conditional probabilities of the stages of every repetition
+        <simulated_hours> int: simulated hours spent
+        <brute_force_hours> float: simulated hours plain Monte Carlo needs for the same variance
+    """
+
+    if repetitions < 2:
+        raise AttributeError('At least 2 repetitions are needed')
+    if not 0 < level_fraction < 1 or not 0 < level_step <= 1:
+        raise AttributeError('Level fraction must be in (0, 1) and level step in (0, 1]')
+    grid = [min(level_step * k, 1.0) for k in range(1, math.ceil(1 / level_step) + 1)]
+    splitting = _Splitting(scenario, score, horizon_hours, particles, level_fraction, grid, seed)
+
+    estimates = []
+    levels = []
+    for _ in range(repetitions):
+        estimate, stages = splitting.run()
+        estimates.append(estimate)
+        levels.append(stages)
+
+    probability = confidence_interval(estimates, confidence)
+    estimate_variance = variance(estimates) / repetitions
+    if probability[0] <= 0:
+        brute_force_hours = math.inf
+    elif estimate_variance == 0:
+        brute_force_hours = math.nan
+    else:
+        brute_force_hours = probability[0] * (1 - probability[0]) / estimate_variance * horizon_hours
+    return {'probability': probability,
+            'estimates': estimates,
+            'levels': levels,
+            'simulated_hours': splitting.simulated_hours,
+            'brute_force_hours': brute_force_hours}
+
+
+class _Splitting:
+    """ One run of fixed effort splitting per run() call. Seeds of production streams never repeat """
+
+    def __init__(self, scenario: dict, score: Callable[[Modeler], float], horizon_hours: int, particles: int,
+                 level_fraction: float, grid: list[float], seed: int):
+        self._scenario = scenario
+        self._score = score
+        self._horizon_hours = horizon_hours
+        self._particles = particles
+        self._level_fraction = level_fraction
+        self._grid = grid
+        self._seed = seed
+        self._terminal_names = [param['station_name'] for param in scenario['terminals']]
+        self._rnd = random.Random(seed)
+        self.simulated_hours = 0
+
+    def __next_rngs(self) -> dict:
+        self._seed += 1
+        return create_production_rngs(self._seed, self._terminal_names)
+
+    def __reseed(self, modeler: Modeler):
+        """ Gives the clone its own production streams, so clones of one state have different futures """
+
+        for name, rng in self.__next_rngs().items():
+            modeler.station_manager.get_station(name).rng = rng
+
+    def run(self) -> tuple[float, list[tuple[float, float]]]:
+        """
+        Returns
+        -------
+        tuple[float, list[tuple[float, float]]]
+            Probability estimate and (level, conditional probability) of every stage
+        """
+
+        end_time = STARTING_TIME + timedelta(hours=self._horizon_hours)
+        starts = [build_modeler(self._scenario, STARTING_TIME, end_time, production_rngs=self.__next_rngs(),
+                                log_steps=False)
+                  for _ in range(self._particles)]
+        level_id = -1
+        probability = 1.0
+        stages = []
+        while True:
+            entrances = [[] for _ in self._grid]
+            for modeler in starts:
+                self.__run_particle(modeler, level_id + 1, entrances)
+
+            reached = [len(states) for states in entrances]
+            next_id = None
+            for i in range(level_id + 1, len(self._grid)):
+                if reached[i] >= self._level_fraction * self._particles:
+                    next_id = i
+            if next_id is None:
+                # Nobody reached the target share: take the first level anybody reached
+                next_id = next((i for i in range(level_id + 1, len(self._grid)) if reached[i] > 0), None)
+            if next_id is None:
+                stages.append((self._grid[level_id + 1], 0.0))
+                return 0.0, stages
+
+            conditional = reached[next_id] / self._particles
+            probability *= conditional
+            stages.append((self._grid[next_id], conditional))
+            if next_id == len(self._grid) - 1:
+                return probability, stages
+
+            level_id = next_id
+            starts = []
+            for _ in range(self._particles):
+                modeler = self._rnd.choice(entrances[level_id]).clone()
+                self.__reseed(modeler)
+                starts.append(modeler)
+
+    def __run_particle(self, modeler: Modeler, level_id: int, entrances: list[list[Modeler]]):
+        """ Runs the particle to the horizon or to the event and keeps its states at level crossings """
+
+        level_id = self.__keep_crossings(modeler, level_id, entrances)
+        if level_id == len(self._grid):
+            return
+        for record in modeler.iter_steps(include_stations=False):
+            self.simulated_hours += record.hours
+            level_id = self.__keep_crossings(modeler, level_id, entrances)
+            if level_id == len(self._grid):
+                break
+
+    def __keep_crossings(self, modeler: Modeler, level_id: int, entrances: list[list[Modeler]]) -> int:
+        """ Keeps clones of the state for the levels it has reached
+
+        Returns
+        -------
+        int
+            First level not reached yet
+        """
+
+        value = self._score(modeler)
+        while level_id < len(self._grid) and value >= self._grid[level_id]:
+            # The event ends the particle, so its last state needs no copy
+            is_event = level_id == len(self._grid) - 1
+            entrances[level_id].append(modeler if is_event else modeler.clone())
+            level_id += 1
+        return level_id
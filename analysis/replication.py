@@ -0,0 +1,100 @@
+import json
+from concurrent.futures import Executor
+from datetime import datetime, timedelta
+
+from analysis.result_cache import ResultCache
+from analysis.run_metrics import RunMetrics
+from scenario.scenario_builder import build_modeler, scenario_key
+from station_logic.production_random import create_production_rngs
+
+STARTING_TIME = datetime(year=2021, month=11, day=1)
+
+
+def run_replication(scenario: dict, seed: int, horizon_hours: int, terminal_volumes: dict[str, int] = None,
+                    antithetic: bool = False) -> dict:
+    """ Runs one simulation replication and returns its aggregated metrics.
+
+    Every terminal gets its own production stream derived from the seed and the terminal name,
+    so scenarios run with the same seed share random numbers
+
+    Parameters
+    ----------
+    scenario
+        Scenario parameters in the init data format
+    seed
+        Random seed of oil production
+    horizon_hours
+        Simulation length in hours
+    terminal_volumes
+        Optional terminal storage limits used for overflow metrics
+    antithetic
+        Use antithetic production streams
+
+    Returns
+    -------
+    dict
+        RunMetrics result and
+        <production_control> float: sum of standard normal production draws. Its expectation is 0
+    """
+
+    rngs = create_production_rngs(seed, [param['station_name'] for param in scenario['terminals']], antithetic)
+    metrics = RunMetrics.for_scenario(scenario, terminal_volumes)
+    end_time = STARTING_TIME + timedelta(hours=horizon_hours)
+    modeler = build_modeler(scenario, STARTING_TIME, end_time, logger=metrics, production_rngs=rngs)
+    modeler.simulate()
+    result = metrics.result()
+    result['production_control'] = sum(rng.z_sum for rng in rngs.values())
+    return result
+
+
+def replication_key(scenario: dict, seed: int, horizon_hours: int, terminal_volumes: dict[str, int] = None,
+                    antithetic: bool = False) -> str:
+    volumes = json.dumps(terminal_volumes, sort_keys=True, ensure_ascii=False)
+    return f'{scenario_key(scenario)}:{seed}:{horizon_hours}:{volumes}:{int(antithetic)}'
+
+
+def run_replications(jobs: list[tuple[dict, int]], horizon_hours: int, cache: ResultCache = None,
+                     executor: Executor = None, terminal_volumes: dict[str, int] = None,
+                     antithetic: bool = False) -> list[dict]:
+    """ Runs replications, skipping the ones that are already cached
+
+    Parameters
+    ----------
+    jobs
+        List of (scenario, seed) pairs
+    horizon_hours
+        Simulation length in hours
+    cache
+        Result cache. New results are added to it
+    executor
+        Executor with worker processes. Runs in the current process if None
+    terminal_volumes
+        Optional terminal storage limits used for overflow metrics
+    antithetic
+        Use antithetic production streams
+
+    Returns
+    -------
+    list[dict]
+        RunMetrics results in the order of jobs
+    """
+
+    if cache is None:
+        cache = ResultCache()
+
+    keys = [replication_key(scenario, seed, horizon_hours, terminal_volumes, antithetic) for scenario, seed in jobs]
+    missing = dict()
+    for key, job in zip(keys, jobs):
+        if key not in cache and key not in missing:
+            missing[key] = job
+
+    if len(missing) > 0:
+        args = [(scenario, seed, horizon_hours, terminal_volumes, antithetic) for scenario, seed in missing.values()]
+        if executor is None:
+            results = [run_replication(*arg) for arg in args]
+        else:
+            results = list(executor.map(run_replication, *zip(*args)))
+        for key, result in zip(missing.keys(), results):
+            cache.put(key, result)
+
+    return [cache.get(key) for key in keys]
@@ -0,0 +1,44 @@
+import json
+import os
+
+
+class ResultCache:
+    """ Memoizes replication results by scenario key, seed and horizon.
+
+    Results are optionally persisted to a JSON lines file so that they survive between runs
+    """
+
+    def __init__(self, path: str = None):
+        """
+        Parameters
+        ----------
+        path
+            JSON lines file to load results from and append new results to. In-memory only if None
+        """
+
+        self._path = path
+        self._results = dict()
+        if path is not None and os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self._results[record['key']] = record['result']
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._results
+
+    def items(self) -> list[tuple[str, dict]]:
+        return list(self._results.items())
+
+    def get(self, key: str):
+        return self._results.get(key)
+
+    def put(self, key: str, result: dict):
+        self._results[key] = result
+        if self._path is not None:
+            with open(self._path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'key': key, 'result': result}, ensure_ascii=False) + '\n')
@@ -0,0 +1,279 @@
+import math
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from snapshot_logic.snapshot_buffer import SnapshotBuffer, NO_TRAIN
+
+RESOLUTIONS = {'hourly': timedelta(hours=1),
+               'daily': timedelta(days=1),
+               'weekly': timedelta(weeks=1)}
+# Buckets are counted from a Monday midnight, so weekly buckets start on Mondays
+BUCKET_ORIGIN = datetime(2001, 1, 1)
+
+
+def bucket_start(time: datetime, resolution: timedelta) -> datetime:
+    return BUCKET_ORIGIN + (time - BUCKET_ORIGIN) // resolution * resolution
+
+
+class Rollup:
+    """ Minimum, weighted mean and maximum of one time series per time bucket.
+
+    Samples must come in time order. A bucket is closed when the first sample of a later bucket comes,
+    buckets without samples are skipped
+    """
+
+    def __init__(self, resolution: timedelta):
+        """
+        Parameters
+        ----------
+        resolution
+            Bucket length
+        """
+
+        self._resolution = resolution
+        self._starts = []
+        self._mins = []
+        self._means = []
+        self._maxs = []
+        self._start = None
+        self._min = math.inf
+        self._max = -math.inf
+        self._sum = 0.0
+        self._weight = 0.0
+
+    @property
+    def resolution(self) -> timedelta:
+        """timedelta: Bucket length. Read only"""
+        return self._resolution
+
+    def add(self, time: datetime, value: float, weight: float = 1.0):
+        """ Adds a sample
+
+        Parameters
+        ----------
+        time
+            Sample time
+        value
+            Sample value
+        weight
+            Sample weight in the mean, e.g. step length in hours
+        """
+
+        start = bucket_start(time, self._resolution)
+        if start != self._start:
+            self.__close()
+            self._start = start
+        self._min = min(self._min, value)
+        self._max = max(self._max, value)
+        self._sum += value * weight
+        self._weight += weight
+
+    def __close(self):
+        if self._start is None or self._weight == 0:
+            return
+        self._starts.append(self._start)
+        self._mins.append(self._min)
+        self._means.append(self._sum / self._weight)
+        self._maxs.append(self._max)
+        self._min = math.inf
+        self._max = -math.inf
+        self._sum = 0.0
+        self._weight = 0.0
+
+    def rows(self) -> list[tuple[datetime, float, float, float]]:
+        """ (bucket start, min, mean, max) of every bucket, including the current one """
+
+        rows = list(zip(self._starts, self._mins, self._means, self._maxs))
+        if self._weight > 0:
+            rows.append((self._start, self._min, self._sum / self._weight, self._max))
+        return rows
+
+    @classmethod
+    def from_series(cls, times: np.ndarray, values: np.ndarray, resolution: timedelta,
+                    weights: np.ndarray = None) -> 'Rollup':
+        """ Rolls up a recorded series at once, e.g. a logger table column or SnapshotRecorder history
+
+        Parameters
+        ----------
+        times
+            Sample times in time order, datetime64 or datetime
+        values
+            Sample values. NaN samples are skipped
+        resolution
+            Bucket length
+        weights
+            Sample weights. Equal if None
+        """
+
+        times = np.asarray(times, dtype='datetime64[s]')
+        values = np.asarray(values, dtype=np.float64)
+        weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=np.float64)
+        is_valid = ~np.isnan(values)
+        times, values, weights = times[is_valid], values[is_valid], weights[is_valid]
+
+        rollup = cls(resolution)
+        if len(values) == 0:
+            return rollup
+        origin = np.datetime64(BUCKET_ORIGIN, 's')
+        buckets = (times - origin) // np.timedelta64(resolution)
+        # Boundaries of runs of equal buckets
+        firsts = np.flatnonzero(np.concatenate([[True], buckets[1:] != buckets[:-1]]))
+        rollup._starts = [BUCKET_ORIGIN + int(bucket) * resolution for bucket in buckets[firsts]]
+        rollup._mins = np.minimum.reduceat(values, firsts).tolist()
+        rollup._maxs = np.maximum.reduceat(values, firsts).tolist()
+        rollup._means = (np.add.reduceat(values * weights, firsts) / np.add.reduceat(weights, firsts)).tolist()
+        return rollup
+
+
+class RollupLogger:
+    """ Computes multi-resolution rollups of station oil and track state during the run.
+
+    Can be passed to Modeler as a logger or used as a snapshot sink. Series are keyed by
+    (station name, track number or None, field): station 'oil', track 'occupancy' (1 if a train is on
+    the track) and track 'train_oil' (oil of the train on the track, only while there is one)
+    """
+
+    def __init__(self, resolutions: dict[str, timedelta] = None):
+        """
+        Parameters
+        ----------
+        resolutions
+            Resolution name -> bucket length. Hourly, daily and weekly if None
+        """
+
+        self._resolutions = dict(resolutions) if resolutions is not None else dict(RESOLUTIONS)
+        self._rollups = dict()
+
+    def __add(self, key: tuple, time: datetime, value: float, weight: float):
+        rollups = self._rollups.get(key)
+        if rollups is None:
+            rollups = dict((name, Rollup(resolution)) for name, resolution in self._resolutions.items())
+            self._rollups[key] = rollups
+        for rollup in rollups.values():
+            rollup.add(time, value, weight)
+
+    def __add_track(self, station_name: str, track: int, is_occupied: bool, train_oil: float, time: datetime,
+                    weight: float):
+        self.__add((station_name, track, 'occupancy'), time, 1.0 if is_occupied else 0.0, weight)
+        if is_occupied:
+            self.__add((station_name, track, 'train_oil'), time, train_oil, weight)
+
+    def insert_data(self, station_data: list[dict], train_data: list[dict], time: datetime):
+        """ Logger interface. Every step has the same weight """
+
+        for elem in station_data:
+            for name, info in elem.items():
+                self.__add((name, None, 'oil'), time, info['oil_amt'], 1.0)
+                if 'tracks' in info:  # entrepot or terminal with several tracks
+                    for i, track in enumerate(info['tracks']):
+                        self.__add_track(name, i, track['train_name'] is not None, track['storage'], time, 1.0)
+                else:
+                    self.__add_track(name, 0, info['train_name'] is not None, info['train_storage'], time, 1.0)
+
+    def insert_snapshot(self, buffer: SnapshotBuffer):
+        """ Snapshot sink interface. Steps are weighted by their length """
+
+        time = buffer.time
+        weight = buffer.hours
+        station_oil = buffer.station_oil.tolist()
+        track_train = buffer.track_train.tolist()
+        track_storage = buffer.track_storage.tolist()
+        for station_id, name in enumerate(buffer.station_names):
+            self.__add((name, None, 'oil'), time, station_oil[station_id], weight)
+            rows = buffer.track_rows(station_id)
+            for track, row in enumerate(range(rows.start, rows.stop)):
+                self.__add_track(name, track, track_train[row] != NO_TRAIN, track_storage[row], time, weight)
+
+    def series(self) -> list[tuple]:
+        """ Keys of the collected series """
+
+        return list(self._rollups.keys())
+
+    def rollup(self, key: tuple, resolution: str = 'daily') -> Rollup:
+        """
+        Parameters
+        ----------
+        key
+            Series key: (station name, track number or None, field)
+        resolution
+            Resolution name
+        """
+
+        if key not in self._rollups:
+            raise AttributeError('No such series')
+        if resolution not in self._resolutions:
+            raise AttributeError('No such resolution')
+        return self._rollups[key][resolution]
+
+
+def lttb(times: np.ndarray, values: np.ndarray, points: int) -> tuple[np.ndarray, np.ndarray]:
+    """ Largest-Triangle-Three-Buckets downsampling: keeps the points that preserve the visual shape of the series
+
+    Parameters
+    ----------
+    times
+        Sample times in time order, datetime64, datetime or numbers
+    values
+        Sample values
+    points
+        Number of points to keep. At least 3
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        Kept times and values
+    """
+
+    times = np.asarray(times)
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if points >= n or n <= 2:
+        return times, values
+    if points < 3:
+        raise AttributeError('At least 3 points are needed')
+
+    if np.issubdtype(times.dtype, np.datetime64) or times.dtype == object:
+        x = times.astype('datetime64[s]').astype(np.float64)
+    else:
+        x = times.astype(np.float64)
+    # First and last points are always kept, the rest is split into points - 2 buckets
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    kept = [0]
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket is the third point of the triangle
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        next_x = x[end:next_end].mean() if next_end > end else x[n - 1]
+        next_y = values[end:next_end].mean() if next_end > end else values[n - 1]
+        prev = kept[-1]
+        areas = np.abs((x[prev] - next_x) * (values[start:end] - values[prev])
+                       - (x[prev] - x[start:end]) * (next_y - values[prev]))
+        kept.append(start + int(np.argmax(areas)))
+    kept.append(n - 1)
+    return times[kept], values[kept]
+
+
+def chart_points(rollup: Rollup, points: int = 500) -> tuple[np.ndarray, np.ndarray]:
+    """ Bucket means of the rollup downsampled with LTTB for a chart """
+
+    rows = rollup.rows()
+    times = np.array([row[0] for row in rows], dtype='datetime64[s]')
+    means = np.array([row[2] for row in rows], dtype=np.float64)
+    return lttb(times, means, points)
+
+
+def format_rollups(rollups: RollupLogger, resolution: str = 'daily', field: str = 'oil') -> str:
+    """ Formats rollups of one field of all series as text tables """
+
+    lines = []
+    for key in rollups.series():
+        station_name, track, key_field = key
+        if key_field != field:
+            continue
+        lines.append(station_name if track is None else f'{station_name}, track {track + 1}')
+        lines.append(f'{"start":<22}{"min":>12}{"mean":>12}{"max":>12}')
+        for start, low, avg, high in rollups.rollup(key, resolution).rows():
+            lines.append(f'{str(start):<22}{low:>12.1f}{avg:>12.1f}{high:>12.1f}')
+        lines.append('')
+    return '\n'.join(lines)
@@ -0,0 +1,115 @@
+from datetime import datetime
+
+
+class RunMetrics:
+    """ Collects aggregated run statistics instead of logging every step.
+
+    Can be passed to Modeler as a logger
+    """
+
+    def __init__(self, storage_volumes: dict[str, int] = None, initial_stocks: dict[str, int] = None):
+        """
+        Parameters
+        ----------
+        storage_volumes
+            Maximum oil amount per station name. Stations without volume are not checked for overflow
+        initial_stocks
+            Initial oil amount per entrepot name, used for the stock balance check
+        """
+
+        self._storage_volumes = storage_volumes if storage_volumes is not None else dict()
+        self._initial_stocks = initial_stocks if initial_stocks is not None else dict()
+        # Entrepot name -> [delivered minus shipped oil, last oil amount]
+        self._entrepot_stocks = dict()
+        self._steps = 0
+        self._delivered_oil = 0
+        self._shipped_oil = 0
+        self._overflow_oil = 0
+        self._overflow_steps = 0
+        self._stockout_steps = 0
+        self._departures = 0
+        self._peak_oil = dict()
+
+    @classmethod
+    def for_scenario(cls, scenario: dict, terminal_volumes: dict[str, int] = None) -> 'RunMetrics':
+        """ Creates metrics with entrepot storage volumes taken from scenario parameters
+
+        Parameters
+        ----------
+        scenario
+            Scenario parameters in the init data format
+        terminal_volumes
+            Optional terminal storage limits. Terminals have no storage limit in the model itself
+        """
+
+        storage_volumes = dict(terminal_volumes) if terminal_volumes is not None else dict()
+        initial_stocks = dict()
+        for param in scenario['entrepots']:
+            storage_volumes[param['station_name']] = param['storage_volume']
+            initial_stocks[param['station_name']] = param['oil_volume']
+        return cls(storage_volumes, initial_stocks)
+
+    def insert_data(self, station_data: list[dict], train_data: list[dict], time: datetime):
+        self._steps += 1
+        self._departures += len(train_data)
+        for elem in station_data:
+            for name, info in elem.items():
+                self.__add_station_info(name, info)
+
+    def __add_station_info(self, name: str, info: dict):
+        oil_amt = info['oil_amt']
+        self._peak_oil[name] = max(self._peak_oil.get(name, oil_amt), oil_amt)
+
+        # Storage limit check
+        if name in self._storage_volumes and oil_amt > self._storage_volumes[name]:
+            self._overflow_oil += oil_amt - self._storage_volumes[name]
+            self._overflow_steps += 1
+
+        if 'oil_mined' not in info:  # entrepot
+            stock = self._entrepot_stocks.setdefault(name, [0, oil_amt])
+            stock[1] = oil_amt
+            for track in info['tracks']:
+                if track['oil_collected'] is None:
+                    continue
+                # The unloader train leaves in the step it is filled, so the track flag is used, not the train name
+                if track['is_unloader']:
+                    self._shipped_oil += track['oil_collected']
+                    stock[0] -= track['oil_collected']
+                else:
+                    self._delivered_oil += track['oil_collected']
+                    stock[0] += track['oil_collected']
+        elif oil_amt <= 0:  # terminal ran dry
+            self._stockout_steps += 1
+
+    def stock_imbalance(self) -> dict[str, int]:
+        """ Conservation check of entrepot oil: initial stock + delivered - shipped - final stock per entrepot
+        with a known initial stock. Zero if all collected oil is accounted for
+        """
+
+        return dict((name, self._initial_stocks[name] + net - final)
+                    for name, (net, final) in self._entrepot_stocks.items() if name in self._initial_stocks)
+
+    def result(self) -> dict:
+        """ Get collected statistics
+
+        Returns
+        -------
+        dict
+            <steps> int: number of logged steps
+            <delivered_oil> int: oil unloaded from trains at entrepots
+            <shipped_oil> int: oil loaded into unloader trains
+            <overflow_oil> int: sum over steps of oil amount above station storage volume
+            <overflow_steps> int: number of station steps with overflow
+            <stockout_steps> int: number of terminal steps with empty storage
+            <departures> int: number of train departures
+            <peak_oil> dict: maximum oil amount per station
+        """
+
+        return {'steps': self._steps,
+                'delivered_oil': self._delivered_oil,
+                'shipped_oil': self._shipped_oil,
+                'overflow_oil': self._overflow_oil,
+                'overflow_steps': self._overflow_steps,
+                'stockout_steps': self._stockout_steps,
+                'departures': self._departures,
+                'peak_oil': dict(self._peak_oil)}
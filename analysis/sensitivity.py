@@ -0,0 +1,409 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from typing import Callable
+
+import numpy as np
+
+from analysis.replication import STARTING_TIME, replication_key, run_replications
+from analysis.result_cache import ResultCache
+from batch_logic.batched_modeler import BatchedModeler
+from scenario.scenario_builder import apply_overrides
+
+ENGINES = ('modeler', 'batched')
+
+
+def _overflow_oil(metrics: dict) -> float:
+    return metrics['overflow_oil']
+
+
+def _overflow_steps(metrics: dict) -> float:
+    return metrics['overflow_steps']
+
+
+def _stockout_steps(metrics: dict) -> float:
+    return metrics['stockout_steps']
+
+
+# Entrepot overflow and terminal idle time (steps with empty storage)
+DEFAULT_OUTPUTS = {'overflow_oil': _overflow_oil,
+                   'overflow_steps': _overflow_steps,
+                   'stockout_steps': _stockout_steps}
+
+
+class SensitivityAnalysis:
+    """ Global sensitivity analysis of run metrics to scenario parameters.
+
+    Parameters are declared by their apply_overrides paths with ranges, e.g.
+    {'terminals/Радужный/mean_prod_speed': (100, 200), 'trains/Радужный/velocity': (30, 50)}.
+    Sobol indices come from a Saltelli design, elementary effects from Morris trajectories. Every design point
+    is evaluated once with common seeds, and all indices, outputs and bootstrap resamples reuse the same
+    evaluations. Results are cached by scenario and seed, so a repeated or extended analysis runs only new points
+    """
+
+    def __init__(self,
+                 scenario: dict,
+                 parameters: dict[str, tuple[float, float]],
+                 outputs: dict[str, Callable[[dict], float]] = None,
+                 horizon_hours: int = 24 * 30,
+                 seeds: list[int] = None,
+                 engine: str = 'batched',
+                 workers: int = None,
+                 batch_size: int = 256,
+                 cache: ResultCache = None,
+                 terminal_volumes: dict[str, int] = None):
+        """
+        Parameters
+        ----------
+        scenario
+            Base scenario parameters in the init data format
+        parameters
+            Parameter path (see apply_overrides) -> (low, high). Parameters with integer values in the scenario
+            stay integer
+        outputs
+            Output name -> function of RunMetrics result. Overflow and stock-out metrics if None
+        horizon_hours
+            Simulation length of one replication in hours
+        seeds
+            Seeds of replications averaged per design point. The same seeds are used at every point
+        engine
+            'batched' runs batches of points with BatchedModeler, 'modeler' runs every point with run_replication.
+            Batched engine keeps the structure of the scenario, so fleet sizes cannot be analysed with it
+        workers
+            Number of worker processes. Runs in the current process if 1
+        batch_size
+            Number of design points per batch
+        cache
+            Result cache shared between analyses. Give it a file path to keep results between runs
+        terminal_volumes
+            Optional terminal storage limits used for overflow metrics
+        """
+
+        if engine not in ENGINES:
+            raise AttributeError(f'No such engine: {engine}')
+        if len(parameters) == 0:
+            raise AttributeError('At least one parameter is needed')
+        self._paths = list(parameters.keys())
+        self._low = np.array([parameters[path][0] for path in self._paths], dtype=np.float64)
+        self._high = np.array([parameters[path][1] for path in self._paths], dtype=np.float64)
+        if np.any(self._high <= self._low):
+            raise AttributeError('Parameter ranges need high > low')
+        self._is_integer = np.array([isinstance(value, int) for value in parameter_values(scenario, self._paths)])
+
+        self._scenario = scenario
+        self._outputs = dict(outputs) if outputs is not None else dict(DEFAULT_OUTPUTS)
+        self._horizon_hours = horizon_hours
+        self._seeds = list(seeds) if seeds is not None else [0]
+        self._engine = engine
+        self._workers = workers
+        self._batch_size = batch_size
+        self._cache = cache if cache is not None else ResultCache()
+        self._terminal_volumes = terminal_volumes
+        self.simulated_hours = 0
+
+    @property
+    def parameter_paths(self) -> list[str]:
+        """list[str]: Parameter paths in the order of design columns. Read only"""
+        return list(self._paths)
+
+    def to_overrides(self, unit_point: np.ndarray) -> dict:
+        """ Overrides of a design point given in [0, 1] per parameter """
+
+        values = self._low + np.asarray(unit_point) * (self._high - self._low)
+        return dict((path, int(round(value)) if is_integer else float(value))
+                    for path, value, is_integer in zip(self._paths, values.tolist(), self._is_integer))
+
+    def evaluate(self, unit_points: np.ndarray) -> dict[str, np.ndarray]:
+        """ Outputs at design points given in [0, 1] per parameter, averaged over the seeds
+
+        Returns
+        -------
+        dict[str, np.ndarray]
+            Output name -> value per point
+        """
+
+        scenarios = [apply_overrides(self._scenario, self.to_overrides(point)) for point in unit_points]
+        executor = None
+        if self._workers != 1:
+            executor = ProcessPoolExecutor(max_workers=self._workers)
+        try:
+            if self._engine == 'modeler':
+                results = self.__evaluate_replications(scenarios, executor)
+            else:
+                results = self.__evaluate_batched(scenarios, executor)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        outputs = dict()
+        for name, output in self._outputs.items():
+            outputs[name] = np.array([np.mean([output(metrics) for metrics in point_results])
+                                      for point_results in results])
+        return outputs
+
+    def __evaluate_replications(self, scenarios: list[dict], executor) -> list[list[dict]]:
+        """ RunMetrics results of every scenario for every seed. The cache is updated after every batch """
+
+        results = []
+        for start in range(0, len(scenarios), self._batch_size):
+            jobs = [(scenario, seed) for scenario in scenarios[start:start + self._batch_size] for seed in self._seeds]
+            cache_size = len(self._cache)
+            batch_results = run_replications(jobs, self._horizon_hours, cache=self._cache, executor=executor,
+                                             terminal_volumes=self._terminal_volumes)
+            self.simulated_hours += (len(self._cache) - cache_size) * self._horizon_hours
+            seeds_num = len(self._seeds)
+            results.extend(batch_results[i:i + seeds_num] for i in range(0, len(batch_results), seeds_num))
+        return results
+
+    def __evaluate_batched(self, scenarios: list[dict], executor) -> list[list[dict]]:
+        """ RunMetrics results of every scenario for every seed. Missing results are simulated in batches of
+        batch_size scenarios with one seed, and the cache is updated as batches finish
+        """
+
+        keys = [[_batched_key(scenario, seed, self._horizon_hours, self._terminal_volumes)
+                 for seed in self._seeds] for scenario in scenarios]
+        tasks = []
+        for seed_id, seed in enumerate(self._seeds):
+            # Scenarios with equal parameters are simulated once
+            missing = dict()
+            for i, point_keys in enumerate(keys):
+                if point_keys[seed_id] not in self._cache and point_keys[seed_id] not in missing:
+                    missing[point_keys[seed_id]] = scenarios[i]
+            missing = list(missing.items())
+            for start in range(0, len(missing), self._batch_size):
+                tasks.append((missing[start:start + self._batch_size], seed))
+        args = [([scenario for _, scenario in batch], seed, self._horizon_hours, self._terminal_volumes)
+                for batch, seed in tasks]
+        if executor is None:
+            batch_results = (_run_batch(*arg) for arg in args)
+        else:
+            batch_results = executor.map(_run_batch, *zip(*args)) if len(args) > 0 else []
+        for (batch, _), results in zip(tasks, batch_results):
+            for (key, _), metrics in zip(batch, results):
+                self._cache.put(key, metrics)
+            self.simulated_hours += len(batch) * self._horizon_hours
+        return [[self._cache.get(key) for key in point_keys] for point_keys in keys]
+
+    def sobol(self, base_samples: int = 64, bootstrap: int = 200, confidence: float = 0.95, seed: int = 0) -> dict:
+        """ First-order and total Sobol indices estimated from a Saltelli design.
+
+        The design has two independent random matrices A and B of base_samples rows and, for every parameter,
+        A with the column of that parameter taken from B: base_samples * (parameters + 2) points. First-order
+        indices use the Saltelli (2010) estimator, total indices the Jansen estimator. Confidence intervals are
+        percentile intervals of bootstrap resamples of the rows
+
+        Parameters
+        ----------
+        base_samples
+            Number of rows of A and B
+        bootstrap
+            Number of bootstrap resamples
+        confidence
+            Confidence level
+        seed
+            Seed of the design and the bootstrap
+
+        Returns
+        -------
+        dict
+            <parameters> list: parameter paths
+            <outputs> dict: output name ->
+                <first_order> list: (index, lower bound, upper bound) per parameter
+                <total> list: (index, lower bound, upper bound) per parameter
+                <variance> float: output variance
+            <points> int: number of design points
+            <simulated_hours> int: simulated hours spent, excluding cached results
+        """
+
+        rnd = np.random.default_rng(seed)
+        d = len(self._paths)
+        a = rnd.random((base_samples, d))
+        b = rnd.random((base_samples, d))
+        ab = np.repeat(a[None, :, :], d, axis=0)
+        for i in range(d):
+            ab[i, :, i] = b[:, i]
+        points = np.concatenate([a, b, ab.reshape(d * base_samples, d)])
+        simulated_hours = self.simulated_hours
+        values = self.evaluate(points)
+
+        resamples = rnd.integers(0, base_samples, (bootstrap, base_samples))
+        outputs = dict()
+        for name, y in values.items():
+            y_a = y[:base_samples]
+            y_b = y[base_samples:2 * base_samples]
+            y_ab = y[2 * base_samples:].reshape(d, base_samples)
+            first_order, total = _sobol_indices(y_a, y_b, y_ab)
+            boot_first = np.empty((bootstrap, d))
+            boot_total = np.empty((bootstrap, d))
+            for r, rows in enumerate(resamples):
+                boot_first[r], boot_total[r] = _sobol_indices(y_a[rows], y_b[rows], y_ab[:, rows])
+            outputs[name] = {'first_order': _with_intervals(first_order, boot_first, confidence),
+                             'total': _with_intervals(total, boot_total, confidence),
+                             'variance': float(np.var(np.concatenate([y_a, y_b]), ddof=1))}
+        return {'parameters': list(self._paths),
+                'outputs': outputs,
+                'points': len(points),
+                'simulated_hours': self.simulated_hours - simulated_hours}
+
+    def morris(self, trajectories: int = 20, levels: int = 4, bootstrap: int = 200, confidence: float = 0.95,
+               seed: int = 0) -> dict:
+        """ Morris elementary effects screening.
+
+        Every trajectory starts at a random point of the grid with the given number of levels in [0, 1] and
+        moves one parameter at a time, in random order, by delta = levels / (2 * (levels - 1)):
+        trajectories * (parameters + 1) points. Effects are output changes per unit of the scaled parameter
+        range. Confidence intervals of mu* are percentile intervals of bootstrap resamples of trajectories
+
+        Parameters
+        ----------
+        trajectories
+            Number of trajectories
+        levels
+            Number of grid levels. Even numbers give symmetric steps, with odd numbers steps that leave [0, 1]
+            are cut at the bound and effects use the cut step
+        bootstrap
+            Number of bootstrap resamples
+        confidence
+            Confidence level
+        seed
+            Seed of the design and the bootstrap
+
+        Returns
+        -------
+        dict
+            <parameters> list: parameter paths
+            <outputs> dict: output name ->
+                <mu_star> list: (mean absolute effect, lower bound, upper bound) per parameter
+                <mu> list: mean effect per parameter
+                <sigma> list: standard deviation of effects per parameter
+            <points> int: number of design points
+            <simulated_hours> int: simulated hours spent, excluding cached results
+        """
+
+        if levels < 2:
+            raise AttributeError('At least 2 levels are needed')
+        rnd = np.random.default_rng(seed)
+        d = len(self._paths)
+        delta = levels / (2 * (levels - 1))
+        grid = np.arange(levels) / (levels - 1)
+        points = np.empty((trajectories, d + 1, d))
+        orders = np.empty((trajectories, d), dtype=np.int64)
+        for t in range(trajectories):
+            point = rnd.choice(grid, d)
+            # Step up from the lower half of the grid, down from the upper half
+            step = np.where(point + delta <= 1 + 1e-12, delta, -delta)
+            order = rnd.permutation(d)
+            points[t, 0] = point
+            for k, i in enumerate(order):
+                point = point.copy()
+                point[i] += step[i]
+                points[t, k + 1] = point
+            orders[t] = order
+        points = np.clip(points, 0, 1)
+        # Step of the parameter changed between consecutive points, as evaluated
+        steps = np.array([[points[t, k + 1, i] - points[t, k, i] for k, i in enumerate(orders[t])]
+                          for t in range(trajectories)])
+        simulated_hours = self.simulated_hours
+        values = self.evaluate(points.reshape(-1, d))
+
+        resamples = rnd.integers(0, trajectories, (bootstrap, trajectories))
+        outputs = dict()
+        for name, y in values.items():
+            y = y.reshape(trajectories, d + 1)
+            effects = np.empty((trajectories, d))
+            for t in range(trajectories):
+                effects[t, orders[t]] = (y[t, 1:] - y[t, :-1]) / steps[t]
+            mu_star = np.abs(effects).mean(axis=0)
+            boot_mu_star = np.array([np.abs(effects[rows]).mean(axis=0) for rows in resamples])
+            outputs[name] = {'mu_star': _with_intervals(mu_star, boot_mu_star, confidence),
+                             'mu': effects.mean(axis=0).tolist(),
+                             'sigma': (effects.std(axis=0, ddof=1) if trajectories > 1
+                                       else np.zeros(d)).tolist()}
+        return {'parameters': list(self._paths),
+                'outputs': outputs,
+                'points': trajectories * (d + 1),
+                'simulated_hours': self.simulated_hours - simulated_hours}
+
+
+def parameter_values(scenario: dict, paths: list[str]) -> list:
+    """ Values of the parameters in the scenario. Raises AttributeError for paths outside the init data schema """
+
+    values = []
+    for path in paths:
+        parts = path.split('/')
+        if len(parts) != 3:
+            raise AttributeError(f'Parameter path must have 3 parts: {path}')
+        section, selector, field = parts
+        if section in ['terminals', 'entrepots']:
+            matched = [param for param in scenario[section] if param['station_name'] == selector]
+        elif section == 'trains':
+            matched = [param for param in scenario['trains'] if selector in [param['name'], param['load_station_name']]]
+        elif section == 'distances':
+            matched = [{field: param['distance']} for param in scenario['distances']
+                       if {param['point_a_name'], param['point_b_name']} == {selector, field}]
+        elif section == 'routes' and field == 'fleet_size':
+            matched = [{field: sum(param['load_station_name'] == selector for param in scenario['trains'])}]
+        else:
+            raise AttributeError(f'No such scenario section: {section}')
+        if len(matched) == 0 or field not in matched[0]:
+            raise AttributeError(f'No such parameter: {path}')
+        values.append(matched[0][field])
+    return values
+
+
+def _batched_key(scenario: dict, seed: int, horizon_hours: int, terminal_volumes: dict[str, int]) -> str:
+    return f'batched:{replication_key(scenario, seed, horizon_hours, terminal_volumes)}'
+
+
+def _run_batch(scenarios: list[dict], seed: int, horizon_hours: int,
+               terminal_volumes: dict[str, int]) -> list[dict]:
+    """ RunMetrics results of the scenarios run with BatchedModeler and common production draws """
+
+    modeler = BatchedModeler(scenarios, STARTING_TIME, STARTING_TIME + timedelta(hours=horizon_hours),
+                             np.random.default_rng(seed), terminal_volumes=terminal_volumes, common_draws=True)
+    modeler.simulate()
+    result = modeler.result()
+    return [{'steps': result['steps'],
+             'delivered_oil': int(result['delivered_oil'][i]),
+             'shipped_oil': int(result['shipped_oil'][i]),
+             'overflow_oil': float(result['overflow_oil'][i]),
+             'overflow_steps': int(result['overflow_steps'][i]),
+             'stockout_steps': int(result['stockout_steps'][i]),
+             'departures': int(result['departures'][i]),
+             'peak_oil': dict((name, float(peaks[i])) for name, peaks in result['peak_oil'].items())}
+            for i in range(len(scenarios))]
+
+
+def _sobol_indices(y_a: np.ndarray, y_b: np.ndarray, y_ab: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    variance = np.var(np.concatenate([y_a, y_b]))
+    if variance == 0:
+        return np.zeros(len(y_ab)), np.zeros(len(y_ab))
+    first_order = (y_b * (y_ab - y_a)).mean(axis=1) / variance
+    total = 0.5 * ((y_a - y_ab) ** 2).mean(axis=1) / variance
+    return first_order, total
+
+
+def _with_intervals(estimate: np.ndarray, resamples: np.ndarray, confidence: float) -> list[tuple[float, float, float]]:
+    low = np.percentile(resamples, 100 * (1 - confidence) / 2, axis=0)
+    high = np.percentile(resamples, 100 * (1 + confidence) / 2, axis=0)
+    return list(zip(estimate.tolist(), low.tolist(), high.tolist()))
+
+
+def format_indices(report: dict) -> str:
+    """ Formats sobol or morris result as text tables """
+
+    lines = []
+    for name, output in report['outputs'].items():
+        lines.append(name)
+        if 'first_order' in output:
+            lines.append(f'{"parameter":<44}{"S1":>8}{"S1 CI":>18}{"ST":>8}{"ST CI":>18}')
+            for path, first, total in zip(report['parameters'], output['first_order'], output['total']):
+                lines.append(f'{path:<44}{first[0]:>8.3f}{f"[{first[1]:.2f}, {first[2]:.2f}]":>18}'
+                             f'{total[0]:>8.3f}{f"[{total[1]:.2f}, {total[2]:.2f}]":>18}')
+        else:
+            lines.append(f'{"parameter":<44}{"mu*":>12}{"mu* CI":>26}{"sigma":>12}')
+            for path, mu_star, sigma in zip(report['parameters'], output['mu_star'], output['sigma']):
+                lines.append(f'{path:<44}{mu_star[0]:>12.1f}{f"[{mu_star[1]:.1f}, {mu_star[2]:.1f}]":>26}'
+                             f'{sigma:>12.1f}')
+        lines.append('')
+    lines.append(f'{report["points"]} points, {report["simulated_hours"]} simulated hours')
+    return '\n'.join(lines)
@@ -0,0 +1,317 @@
+import json
+import math
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+import numpy as np
+
+from analysis.gaussian_process import GaussianProcess
+from analysis.replication import STARTING_TIME
+from analysis.result_cache import ResultCache
+from analysis.run_metrics import RunMetrics
+from analysis.sensitivity import parameter_values
+from event_logic.event_bus import EventBus
+from event_logic.event_type import EventType
+from event_logic.transition_event import TransitionEvent
+from scenario.scenario_builder import apply_overrides, build_modeler, scenario_key
+from station_logic.production_random import create_production_rngs
+
+OUTPUTS = ('delivered_oil', 'mean_queue_wait', 'overflow_probability')
+
+
+class _QueueWaits:
+    """ Hours from queueing to admission of every admitted train. Trains admitted on arrival wait 0 hours """
+
+    def __init__(self, event_bus: EventBus):
+        self._queued = dict()
+        self.waits = []
+        event_bus.subscribe(EventType.Queued, self.__on_queued)
+        event_bus.subscribe(EventType.Admitted, self.__on_admitted)
+
+    def __on_queued(self, event: TransitionEvent):
+        self._queued[event.train_name] = event.time
+
+    def __on_admitted(self, event: TransitionEvent):
+        queued = self._queued.pop(event.train_name, event.time)
+        self.waits.append((event.time - queued).total_seconds() / 3600)
+
+
+def simulate_outputs(scenario: dict, seeds: list[int], horizon_hours: int,
+                     terminal_volumes: dict[str, int] = None) -> dict:
+    """ Runs replications of the scenario with Modeler and returns the surrogate outputs
+
+    Returns
+    -------
+    dict
+        <outputs> dict: output name -> mean over replications:
+            delivered_oil - oil unloaded at entrepots,
+            mean_queue_wait - mean hours from arrival to admission of admitted trains,
+            overflow_probability - share of replications with a station above its storage volume
+        <errors> dict: output name -> standard error of the mean
+    """
+
+    values = dict((name, []) for name in OUTPUTS)
+    for seed in seeds:
+        rngs = create_production_rngs(seed, [param['station_name'] for param in scenario['terminals']])
+        metrics = RunMetrics.for_scenario(scenario, terminal_volumes)
+        event_bus = EventBus()
+        queue_waits = _QueueWaits(event_bus)
+        modeler = build_modeler(scenario, STARTING_TIME, STARTING_TIME + timedelta(hours=horizon_hours),
+                                logger=metrics, production_rngs=rngs, event_bus=event_bus)
+        modeler.simulate()
+        result = metrics.result()
+        values['delivered_oil'].append(result['delivered_oil'])
+        values['mean_queue_wait'].append(float(np.mean(queue_waits.waits)) if len(queue_waits.waits) > 0 else 0.0)
+        values['overflow_probability'].append(1.0 if result['overflow_steps'] > 0 else 0.0)
+
+    outputs = dict((name, float(np.mean(samples))) for name, samples in values.items())
+    errors = dict((name, float(np.std(samples, ddof=1) / math.sqrt(len(samples))) if len(samples) > 1 else math.nan)
+                  for name, samples in values.items())
+    return {'outputs': outputs, 'errors': errors}
+
+
+class Surrogate:
+    """ Gaussian process emulator of simulation outputs over a box of scenario parameters.
+
+    Parameters are declared by apply_overrides paths with ranges, like in SensitivityAnalysis. Training points
+    are simulated with Modeler and kept in the result cache, so an emulator with the same scenario, parameters,
+    seeds and horizon starts from the stored runs. Active learning adds runs where the emulator is least certain.
+    Queries inside the box are answered by the emulator in about a millisecond, queries outside it or with other
+    parameters are simulated
+    """
+
+    def __init__(self,
+                 scenario: dict,
+                 parameters: dict[str, tuple[float, float]],
+                 horizon_hours: int = 24 * 30,
+                 seeds: list[int] = None,
+                 workers: int = None,
+                 cache: ResultCache = None,
+                 terminal_volumes: dict[str, int] = None):
+        """
+        Parameters
+        ----------
+        scenario
+            Base scenario parameters in the init data format
+        parameters
+            Parameter path (see apply_overrides) -> (low, high). Parameters with integer values in the scenario
+            stay integer
+        horizon_hours
+            Simulation length of one replication in hours
+        seeds
+            Seeds of replications averaged per point. 5 seeds if None
+        workers
+            Number of worker processes for training runs. Runs in the current process if 1
+        cache
+            Result cache. Give it a file path to keep training runs between sessions
+        terminal_volumes
+            Optional terminal storage limits used for overflow
+        """
+
+        if len(parameters) == 0:
+            raise AttributeError('At least one parameter is needed')
+        self._scenario = scenario
+        self._paths = list(parameters.keys())
+        self._low = np.array([parameters[path][0] for path in self._paths], dtype=np.float64)
+        self._high = np.array([parameters[path][1] for path in self._paths], dtype=np.float64)
+        if np.any(self._high <= self._low):
+            raise AttributeError('Parameter ranges need high > low')
+        base_values = parameter_values(scenario, self._paths)
+        self._base_values = dict(zip(self._paths, base_values))
+        self._is_integer = [isinstance(value, int) for value in base_values]
+        # Rounded integer values are kept inside the box
+        self._integer_low = np.ceil(self._low)
+        self._integer_high = np.floor(self._high)
+        if any(is_integer and low > high
+               for is_integer, low, high in zip(self._is_integer, self._integer_low, self._integer_high)):
+            raise AttributeError('Ranges of integer parameters need an integer value inside')
+        self._horizon_hours = horizon_hours
+        self._seeds = list(seeds) if seeds is not None else list(range(5))
+        self._workers = workers
+        self._cache = cache if cache is not None else ResultCache()
+        self._terminal_volumes = terminal_volumes
+        self._signature = ':'.join([scenario_key(scenario), json.dumps(self._seeds), str(horizon_hours),
+                                    json.dumps(terminal_volumes, sort_keys=True, ensure_ascii=False)])
+
+        self._x = []
+        self._y = []
+        # Cache keys of the training points
+        self._keys = set()
+        self._models = None
+        self.simulated_hours = 0
+        # Stored runs of the same emulator
+        for key, record in self._cache.items():
+            if (isinstance(record, dict) and record.get('signature') == self._signature
+                    and set(record['overrides']) == set(self._paths)):
+                x = self.__to_unit(record['overrides'])
+                if x is not None:
+                    self._x.append(x)
+                    self._y.append([record['outputs'][name] for name in OUTPUTS])
+                    self._keys.add(key)
+
+    @property
+    def points_num(self) -> int:
+        """int: Number of training points. Read only"""
+        return len(self._x)
+
+    def __to_unit(self, overrides: dict) -> np.ndarray:
+        """ Point of the overrides in [0, 1] per parameter, None if it is outside the box """
+
+        if any(path not in self._base_values for path in overrides):
+            return None
+        values = np.array([overrides.get(path, self._base_values[path]) for path in self._paths], dtype=np.float64)
+        if np.any(values < self._low) or np.any(values > self._high):
+            return None
+        return (values - self._low) / (self._high - self._low)
+
+    def __to_overrides(self, unit_point: np.ndarray) -> dict:
+        values = self._low + np.asarray(unit_point) * (self._high - self._low)
+        rounded = np.clip(np.round(values), self._integer_low, self._integer_high)
+        return dict((path, int(rounded_value) if is_integer else float(value))
+                    for path, value, rounded_value, is_integer
+                    in zip(self._paths, values.tolist(), rounded.tolist(), self._is_integer))
+
+    def __point_key(self, overrides: dict) -> str:
+        return f'surrogate:{self._signature}:{json.dumps(overrides, sort_keys=True, ensure_ascii=False)}'
+
+    def add_runs(self, unit_points: np.ndarray):
+        """ Simulates the points given in [0, 1] per parameter and adds them to the training data.
+        Stored runs are not repeated, and points that are already in the training data, also after rounding
+        integer parameters, are not added again. Call fit afterwards
+        """
+
+        overrides = [self.__to_overrides(point) for point in unit_points]
+        missing = dict()
+        for point_overrides in overrides:
+            key = self.__point_key(point_overrides)
+            if key not in self._cache and key not in missing:
+                missing[key] = point_overrides
+        scenarios = [apply_overrides(self._scenario, point_overrides) for point_overrides in missing.values()]
+        args = [(scenario, self._seeds, self._horizon_hours, self._terminal_volumes) for scenario in scenarios]
+        if self._workers == 1 or len(args) <= 1:
+            results = [simulate_outputs(*arg) for arg in args]
+        else:
+            with ProcessPoolExecutor(max_workers=self._workers) as executor:
+                results = list(executor.map(simulate_outputs, *zip(*args)))
+        for (key, point_overrides), result in zip(missing.items(), results):
+            self._cache.put(key, dict(result, signature=self._signature, overrides=point_overrides))
+        self.simulated_hours += len(missing) * len(self._seeds) * self._horizon_hours
+
+        for point_overrides in overrides:
+            key = self.__point_key(point_overrides)
+            if key in self._keys:
+                continue
+            record = self._cache.get(key)
+            # Rounded integer parameters move the point, so the simulated values are used
+            self._x.append(self.__to_unit(point_overrides))
+            self._y.append([record['outputs'][name] for name in OUTPUTS])
+            self._keys.add(key)
+
+    def fit(self):
+        """ Fits an emulator per output to the training data """
+
+        x = np.array(self._x)
+        y = np.array(self._y)
+        self._models = [GaussianProcess().fit(x, y[:, i]) for i in range(len(OUTPUTS))]
+
+    def train(self, initial_points: int = 20, seed: int = 0):
+        """ Simulates a Latin hypercube design and fits the emulator
+
+        Parameters
+        ----------
+        initial_points
+            Number of design points
+        seed
+            Seed of the design
+        """
+
+        rnd = np.random.default_rng(seed)
+        d = len(self._paths)
+        # Every parameter has one point in each of initial_points equal intervals
+        strata = np.column_stack([rnd.permutation(initial_points) for _ in range(d)])
+        self.add_runs((strata + rnd.random((initial_points, d))) / initial_points)
+        self.fit()
+
+    def uncertainty(self, unit_points: np.ndarray) -> np.ndarray:
+        """ Sum over outputs of the predictive standard deviation relative to the spread of training outputs """
+
+        if self._models is None:
+            raise AttributeError('Surrogate is not trained')
+        scales = np.array(self._y).std(axis=0)
+        total = np.zeros(len(unit_points))
+        for model, scale in zip(self._models, scales):
+            if scale > 0:
+                total += model.predict(unit_points)[1] / scale
+        return total
+
+    def improve(self, rounds: int = 5, batch_size: int = 4, candidates: int = 2000, seed: int = 0) -> list[float]:
+        """ Active learning: every round simulates the candidate points where the emulator is least certain
+        and refits it. Points of a batch are kept apart by discounting the uncertainty near the chosen points
+
+        Parameters
+        ----------
+        rounds
+            Number of rounds
+        batch_size
+            Number of runs per round
+        candidates
+            Number of random candidate points per round
+        seed
+            Seed of the candidates
+
+        Returns
+        -------
+        list[float]
+            Largest uncertainty among the candidates before every round
+        """
+
+        rnd = np.random.default_rng(seed)
+        d = len(self._paths)
+        history = []
+        for _ in range(rounds):
+            points = rnd.random((candidates, d))
+            scores = self.uncertainty(points)
+            history.append(float(scores.max()))
+            length_scales = np.exp(np.mean([np.log(model.length_scales) for model in self._models], axis=0))
+            chosen = []
+            for _ in range(batch_size):
+                i = int(np.argmax(scores))
+                chosen.append(points[i])
+                distances = (((points - points[i]) / length_scales) ** 2).sum(axis=1)
+                scores = scores * (1 - np.exp(-0.5 * distances))
+            self.add_runs(np.array(chosen))
+            self.fit()
+        return history
+
+    def predict(self, overrides: dict) -> dict:
+        """ Outputs of the scenario with the overrides. Parameters that are not given keep their base values
+
+        Parameters
+        ----------
+        overrides
+            Mapping of parameter path to value
+
+        Returns
+        -------
+        dict
+            <source> str: 'surrogate', or 'simulation' if the point is outside the trained box
+            <outputs> dict: output name -> (value, standard deviation). The deviation is the emulator uncertainty,
+                or the standard error over the seeds for simulated points
+        """
+
+        x = self.__to_unit(overrides)
+        if x is None or self._models is None:
+            result = simulate_outputs(apply_overrides(self._scenario, overrides), self._seeds, self._horizon_hours,
+                                      self._terminal_volumes)
+            self.simulated_hours += len(self._seeds) * self._horizon_hours
+            return {'source': 'simulation',
+                    'outputs': dict((name, (result['outputs'][name], result['errors'][name])) for name in OUTPUTS)}
+
+        outputs = dict()
+        for name, model in zip(OUTPUTS, self._models):
+            mean, std = model.predict(x[None, :])
+            value = max(float(mean[0]), 0.0)
+            if name == 'overflow_probability':
+                value = min(value, 1.0)
+            outputs[name] = (value, float(std[0]))
+        return {'source': 'surrogate', 'outputs': outputs}
@@ -0,0 +1,145 @@
+import math
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
+from statistics import mean, variance
+from typing import Callable, Union
+
+from analysis.estimators import confidence_interval
+from analysis.replication import run_replications
+from analysis.result_cache import ResultCache
+
+# Seed offset of the second scenario when random numbers are not shared
+INDEPENDENT_SEED_OFFSET = 1_000_000
+
+
+def compare_scenarios(scenario_a: dict,
+                      scenario_b: dict,
+                      replications: int,
+                      horizon_hours: int = 24 * 30,
+                      metric: Union[str, Callable[[dict], float]] = 'delivered_oil',
+                      common_random_numbers: bool = True,
+                      antithetic: bool = False,
+                      control_variate: bool = False,
+                      confidence: float = 0.95,
+                      workers: int = None,
+                      cache: ResultCache = None) -> dict:
+    """ Estimates the difference of a metric between two scenarios (A - B)
+
+    Parameters
+    ----------
+    scenario_a
+        First scenario parameters in the init data format
+    scenario_b
+        Second scenario parameters in the init data format
+    replications
+        Number of replications per scenario. Each antithetic pair counts as one replication
+    horizon_hours
+        Simulation length in hours
+    metric
+        RunMetrics result key or function of RunMetrics result
+    common_random_numbers
+        Run both scenarios with the same production streams
+    antithetic
+        Average every replication with its antithetic twin
+    control_variate
+        Adjust observations by the sum of standard normal production draws, whose expectation is 0
+    confidence
+        Confidence level
+    workers
+        Number of worker processes. Runs in the current process if 1
+    cache
+        Result cache
+
+    Returns
+    -------
+    dict
+        <a> tuple: mean of A with confidence bounds
+        <b> tuple: mean of B with confidence bounds
+        <difference> tuple: mean of A - B with confidence bounds
+        <efficiency> float: variance of independent sampling divided by the achieved variance of the difference,
+            i.e. how many times fewer runs are needed for the same precision. Inf if only the difference has
+            no variance, nan if both have none
+        <runs> int: number of simulation runs
+    """
+
+    if replications < 2:
+        raise AttributeError('At least 2 replications are needed')
+    if isinstance(metric, str):
+        metric = itemgetter(metric)
+
+    seeds_a = list(range(replications))
+    seeds_b = seeds_a if common_random_numbers else [seed + INDEPENDENT_SEED_OFFSET for seed in seeds_a]
+    jobs = [(scenario_a, seed) for seed in seeds_a] + [(scenario_b, seed) for seed in seeds_b]
+
+    executor = None
+    if workers != 1:
+        executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        results = run_replications(jobs, horizon_hours, cache=cache, executor=executor)
+        runs = len(jobs)
+        if antithetic:
+            twins = run_replications(jobs, horizon_hours, cache=cache, executor=executor, antithetic=True)
+            runs += len(jobs)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    values = [metric(metrics) for metrics in results]
+    controls = [metrics['production_control'] for metrics in results]
+    if antithetic:
+        values = [(x + y) / 2 for x, y in zip(values, [metric(metrics) for metrics in twins])]
+        controls = [(x + y) / 2 for x, y in zip(controls, [metrics['production_control'] for metrics in twins])]
+
+    values_a, values_b = values[:replications], values[replications:]
+    controls_a, controls_b = controls[:replications], controls[replications:]
+    diffs = [a - b for a, b in zip(values_a, values_b)]
+    if control_variate:
+        values_a = _control_adjusted(values_a, controls_a)
+        values_b = _control_adjusted(values_b, controls_b)
+        diffs = _control_adjusted(diffs, controls_a)
+        if not common_random_numbers:
+            # Independent streams give the difference a second control
+            diffs = _control_adjusted(diffs, controls_b)
+
+    # Variance of a single difference if the runs were independent and without variance reduction
+    raw_a = [metric(metrics) for metrics in results[:replications]]
+    raw_b = [metric(metrics) for metrics in results[replications:]]
+    naive_variance = variance(raw_a) + variance(raw_b)
+    # Achieved variance per simulation run spent on the difference
+    runs_per_replication = 4 if antithetic else 2
+    achieved_variance = variance(diffs) * runs_per_replication / 2
+    if achieved_variance > 0:
+        efficiency = naive_variance / achieved_variance
+    else:
+        efficiency = math.inf if naive_variance > 0 else math.nan
+
+    return {'a': confidence_interval(values_a, confidence),
+            'b': confidence_interval(values_b, confidence),
+            'difference': confidence_interval(diffs, confidence),
+            'efficiency': efficiency,
+            'runs': runs}
+
+
+def _control_adjusted(values: list[float], controls: list[float]) -> list[float]:
+    """ Subtracts the control variate part from observations. Control expectation must be 0 """
+
+    control_variance = variance(controls)
+    if control_variance == 0:
+        return list(values)
+    avg_value = mean(values)
+    avg_control = mean(controls)
+    covariance = sum((v - avg_value) * (c - avg_control)
+                     for v, c in zip(values, controls)) / (len(values) - 1)
+    beta = covariance / control_variance
+    return [v - beta * c for v, c in zip(values, controls)]
+
+
+def format_comparison(report: dict) -> str:
+    """ Formats compare_scenarios result as a text table """
+
+    lines = [f'{"":<12}{"mean":>14}{"lower":>14}{"upper":>14}']
+    for name, key in [('A', 'a'), ('B', 'b'), ('A - B', 'difference')]:
+        avg, low, high = report[key]
+        lines.append(f'{name:<12}{avg:>14.1f}{low:>14.1f}{high:>14.1f}')
+    lines.append(f'runs: {report["runs"]}, efficiency vs. independent runs: {report["efficiency"]:.1f}x')
+    return '\n'.join(lines)
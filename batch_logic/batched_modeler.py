@@ -0,0 +1,527 @@
+import math
+from datetime import datetime, timedelta
+from typing import Iterator
+
+import numpy as np
+
+from scenario.scenario_builder import apply_overrides
+from snapshot_logic.snapshot_buffer import SnapshotBuffer, NO_TRAIN, UNLOADER_TRAIN
+from train_logic.train_direction import TrainDirection
+from train_logic.train_state import TrainState
+
+# Train id of the track of an unloader train and of a free track in the batched arrays
+_NO_TRAIN = -1
+_UNLOADER = -2
+
+_WAIT = TrainState.Wait.value
+_READY = TrainState.Ready.value
+_TRANSIT = TrainState.Transit.value
+_ARRIVED = TrainState.Arrived.value
+_IN_CARGO = TrainState.In_cargo_process.value
+_TO_LOAD = TrainDirection.To_load_station.value
+_TO_UNLOAD = TrainDirection.To_unload_station.value
+
+
+class BatchedModeler:
+    """ Runs many variants of one railway system in lockstep, with the scenario index as the first dimension
+    of every state array.
+
+    Variants must have the same terminals, entrepots and trains with the same routes. Everything else may
+    differ between them: velocities and storage volumes of trains, distances, speeds, storage volumes and
+    unload limits of entrepots, production mean and std of terminals, initial state and numbers of entrepot tracks.
+
+    Every tick follows TrainManager with VectorizedStationManager exactly for each variant: trains are
+    processed in their order, arrived trains try their stations and wait in FIFO queues, queues are served
+    in the station order, then stations mine, load and unload. The Python loops go over trains and stations,
+    never over variants, so a tick costs about the same for one variant or a few hundred. Terminals have one
+    track, and steps are whole hours
+    """
+
+    def __init__(self, scenarios: list[dict], starting_time: datetime, end_time: datetime,
+                 rng=None, step: int = 1, terminal_volumes: dict[str, int] = None, common_draws: bool = False):
+        """
+        Parameters
+        ----------
+        scenarios
+            Scenario variants in the init data format
+        starting_time
+            Starting time of simulation
+        end_time
+            End time of simulation
+        rng
+            Random generator of oil production shared by the variants, or a list with a generator per variant.
+            A variant with its own generator draws the same numbers as VectorizedStationManager with it
+        step
+            Simulation step length in whole hours
+        terminal_volumes
+            Optional terminal storage limits used for overflow metrics, same as RunMetrics
+        common_draws
+            All variants draw the same production numbers from the shared generator, as if each had its own copy
+            of it. Results of a variant then do not depend on the other variants of the batch
+        """
+
+        if len(scenarios) == 0:
+            raise AttributeError('At least one scenario is needed')
+        if step != int(step) or step < 1:
+            raise AttributeError('Only whole hour steps are supported')
+        base = scenarios[0]
+        self._terminal_names = [param['station_name'] for param in base['terminals']]
+        self._entrepot_names = [param['station_name'] for param in base['entrepots']]
+        self._train_names = [param['name'] for param in base['trains']]
+        routes = [(param['load_station_name'], param['unload_station_name']) for param in base['trains']]
+        for scenario in scenarios:
+            if ([param['station_name'] for param in scenario['terminals']] != self._terminal_names
+                    or [param['station_name'] for param in scenario['entrepots']] != self._entrepot_names
+                    or [param['name'] for param in scenario['trains']] != self._train_names
+                    or [(param['load_station_name'], param['unload_station_name'])
+                        for param in scenario['trains']] != routes):
+                raise AttributeError('Scenarios must have the same stations, trains and routes')
+            if any(param['tracks_num'] != 1 for param in scenario['terminals']):
+                raise AttributeError('Only one track per terminal is supported')
+
+        self._scenarios_num = len(scenarios)
+        self._starting_time = starting_time
+        self._simulation_time = starting_time
+        self._end_time = end_time
+        self._step = int(step)
+        if isinstance(rng, list):
+            if len(rng) != len(scenarios):
+                raise AttributeError('Need one random generator per scenario')
+            self._rngs = rng
+            self._rng = None
+        else:
+            self._rngs = None
+            self._rng = rng if rng is not None else np.random.default_rng()
+        self._common_draws = common_draws
+
+        def column(section: str, field: str, dtype) -> np.ndarray:
+            return np.array([[param[field] for param in scenario[section]] for scenario in scenarios],
+                            dtype=dtype).reshape(len(scenarios), len(base[section]))
+
+        # Terminals: (scenario, terminal)
+        n = len(self._terminal_names)
+        self._t_oil = column('terminals', 'oil_volume', np.int64)
+        self._t_emptying_speed = column('terminals', 'emptying_speed', np.int64)
+        self._t_mean_prod_speed = column('terminals', 'mean_prod_speed', np.float64)
+        self._t_std_prod_speed = column('terminals', 'std_prod_speed', np.float64)
+        self._t_last_oil_mined = np.zeros_like(self._t_oil)
+        self._t_has_mined = False
+        self._t_last_oil_given = np.zeros_like(self._t_oil)
+        self._t_has_given = np.zeros(self._t_oil.shape, dtype=bool)
+        self._t_train = np.full(self._t_oil.shape, _NO_TRAIN, dtype=np.int64)
+        self._t_train_oil = np.zeros_like(self._t_oil)
+        self._t_train_storage = np.zeros_like(self._t_oil)
+
+        # Entrepots: (scenario, entrepot), tracks (scenario, entrepot, track) padded to the maximum number
+        m = len(self._entrepot_names)
+        self._e_oil = column('entrepots', 'oil_volume', np.int64)
+        self._e_emptying_speed = column('entrepots', 'emptying_speed', np.int64)
+        self._e_filling_speed = column('entrepots', 'filling_speed', np.int64)
+        self._e_storage_volume = column('entrepots', 'storage_volume', np.int64)
+        self._e_unload_limit = column('entrepots', 'unload_limit', np.int64)
+        tracks_nums = column('entrepots', 'tracks_num', np.int64)
+        k = int(tracks_nums.max(initial=0))
+        self._e_track_exists = np.arange(k)[None, None, :] < tracks_nums[:, :, None]
+        self._e_has_unloader = np.zeros(self._e_oil.shape, dtype=bool)
+        self._e_train = np.full((len(scenarios), m, k), _NO_TRAIN, dtype=np.int64)
+        self._e_train_oil = np.zeros((len(scenarios), m, k), dtype=np.int64)
+        self._e_train_storage = np.zeros((len(scenarios), m, k), dtype=np.int64)
+        self._e_last_collected = np.zeros((len(scenarios), m, k), dtype=np.int64)
+        self._e_has_collected = np.zeros((len(scenarios), m, k), dtype=bool)
+        # Tracks where unloader trains were loaded during the last step
+        self._e_collected_unloader = np.zeros((len(scenarios), m, k), dtype=bool)
+
+        # Trains: (scenario, train). Oil of trains on tracks is kept in the track arrays until departure
+        terminal_ids = dict((name, i) for i, name in enumerate(self._terminal_names))
+        entrepot_ids = dict((name, i) for i, name in enumerate(self._entrepot_names))
+        self._load_station = np.array([terminal_ids[load] for load, _ in routes], dtype=np.int64)
+        self._unload_station = np.array([entrepot_ids[unload] for _, unload in routes], dtype=np.int64)
+        self._velocity = column('trains', 'velocity', np.float64)
+        self._storage_volume = column('trains', 'storage_volume', np.int64)
+        self._coord = column('trains', 'coord', np.float64)
+        self._state = column('trains', 'state', np.int8)
+        self._direction = column('trains', 'direction', np.int8)
+        self._oil = column('trains', 'oil_volume', np.int64)
+        self._distance = np.empty(self._coord.shape, dtype=np.float64)
+        for s, scenario in enumerate(scenarios):
+            distances = dict()
+            for param in scenario['distances']:
+                distances[(param['point_a_name'], param['point_b_name'])] = param['distance']
+                distances[(param['point_b_name'], param['point_a_name'])] = param['distance']
+            self._distance[s] = [distances[route] for route in routes]
+        self._cargo_time = np.full(self._coord.shape, -1.0)
+        self._departed_cargo_time = np.full(self._coord.shape, math.nan)
+        # Queue tickets: trains wait in the order of their tickets, -1 if the train is not queued
+        self._ticket = np.full(self._coord.shape, -1, dtype=np.int64)
+        self._next_ticket = 0
+        self._queued_hours = np.zeros(self._coord.shape)
+        self._scenario_ids = np.arange(len(scenarios))
+
+        # Metrics, same definitions as RunMetrics
+        volumes = dict(terminal_volumes) if terminal_volumes is not None else dict()
+        self._t_volume = np.array([volumes.get(name, math.inf) for name in self._terminal_names], dtype=np.float64)
+        self._steps = 0
+        self._delivered_oil = np.zeros(len(scenarios), dtype=np.int64)
+        self._shipped_oil = np.zeros(len(scenarios), dtype=np.int64)
+        self._overflow_oil = np.zeros(len(scenarios), dtype=np.float64)
+        self._overflow_steps = np.zeros(len(scenarios), dtype=np.int64)
+        self._stockout_steps = np.zeros(len(scenarios), dtype=np.int64)
+        self._departures = np.zeros(len(scenarios), dtype=np.int64)
+        self._peak_oil = np.full((len(scenarios), n + m), -math.inf)
+
+    @classmethod
+    def from_variants(cls, scenario: dict, overrides: list[dict], starting_time: datetime, end_time: datetime,
+                      rng=None, step: int = 1, terminal_volumes: dict[str, int] = None,
+                      common_draws: bool = False) -> 'BatchedModeler':
+        """ Batch of variants of the scenario, one per overrides dict in the apply_overrides format.
+        Fleet sizes must not change
+        """
+
+        return cls([apply_overrides(scenario, override) for override in overrides], starting_time, end_time,
+                   rng, step, terminal_volumes, common_draws)
+
+    @property
+    def scenarios_num(self) -> int:
+        """int: Number of scenario variants. Read only"""
+        return self._scenarios_num
+
+    @property
+    def simulation_time(self) -> datetime:
+        """datetime: Time of the next step. Read only"""
+        return self._simulation_time
+
+    def __enqueue(self, rows: np.ndarray, j: int):
+        self._state[rows, j] = _WAIT
+        self._ticket[rows, j] = self._next_ticket
+        self._next_ticket += 1
+        self._queued_hours[rows, j] = 0
+
+    def __terminal_can_add(self, rows: np.ndarray, i: int, storage: np.ndarray) -> np.ndarray:
+        """ Same preliminary simulation as Terminal for the train storage volumes of the rows """
+
+        oil = self._t_oil[rows, i]
+        emptying_speed = self._t_emptying_speed[rows, i]
+        sum_speed = self._t_mean_prod_speed[rows, i] - emptying_speed
+        has_steps = oil // np.where(sum_speed < 0, np.abs(sum_speed), 1)
+        need_steps = -(-storage // emptying_speed)
+        return ((self._t_train[rows, i] == _NO_TRAIN)
+                & ((oil >= storage) | (sum_speed >= 0) | (has_steps >= need_steps)))
+
+    def __entrepot_can_add(self, rows: np.ndarray, i: int, train_oil: np.ndarray) -> np.ndarray:
+        """ Same preliminary simulation as Entrepot for the train oil volumes of the rows """
+
+        occupied = self._e_train[rows, i] != _NO_TRAIN
+        free_tracks_num = (self._e_track_exists[rows, i] & ~occupied).sum(axis=1)
+        tracks_oil = np.where(occupied, self._e_train_oil[rows, i], 0).sum(axis=1)
+        sum_oil_volume = self._e_oil[rows, i] + train_oil + tracks_oil
+        needs_two_tracks = ((sum_oil_volume >= self._e_unload_limit[rows, i]) & ~self._e_has_unloader[rows, i]
+                            & (free_tracks_num < 2))
+        return (free_tracks_num > 0) & (sum_oil_volume <= self._e_storage_volume[rows, i]) & ~needs_two_tracks
+
+    def __add_trains(self, rows: np.ndarray, j: np.ndarray, to_load: np.ndarray) -> np.ndarray:
+        """ Tries to add train j[r] of every row to its station: terminal if to_load[r], entrepot otherwise
+
+        Returns
+        -------
+        np.ndarray
+            Mask of added trains
+        """
+
+        is_added = np.zeros(len(rows), dtype=bool)
+        for i in np.unique(self._load_station[j[to_load]]).tolist():
+            where = np.flatnonzero(to_load & (self._load_station[j] == i))
+            rs, js = rows[where], j[where]
+            storage = self._storage_volume[rs, js]
+            can_add = self.__terminal_can_add(rs, i, storage)
+            rs, js = rs[can_add], js[can_add]
+            self._t_train[rs, i] = js
+            self._t_train_oil[rs, i] = self._oil[rs, js]
+            self._t_train_storage[rs, i] = storage[can_add]
+            self._state[rs, js] = _IN_CARGO
+            is_added[where[can_add]] = True
+        for i in np.unique(self._unload_station[j[~to_load]]).tolist():
+            where = np.flatnonzero(~to_load & (self._unload_station[j] == i))
+            rs, js = rows[where], j[where]
+            # Every variant adds at most one train to the entrepot at once, so tracks are taken one by one
+            train_oil = self._oil[rs, js]
+            can_add = self.__entrepot_can_add(rs, i, train_oil)
+            rs, js = rs[can_add], js[can_add]
+            # First free track
+            track = np.argmax(self._e_track_exists[rs, i] & (self._e_train[rs, i] == _NO_TRAIN), axis=1)
+            self._e_train[rs, i, track] = js
+            self._e_train_oil[rs, i, track] = train_oil[can_add]
+            self._e_train_storage[rs, i, track] = self._storage_volume[rs, js]
+            self._state[rs, js] = _IN_CARGO
+            is_added[where[can_add]] = True
+        return is_added
+
+    def __update_trains(self, hours: int):
+        """ Same as TrainManager.update for every variant """
+
+        state = self._state
+        self._departed_cargo_time.fill(math.nan)
+        self._cargo_time[state == _IN_CARGO] += hours
+
+        # Departures do not depend on other trains
+        is_ready = state == _READY
+        if is_ready.any():
+            self._direction[is_ready] = np.where(self._direction[is_ready] == _TO_LOAD, _TO_UNLOAD, _TO_LOAD)
+            state[is_ready] = _TRANSIT
+            self._coord[is_ready] = self._distance[is_ready]
+            self._departed_cargo_time[is_ready] = self._cargo_time[is_ready] + hours
+            self._cargo_time[is_ready] = -1
+            self._departures += is_ready.sum(axis=1)
+
+        # Arrivals change stations and queues, so trains go in their order
+        for j in np.flatnonzero((state == _ARRIVED).any(axis=0)).tolist():
+            rows = np.flatnonzero(state[:, j] == _ARRIVED)
+            to_load = self._direction[rows, j] == _TO_LOAD
+            # Trains whose destination is the station of train j
+            directions = self._direction[rows]
+            station_trains = np.where(to_load[:, None],
+                                      (directions == _TO_LOAD) & (self._load_station == self._load_station[j]),
+                                      (directions == _TO_UNLOAD) & (self._unload_station == self._unload_station[j]))
+            has_queue = ((self._ticket[rows] >= 0) & station_trains).any(axis=1)
+            self.__enqueue(rows[has_queue], j)
+            rows, to_load = rows[~has_queue], to_load[~has_queue]
+            is_added = self.__add_trains(rows, np.full(len(rows), j), to_load)
+            self._cargo_time[rows[is_added], j] = hours
+            self.__enqueue(rows[~is_added], j)
+
+        # Moving trains, including the ones that have just departed
+        is_transit = state == _TRANSIT
+        if is_transit.any():
+            self._coord[is_transit] = np.maximum(self._coord[is_transit] - self._velocity[is_transit] * hours, 0)
+            state[is_transit & (self._coord == 0)] = _ARRIVED
+
+        # Queues are served in the station order: terminals, then entrepots
+        is_queued = self._ticket >= 0
+        if is_queued.any():
+            to_load = self._direction == _TO_LOAD
+            stations = [(to_load & (self._load_station[None, :] == i)) for i in range(len(self._terminal_names))]
+            stations += [(~to_load & (self._unload_station[None, :] == i)) for i in range(len(self._entrepot_names))]
+            for station_trains in stations:
+                self.__serve_queue(station_trains, hours)
+            is_queued = self._ticket >= 0
+            self._queued_hours[is_queued] += hours
+
+    def __serve_queue(self, station_trains: np.ndarray, hours: int):
+        """ Adds as many trains from the head of the station queue as the station takes, in every variant """
+
+        while True:
+            tickets = np.where(station_trains & (self._ticket >= 0), self._ticket, np.iinfo(np.int64).max)
+            rows = np.flatnonzero(tickets.min(axis=1) < np.iinfo(np.int64).max)
+            if len(rows) == 0:
+                return
+            heads = np.argmin(tickets[rows], axis=1)
+            is_added = self.__add_trains(rows, heads, self._direction[rows, heads] == _TO_LOAD)
+            if not is_added.any():
+                return
+            rows, heads = rows[is_added], heads[is_added]
+            self._cargo_time[rows, heads] += hours
+            self._ticket[rows, heads] = -1
+            station_trains = station_trains.copy()
+            station_trains[~np.isin(self._scenario_ids, rows)] = False
+
+    def __update_terminals(self, hours: int):
+        # Mine the oil
+        shape = self._t_oil.shape
+        if self._rngs is not None:
+            draws = np.stack([rng.standard_normal(shape[1]) for rng in self._rngs])
+        elif self._common_draws:
+            draws = self._rng.standard_normal(shape[1])[None, :]
+        else:
+            draws = self._rng.standard_normal(shape)
+        mean_prod = self._t_mean_prod_speed * hours
+        std_prod = self._t_std_prod_speed * math.sqrt(hours)
+        oil_mined = np.trunc(mean_prod + draws * std_prod).astype(np.int64)
+        self._t_last_oil_mined = oil_mined
+        self._t_has_mined = True
+        self._t_oil += oil_mined
+
+        # Fill the trains: a full step if there is enough oil, otherwise all the oil there is
+        occupied = self._t_train != _NO_TRAIN
+        emptying_amt = self._t_emptying_speed * hours
+        oil_amt = np.where(self._t_oil - emptying_amt > 0, emptying_amt, self._t_oil)
+        given = np.minimum(oil_amt, self._t_train_storage - self._t_train_oil)
+        given[~occupied] = 0
+        self._t_train_oil += given
+        self._t_oil -= given
+        self._t_last_oil_given = given
+        self._t_has_given = occupied
+
+        # Send full trains
+        rows, cols = np.nonzero(occupied & (self._t_train_oil == self._t_train_storage))
+        trains = self._t_train[rows, cols]
+        self._oil[rows, trains] = self._t_train_oil[rows, cols]
+        self._state[rows, trains] = _READY
+        self._t_train[rows, cols] = _NO_TRAIN
+
+    def __update_entrepots(self, hours: int):
+        occupied = self._e_train != _NO_TRAIN
+        free_tracks = self._e_track_exists & ~occupied
+
+        # Add unloader trains
+        sum_oil_volume = self._e_oil + np.where(occupied, self._e_train_oil, 0).sum(axis=2)
+        sum_speed = self._e_filling_speed - self._e_emptying_speed
+        has_steps = np.where(sum_speed < 0, self._e_oil // np.maximum(np.abs(sum_speed), 1), 0)
+        need_steps = np.ceil(self._e_unload_limit / self._e_emptying_speed)
+        is_added = (~self._e_has_unloader
+                    & free_tracks.any(axis=2)
+                    & (sum_oil_volume >= self._e_unload_limit)
+                    & ((sum_speed >= 0) | (has_steps >= need_steps)))
+        rows, stations = np.nonzero(is_added)
+        tracks = np.argmax(free_tracks[rows, stations], axis=1)
+        self._e_train[rows, stations, tracks] = _UNLOADER
+        self._e_train_oil[rows, stations, tracks] = 0
+        self._e_train_storage[rows, stations, tracks] = self._e_unload_limit[rows, stations]
+        self._e_has_unloader[rows, stations] = True
+
+        # Load unloader trains and unload other trains
+        occupied = self._e_train != _NO_TRAIN
+        is_unloader = self._e_train == _UNLOADER
+        is_unloading = occupied & ~is_unloader
+        loaded = np.minimum(self._e_emptying_speed[:, :, None] * hours, self._e_train_storage - self._e_train_oil)
+        unloaded = np.minimum(self._e_filling_speed[:, :, None] * hours, self._e_train_oil)
+        collected = np.where(is_unloader, loaded, np.where(is_unloading, unloaded, 0))
+        self._e_train_oil += np.where(is_unloader, collected, -collected)
+        self._e_oil += np.where(is_unloader, -collected, collected).sum(axis=2)
+        self._e_last_collected = collected
+        self._e_has_collected = occupied
+        self._e_collected_unloader = is_unloader
+
+        # Send full unloader trains and empty trains
+        is_full = is_unloader & (self._e_train_oil == self._e_train_storage)
+        self._e_has_unloader[is_full.any(axis=2)] = False
+        self._e_train[is_full] = _NO_TRAIN
+        rows, stations, tracks = np.nonzero(is_unloading & (self._e_train_oil == 0))
+        trains = self._e_train[rows, stations, tracks]
+        self._oil[rows, trains] = 0
+        self._state[rows, trains] = _READY
+        self._e_train[rows, stations, tracks] = _NO_TRAIN
+
+    def __update_metrics(self):
+        self._steps += 1
+        n = len(self._terminal_names)
+        self._peak_oil[:, :n] = np.maximum(self._peak_oil[:, :n], self._t_oil)
+        self._peak_oil[:, n:] = np.maximum(self._peak_oil[:, n:], self._e_oil)
+        t_overflow = self._t_oil - self._t_volume
+        e_overflow = self._e_oil - self._e_storage_volume
+        self._overflow_oil += np.where(t_overflow > 0, t_overflow, 0).sum(axis=1)
+        self._overflow_oil += np.where(e_overflow > 0, e_overflow, 0).sum(axis=1)
+        self._overflow_steps += (t_overflow > 0).sum(axis=1) + (e_overflow > 0).sum(axis=1)
+        self._stockout_steps += (self._t_oil <= 0).sum(axis=1)
+        # Fills of unloader trains are shipped oil, also in the step the unloader train leaves
+        is_shipped = self._e_collected_unloader
+        self._shipped_oil += np.where(is_shipped, self._e_last_collected, 0).sum(axis=(1, 2))
+        self._delivered_oil += np.where(self._e_has_collected & ~is_shipped, self._e_last_collected, 0).sum(axis=(1, 2))
+
+    def update(self, hours: int = 1):
+        """ Updates trains and stations of every variant
+
+        Parameters
+        ----------
+        hours
+            Step length in whole hours
+        """
+
+        if hours != int(hours):
+            raise AttributeError('Only whole hour steps are supported')
+        self.__update_trains(int(hours))
+        self.__update_terminals(int(hours))
+        self.__update_entrepots(int(hours))
+        self.__update_metrics()
+
+    def iter_steps(self) -> Iterator[datetime]:
+        """ Runs the simulation lazily, one step of every variant per iteration
+
+        Yields
+        ------
+        datetime
+            Simulation time of the step
+        """
+
+        while self._simulation_time <= self._end_time:
+            simulation_time = self._simulation_time
+            self.update(self._step)
+            self._simulation_time = simulation_time + timedelta(hours=self._step)
+            yield simulation_time
+
+    def simulate(self):
+        for _ in self.iter_steps():
+            pass
+
+    def create_snapshot_buffer(self, scenario_id: int) -> SnapshotBuffer:
+        """ Snapshot buffer of the variant, with stations in the VectorizedStationManager order """
+
+        tracks_nums = [1] * len(self._terminal_names) + self._e_track_exists[scenario_id].sum(axis=1).tolist()
+        return SnapshotBuffer([*self._terminal_names, *self._entrepot_names], tracks_nums, self._train_names)
+
+    def write_snapshot(self, buffer: SnapshotBuffer, scenario_id: int):
+        """ Writes the state of the variant after the last step, same as Modeler.iter_snapshots with
+        VectorizedStationManager
+        """
+
+        s = scenario_id
+        n = len(self._terminal_names)
+        buffer.time = self._simulation_time - timedelta(hours=self._step)
+        buffer.hours = self._step
+
+        buffer.train_state[:] = self._state[s]
+        buffer.train_direction[:] = self._direction[s]
+        buffer.train_oil[:] = self._oil[s]
+        buffer.train_coord[:] = self._coord[s]
+        buffer.train_cargo_time[:] = self._departed_cargo_time[s]
+
+        buffer.station_oil[:n] = self._t_oil[s]
+        buffer.station_mined[:n] = self._t_last_oil_mined[s] if self._t_has_mined else np.nan
+        buffer.station_oil[n:] = self._e_oil[s]
+        buffer.station_mined[n:] = np.nan
+        trains = self._t_train[s]
+        occupied = trains != _NO_TRAIN
+        buffer.track_collected[:n] = np.where(self._t_has_given[s], self._t_last_oil_given[s], np.nan)
+        buffer.track_storage[:n] = np.where(occupied, self._t_train_oil[s], np.nan)
+        buffer.track_train[:n] = np.where(occupied, trains, NO_TRAIN)
+        buffer.train_oil[trains[occupied]] = self._t_train_oil[s][occupied]
+
+        exists = self._e_track_exists[s]
+        trains = self._e_train[s][exists]
+        train_oil = self._e_train_oil[s][exists]
+        is_train = trains >= 0
+        buffer.track_collected[n:] = np.where(self._e_has_collected[s][exists], self._e_last_collected[s][exists],
+                                              np.nan)
+        buffer.track_storage[n:] = np.where(trains != _NO_TRAIN, train_oil, np.nan)
+        buffer.track_train[n:] = np.where(trains == _UNLOADER, UNLOADER_TRAIN, np.where(is_train, trains, NO_TRAIN))
+        buffer.train_oil[trains[is_train]] = train_oil[is_train]
+
+    def get_queue_waits(self, scenario_id: int) -> dict[str, list[float]]:
+        """ Hours spent in the queue by trains waiting at every station of the variant, in the queue order """
+
+        waits = dict((name, []) for name in [*self._terminal_names, *self._entrepot_names])
+        queued = np.flatnonzero(self._ticket[scenario_id] >= 0)
+        for j in queued[np.argsort(self._ticket[scenario_id, queued])].tolist():
+            if self._direction[scenario_id, j] == _TO_LOAD:
+                name = self._terminal_names[self._load_station[j]]
+            else:
+                name = self._entrepot_names[self._unload_station[j]]
+            waits[name].append(float(self._queued_hours[scenario_id, j]))
+        return waits
+
+    def result(self) -> dict:
+        """ Collected statistics of every variant, same as RunMetrics.result with the volumes of the variant
+
+        Returns
+        -------
+        dict
+            RunMetrics fields as arrays over variants, <peak_oil> is station name -> array over variants
+        """
+
+        station_names = [*self._terminal_names, *self._entrepot_names]
+        return {'steps': self._steps,
+                'delivered_oil': self._delivered_oil.copy(),
+                'shipped_oil': self._shipped_oil.copy(),
+                'overflow_oil': self._overflow_oil.copy(),
+                'overflow_steps': self._overflow_steps.copy(),
+                'stockout_steps': self._stockout_steps.copy(),
+                'departures': self._departures.copy(),
+                'peak_oil': dict((name, self._peak_oil[:, i].copy()) for i, name in enumerate(station_names))}
@@ -0,0 +1,58 @@
+import time
+from datetime import timedelta
+
+import numpy as np
+
+from analysis.replication import STARTING_TIME
+from batch_logic.batched_modeler import BatchedModeler
+from manager.vectorized_station_manager import VectorizedStationManager
+from scenario.scenario_builder import apply_overrides, build_modeler, load_scenario
+
+
+def _variant_overrides(scenario: dict, variants_num: int, seed: int = 0) -> list[dict]:
+    """ Random velocities, train storage volumes, unload limits and production of the scenario """
+
+    rnd = np.random.default_rng(seed)
+    overrides = []
+    for _ in range(variants_num):
+        override = dict()
+        for param in scenario['trains']:
+            override[f'trains/{param["name"]}/velocity'] = int(param['velocity'] * rnd.uniform(0.7, 1.3))
+            override[f'trains/{param["name"]}/storage_volume'] = int(param['storage_volume'] * rnd.uniform(0.8, 1.2))
+        for param in scenario['entrepots']:
+            override[f'entrepots/{param["station_name"]}/unload_limit'] = int(param['unload_limit']
+                                                                             * rnd.uniform(0.6, 1.2))
+        for param in scenario['terminals']:
+            override[f'terminals/{param["station_name"]}/mean_prod_speed'] = (param['mean_prod_speed']
+                                                                              * rnd.uniform(0.7, 1.3))
+            override[f'terminals/{param["station_name"]}/std_prod_speed'] = param['std_prod_speed'] * rnd.uniform(1, 3)
+        overrides.append(override)
+    return overrides
+
+
+def main(variants_num: int = 500, horizon_hours: int = 24 * 30, reference_runs: int = 20):
+    scenario = load_scenario('init_data')
+    overrides = _variant_overrides(scenario, variants_num)
+    end_time = STARTING_TIME + timedelta(hours=horizon_hours)
+
+    started = time.perf_counter()
+    modeler = BatchedModeler.from_variants(scenario, overrides, STARTING_TIME, end_time, np.random.default_rng(0))
+    modeler.simulate()
+    batched = (time.perf_counter() - started) / variants_num
+
+    started = time.perf_counter()
+    variants = [apply_overrides(scenario, override) for override in overrides[:reference_runs]]
+    for seed, variant in enumerate(variants):
+        station_manager = VectorizedStationManager.from_scenario(variant, seed)
+        build_modeler(variant, STARTING_TIME, end_time, station_manager=station_manager, log_steps=False).simulate()
+    reference = (time.perf_counter() - started) / len(variants)
+
+    print(f'{variants_num} variants, {horizon_hours} hours')
+    print(f'{"engine":<28}{"ms/variant":>12}')
+    print(f'{"separate modelers":<28}{reference * 1000:>12.2f}')
+    print(f'{"batched":<28}{batched * 1000:>12.2f}')
+    print(f'mean delivered oil: {modeler.result()["delivered_oil"].mean():.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+from analysis.equivalence import (adaptive_engine, compare_engines, format_report, generated_scenarios,
+                                  vectorized_engine, without_production_noise)
+
+
+def main(scenarios_num: int = 10, seeds_num: int = 3, horizon_hours: int = 24 * 30):
+    scenarios = generated_scenarios(scenarios_num)
+    seeds = list(range(seeds_num))
+    # Adaptive steps draw production once per step, so they match the reference only without production noise,
+    # where every seed gives the same run
+    engines = [('vectorized', vectorized_engine, scenarios, seeds),
+               ('adaptive, no production noise', adaptive_engine, without_production_noise(scenarios), seeds[:1])]
+    for name, engine, engine_scenarios, engine_seeds in engines:
+        print(f'{name} engine')
+        print(format_report(compare_engines(engine, engine_scenarios, engine_seeds, horizon_hours)))
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+import math
+
+from analysis.equivalence import generated_scenarios
+from analysis.fast_estimate import fast_estimate
+from scenario.scenario_builder import apply_overrides, load_scenario
+
+
+def _excess(scenario: dict, estimate: dict) -> dict[str, float]:
+    """ Terminal name -> tons per hour the estimate takes above min(production, pumping capacity) """
+
+    excess = dict()
+    for terminal in scenario['terminals']:
+        users = [train for train in scenario['trains'] if train['load_station_name'] == terminal['station_name']]
+        rates = [1 / estimate['trains'][train['name']]['cycle_time'] for train in users]
+        throughput = sum(rate * train['storage_volume'] for rate, train in zip(rates, users))
+        # One pump serves all tracks: c / service_time trains per hour of the mean volume
+        pumping_hours = sum(rate * math.ceil(train['storage_volume'] / terminal['emptying_speed'])
+                            for rate, train in zip(rates, users))
+        capacity = throughput / pumping_hours if pumping_hours > 0 else math.inf
+        excess[terminal['station_name']] = throughput - min(max(terminal['mean_prod_speed'], 1), capacity)
+    return excess
+
+
+def main(scenarios_num: int = 50, production_factors: tuple[float, ...] = (1.0, 0.3, 0.1, 0.02)):
+    scenarios = [load_scenario('init_data')] + generated_scenarios(scenarios_num)
+    checked = 0
+    worst = -math.inf
+    for scenario in scenarios:
+        for factor in production_factors:
+            overrides = dict((f'terminals/{param["station_name"]}/mean_prod_speed', param['mean_prod_speed'] * factor)
+                             for param in scenario['terminals'])
+            variant = apply_overrides(scenario, overrides)
+            excess = _excess(variant, fast_estimate(variant))
+            worst = max(worst, max(excess.values()))
+            checked += len(excess)
+    print(f'terminals checked: {checked}, largest excess over capacity: {worst:.6f} t/h')
+    print(f'capacity respected: {worst <= 1e-6}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import gc
+import time
+import tracemalloc
+from datetime import timedelta
+
+from analysis.replication import STARTING_TIME
+from manager.vectorized_station_manager import VectorizedStationManager
+from scenario.scenario_builder import build_modeler
+from scenario.scenario_generator import generate_scenario
+
+
+def _steps(scenario: dict, steps_num: int, snapshots: bool, vectorized: bool):
+    station_manager = VectorizedStationManager.from_scenario(scenario, seed=0) if vectorized else None
+    modeler = build_modeler(scenario, STARTING_TIME, STARTING_TIME + timedelta(hours=steps_num),
+                            station_manager=station_manager, log_steps=False)
+    steps = modeler.iter_snapshots() if snapshots else modeler.iter_steps()
+    # The first step creates lazily allocated objects
+    next(steps)
+    return steps
+
+
+def measure(scenario: dict, steps_num: int, snapshots: bool, vectorized: bool = False) -> dict:
+    """ Runs the scenario in info dict mode (iter_steps) or snapshot mode (iter_snapshots) and measures
+    the cost of a step. Timing and allocation tracing are done in separate runs, because tracing slows
+    allocations down. Snapshots also record the state of every train, which info dicts do not, so they cut
+    allocations and garbage collection rather than the time of a step
+
+    Parameters
+    ----------
+    scenario
+        Scenario parameters in the init data format
+    steps_num
+        Number of measured simulation steps
+    snapshots
+        Use snapshot mode
+    vectorized
+        Use VectorizedStationManager
+
+    Returns
+    -------
+    dict
+        <ms_per_step> float: wall time per step in milliseconds
+        <gc_per_1000_steps> float: garbage collector runs of all generations per 1000 steps
+        <allocated_kb_per_step> float: peak of memory allocated during a step above the memory in use
+            before it, in KiB
+    """
+
+    steps = _steps(scenario, steps_num, snapshots, vectorized)
+    collections = sum(stats['collections'] for stats in gc.get_stats())
+    started = time.perf_counter()
+    for _ in steps:
+        pass
+    elapsed = time.perf_counter() - started
+    collections = sum(stats['collections'] for stats in gc.get_stats()) - collections
+
+    steps = _steps(scenario, steps_num, snapshots, vectorized)
+    allocated = 0
+    tracemalloc.start()
+    current, _ = tracemalloc.get_traced_memory()
+    for _ in steps:
+        next_current, peak = tracemalloc.get_traced_memory()
+        allocated += peak - current
+        current = next_current
+        tracemalloc.reset_peak()
+    tracemalloc.stop()
+
+    return {'ms_per_step': elapsed / steps_num * 1000,
+            'gc_per_1000_steps': collections / steps_num * 1000,
+            'allocated_kb_per_step': allocated / steps_num / 1024}
+
+
+def main(terminals_num: int = 2000, steps_num: int = 200):
+    scenario = generate_scenario(terminals_num, entrepots_num=max(1, terminals_num // 100))
+    print(f'{terminals_num} terminals, {len(scenario["trains"])} trains, {steps_num} steps')
+    print(f'{"mode":<28}{"ms/step":>12}{"gc/1000 steps":>16}{"KiB/step":>12}')
+    for vectorized in [False, True]:
+        for snapshots in [False, True]:
+            name = ('vectorized ' if vectorized else '') + ('snapshots' if snapshots else 'info dicts')
+            result = measure(scenario, steps_num, snapshots, vectorized)
+            print(f'{name:<28}{result["ms_per_step"]:>12.2f}{result["gc_per_1000_steps"]:>16.1f}'
+                  f'{result["allocated_kb_per_step"]:>12.1f}')
+
+
+if __name__ == '__main__':
+    main()
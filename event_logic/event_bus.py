@@ -0,0 +1,61 @@
+from datetime import datetime
+from typing import Callable, Iterable, Union
+
+from event_logic.event_type import EventType
+from event_logic.transition_event import TransitionEvent
+
+
+class EventBus:
+    """ Delivers transition events of trains and stations to subscribers of their event types.
+
+    Events without subscribers are not even created
+    """
+
+    def __init__(self):
+        self._subscribers = dict((event_type, []) for event_type in EventType)
+        self._time = None
+
+    @property
+    def time(self) -> datetime:
+        """datetime: Simulation time of the current step. Set by Modeler"""
+        return self._time
+
+    @time.setter
+    def time(self, value: datetime):
+        self._time = value
+
+    def subscribe(self, event_types: Union[EventType, Iterable[EventType]], callback: Callable[[TransitionEvent], None]):
+        """ Registers callback for the event types
+
+        Parameters
+        ----------
+        event_types
+            Event type or several event types
+        callback
+            Function called with TransitionEvent
+        """
+
+        if isinstance(event_types, EventType):
+            event_types = [event_types]
+        for event_type in event_types:
+            self._subscribers[event_type].append(callback)
+
+    def unsubscribe(self, event_types: Union[EventType, Iterable[EventType]], callback: Callable[[TransitionEvent], None]):
+        if isinstance(event_types, EventType):
+            event_types = [event_types]
+        for event_type in event_types:
+            self._subscribers[event_type].remove(callback)
+
+    def has_subscribers(self, event_type: EventType) -> bool:
+        return len(self._subscribers[event_type]) > 0
+
+    def publish(self, event_type: EventType, station_name: str, train_name: str = None,
+                track: int = None, value: float = None):
+        """ Sends the event to its subscribers """
+
+        callbacks = self._subscribers[event_type]
+        if len(callbacks) == 0:
+            return
+        event = TransitionEvent(event_type, self._time, station_name, train_name, track, value)
+        for callback in callbacks:
+            callback(event)
@@ -0,0 +1,48 @@
+import csv
+
+from event_logic.event_bus import EventBus
+from event_logic.event_type import EventType
+from event_logic.transition_event import TransitionEvent
+
+
+class EventLog:
+    """ Exact log of transition events. Keeps events in memory or writes them to a CSV file """
+
+    def __init__(self, event_bus: EventBus, event_types: list[EventType] = None, path: str = None):
+        """
+        Parameters
+        ----------
+        event_bus
+            Event bus to subscribe to
+        event_types
+            Event types to log. All types if None
+        path
+            CSV file to write events to. Events are kept in memory if None
+        """
+
+        self._events = []
+        self._file = None
+        self._writer = None
+        if path is not None:
+            self._file = open(path, 'w', encoding='utf-8', newline='')
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(['time', 'event', 'station_name', 'train_name', 'track', 'value'])
+        event_bus.subscribe(event_types if event_types is not None else list(EventType), self.__on_event)
+
+    def __on_event(self, event: TransitionEvent):
+        if self._writer is not None:
+            self._writer.writerow([event.time, event.event_type.name, event.station_name,
+                                   event.train_name, event.track, event.value])
+        else:
+            self._events.append(event)
+
+    @property
+    def events(self) -> list[TransitionEvent]:
+        """list[TransitionEvent]: Logged events. Empty if events are written to a file"""
+        return self._events
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._writer = None
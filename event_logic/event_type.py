@@ -0,0 +1,10 @@
+from enum import Enum
+
+
+class EventType(Enum):
+    Arrived = 1
+    Queued = 2
+    Admitted = 3
+    Departed = 4
+    Unloader_created = 5
+    Unloader_filled = 6
@@ -0,0 +1,32 @@
+from dataclasses import dataclass
+from datetime import datetime
+
+from event_logic.event_type import EventType
+
+
+@dataclass(frozen=True)
+class TransitionEvent:
+    """ Transition of a train or a station
+
+    Attributes
+    ----------
+    event_type
+        Type of transition
+    time
+        Simulation time of the step when the transition happened
+    station_name
+        Name of the station
+    train_name
+        Name of the train. Unloader train name for unloader events
+    track
+        Track index for Admitted and unloader events
+    value
+        Departed: hours in cargo process. Queued: queue length. Unloader_filled: shipped oil amount
+    """
+
+    event_type: EventType
+    time: datetime
+    station_name: str
+    train_name: str = None
+    track: int = None
+    value: float = None
@@ -1,3 +1,11 @@
+import math
+from itertools import chain
+from operator import attrgetter
+
+import numpy as np
+
+from event_logic.event_bus import EventBus
+from snapshot_logic.snapshot_buffer import NO_TRAIN, UNLOADER_TRAIN, SnapshotBuffer
 from station_logic.train_station import TrainStation
 from train_logic.train import Train
 
@@ -5,12 +13,14 @@ from train_logic.train import Train
 class StationManager:
     """ Manages stations logic """
 
-    def __init__(self, stations: list[TrainStation]):
+    def __init__(self, stations: list[TrainStation], event_bus: EventBus = None):
         """
         Parameters
         ----------
         stations
             List of train stations. Station names must be unique
+        event_bus
+            Event bus to publish station transitions to
         """
 
         station_names = set()
@@ -22,12 +32,39 @@ class StationManager:
         self._stations = dict()
         for station in stations:
             self._stations[station.station_name] = station
+            if event_bus is not None:
+                station.attach_event_bus(event_bus)
+
+    def update(self, hours: float = 1):
+        """ Updates stations state
 
-    def update(self):
-        """ Updates stations state """
+        Parameters
+        ----------
+        hours
+            Step length in hours
+        """
 
         for station in self._stations.values():
-            station.update()
+            station.update(hours)
+
+    def time_to_next_event(self) -> float:
+        """ Hours until the nearest station event """
+
+        return min([station.time_to_next_event() for station in self._stations.values()], default=math.inf)
+
+    def time_to_admission(self, train: Train, station_name: str) -> float:
+        """ Hours until the train can be added to the track of the station if nothing else happens """
+
+        if station_name not in self._stations.keys():
+            raise AttributeError('No such station name')
+        return self._stations[station_name].time_to_admission(train)
+
+    def announce_train(self, train: Train, station_name: str, hours: float):
+        """ Tells the station that the train is in transit to it and arrives in the given hours """
+
+        if station_name not in self._stations.keys():
+            raise AttributeError('No such station name')
+        self._stations[station_name].announce_train(train, hours)
 
     def add_train_to_station(self, train: Train, station_name: str) -> bool:
         """ Add a train to the track of the current station
@@ -49,9 +86,32 @@ class StationManager:
             raise AttributeError('No such station name')
         return self._stations[station_name].add_train_to_track(train)
 
+    def get_station(self, station_name: str) -> TrainStation:
+        if station_name not in self._stations.keys():
+            raise AttributeError('No such station name')
+        return self._stations[station_name]
+
     def get_station_names(self) -> list[str]:
         return list(self._stations.keys())
 
+    def get_tracks_nums(self) -> list[int]:
+        return [station.tracks_num for station in self._stations.values()]
+
+    def write_snapshot(self, buffer: SnapshotBuffer):
+        """ Writes stations information into the snapshot buffer, same fields as get_stations_info.
+        Every column is written at once, missing values (None) become NaN
+        """
+
+        stations = self._stations.values()
+        buffer.station_oil[:] = np.fromiter(map(attrgetter('oil_volume'), stations), np.float64, len(stations))
+        buffer.station_mined[:] = list(map(attrgetter('last_oil_mined'), stations))
+        buffer.track_collected[:] = list(chain.from_iterable(map(attrgetter('last_track_oil'), stations)))
+        trains = list(chain.from_iterable(map(attrgetter('tracks'), stations)))
+        buffer.track_storage[:] = [train.oil_volume if train is not None else math.nan for train in trains]
+        train_ids = buffer.train_ids
+        buffer.track_train[:] = [train_ids.get(train.name, UNLOADER_TRAIN) if train is not None else NO_TRAIN
+                                 for train in trains]
+
     def get_stations_info(self) -> list[dict]:
         """ Get stations logging info
 
@@ -61,14 +121,16 @@ class StationManager:
             Terminal:
                 <oil_amt> int: amount of oil in station storage
                 <oil_mined> int: amount of mined oil during the last step
-                <train_name> str: name of train on the track. None if track is free
-                <oil_collected> int: amount of train's collected oil during the last step
-                <train_storage> int: amount of oil in train storage
+                <train_name> str: name of train on the first track. None if track is free
+                <oil_collected> int: amount of train's collected oil on the first track during the last step
+                <train_storage> int: amount of oil in train storage on the first track
+                <tracks> list: only for terminals with several tracks, same as entrepot tracks
             Entrepot:
                 <oil_amt> int: amount of oil in station storage
                 <tracks> list: list of tracks where elements consist of -
                     <train_name> str: name of train on the track. None if track is free
                     <oil_collected> int: amount of train's collected oil during the last step
+                    <is_unloader> bool: the oil was collected by the unloader train, which may have left the track
                     <storage> int: amount of oil in train storage
         """
 
@@ -1,3 +1,11 @@
+import math
+from operator import attrgetter
+
+import numpy as np
+
+from event_logic.event_bus import EventBus
+from event_logic.event_type import EventType
+from snapshot_logic.snapshot_buffer import SnapshotBuffer
 from train_logic.train import Train
 from train_logic.train_direction import TrainDirection
 from train_logic.train_state import TrainState
@@ -7,7 +15,8 @@ from manager.station_manager import StationManager
 class TrainManager:
     """ Manages trains logic """
 
-    def __init__(self, trains: list[Train], station_manager: StationManager, distances: list[list]):
+    def __init__(self, trains: list[Train], station_manager: StationManager, distances: list[list],
+                 event_bus: EventBus = None):
         """
         Parameters
         ----------
@@ -18,6 +27,8 @@ class TrainManager:
         distances
             List of distances between stations.
             List consists of [station name A, station name B, distance]
+        event_bus
+            Event bus to publish train transitions to
         """
 
         train_names = set()
@@ -40,6 +51,14 @@ class TrainManager:
         self._trains_cargo_time = dict()
         for train in trains:
             self._trains_cargo_time[train.name] = -1
+        # Departures since the last get_trains_info call
+        self._departures = []
+        # Hours spent in the station queue by queued trains
+        self._queued_hours = dict()
+        self._event_bus = event_bus
+        for train in trains:
+            if train.state == TrainState.Transit:
+                self.__announce(train)
 
     def get_trains_info(self) -> list[dict]:
         """ Get trains logging info
@@ -49,33 +68,66 @@ class TrainManager:
         list[dict]
             <train_name> str: name of the train
             <station_name> str: name of station where train is in cargo process
-            <cargo_time> int: amount of steps for how long train is in cargo process
+            <cargo_time> float: amount of hours for how long train is in cargo process
         """
 
-        info = []
-        for train in self._trains:
-            # Checking if the train has just left
-            if train.state == TrainState.Transit and self._trains_cargo_time[train.name] > -1:
-                train_info = {'train_name': train.name,
-                              'station_name': None,
-                              'cargo_time': self._trains_cargo_time[train.name]}
-                if train.direction == TrainDirection.To_load_station:
-                    train_info['station_name'] = train.unload_station_name
-                elif train.direction == TrainDirection.To_unload_station:
-                    train_info['station_name'] = train.load_station_name
-                else:
-                    raise NotImplementedError('No such direction')
-                info.append(train_info)
-                self._trains_cargo_time[train.name] = -1
+        info = self._departures
+        self._departures = []
         return info
 
-    def __set_train_preconditions(self, train: Train):
+    def get_queue_waits(self) -> dict[str, list[float]]:
+        """ Hours spent in the queue by trains waiting at every station, in the queue order """
+
+        return dict((name, [self._queued_hours[train.name] for train in buffer])
+                    for name, buffer in self._buffers.items())
+
+    def get_train_names(self) -> list[str]:
+        return [train.name for train in self._trains]
+
+    def write_snapshot(self, buffer: SnapshotBuffer):
+        """ Writes trains condition and departures since the last call into the snapshot buffer.
+        Departures are consumed like in get_trains_info
+        """
+
+        # Whole columns from C level iterators. Enum values are read as _value_, the value property is slow
+        trains_num = len(self._trains)
+        buffer.train_state[:] = np.fromiter(map(attrgetter('state._value_'), self._trains), np.int8, trains_num)
+        buffer.train_direction[:] = np.fromiter(map(attrgetter('direction._value_'), self._trains), np.int8,
+                                                trains_num)
+        buffer.train_oil[:] = np.fromiter(map(attrgetter('oil_volume'), self._trains), np.float64, trains_num)
+        buffer.train_coord[:] = np.fromiter(map(attrgetter('coord'), self._trains), np.float64, trains_num)
+        buffer.train_cargo_time.fill(math.nan)
+        for info in self._departures:
+            buffer.train_cargo_time[buffer.train_ids[info['train_name']]] = info['cargo_time']
+        self._departures = []
+
+    def __add_departure_info(self, train: Train):
+        """ Records departure of the train that has just left """
+
+        # Train direction is already changed, so the train has left the opposite station
+        if train.direction == TrainDirection.To_load_station:
+            station_name = train.unload_station_name
+        elif train.direction == TrainDirection.To_unload_station:
+            station_name = train.load_station_name
+        else:
+            raise NotImplementedError('No such direction')
+        cargo_time = self._trains_cargo_time[train.name]
+        self._departures.append({'train_name': train.name,
+                                 'station_name': station_name,
+                                 'cargo_time': cargo_time})
+        self._trains_cargo_time[train.name] = -1
+        if self._event_bus is not None:
+            self._event_bus.publish(EventType.Departed, station_name, train.name, value=cargo_time)
+
+    def __set_train_preconditions(self, train: Train, hours: float):
         """ Updates trains state that are not in buffer
 
         Parameters
         ----------
         train
             Train to add
+        hours
+            Step length in hours
         """
 
         if train.state == TrainState.Ready:
@@ -83,7 +135,9 @@ class TrainManager:
             train.state = TrainState.Transit
             train.coord = self._dist_mx[train.load_station_name][train.unload_station_name]
             # for logging purposes
-            self._trains_cargo_time[train.name] += 1
+            self._trains_cargo_time[train.name] += hours
+            self.__add_departure_info(train)
+            self.__announce(train)
         elif train.state == TrainState.Arrived:
             # Finding out which station the train arrived at
             arrived_station_name = ''
@@ -99,7 +153,7 @@ class TrainManager:
                 # Update status to "Wait"
                 train.state = TrainState.Wait
                 # Putting the train in the queue
-                self._buffers[arrived_station_name].append(train)
+                self.__put_to_queue(train, arrived_station_name)
             else:
                 # Trying to set train to the station
                 is_added = self._station_manager.add_train_to_station(train, arrived_station_name)
@@ -108,25 +162,70 @@ class TrainManager:
                     # Update status to "Wait"
                     train.state = TrainState.Wait
                     # Putting the train in the queue
-                    self._buffers[arrived_station_name].append(train)
+                    self.__put_to_queue(train, arrived_station_name)
                 else: # for logging purposes
-                    self._trains_cargo_time[train.name] = 1
+                    self._trains_cargo_time[train.name] = hours
         elif train.state == TrainState.In_cargo_process:
-            self._trains_cargo_time[train.name] += 1
+            self._trains_cargo_time[train.name] += hours
         elif train.state in [TrainState.Wait, TrainState.Transit]:
             pass
         else:
             raise NotImplementedError('No such state')
 
-    def update(self):
-        """ Updates trains state """
+    def __announce(self, train: Train):
+        """ Tells the destination station about the train in transit """
+
+        if train.direction == TrainDirection.To_load_station:
+            station_name = train.load_station_name
+        else:
+            station_name = train.unload_station_name
+        self._station_manager.announce_train(train, station_name, train.time_to_arrival())
+
+    def __put_to_queue(self, train: Train, station_name: str):
+        self._buffers[station_name].append(train)
+        self._queued_hours[train.name] = 0
+        if self._event_bus is not None:
+            self._event_bus.publish(EventType.Queued, station_name, train.name,
+                                    value=len(self._buffers[station_name]))
+
+    def __publish_arrival(self, train: Train):
+        if train.direction == TrainDirection.To_load_station:
+            station_name = train.load_station_name
+        else:
+            station_name = train.unload_station_name
+        self._event_bus.publish(EventType.Arrived, station_name, train.name)
+
+    def time_to_next_event(self) -> float:
+        """ Hours until the nearest train event: arrival, departure or admission of a queued train """
+
+        time = math.inf
+        for train in self._trains:
+            if train.state in [TrainState.Ready, TrainState.Arrived]:
+                return 0
+            time = min(time, train.time_to_arrival())
+        for name, buffer in self._buffers.items():
+            if len(buffer) > 0:
+                time = min(time, self._station_manager.time_to_admission(buffer[0], name))
+        return time
+
+    def update(self, hours: float = 1):
+        """ Updates trains state
+
+        Parameters
+        ----------
+        hours
+            Step length in hours
+        """
 
         # Updates the states of trains that are NOT in queues
         for train in self._trains:
             # Handling train logic preconditions
-            self.__set_train_preconditions(train)
+            self.__set_train_preconditions(train, hours)
             # Handling train logic
-            train.update()
+            is_transit = train.state == TrainState.Transit
+            train.update(hours)
+            if is_transit and train.state == TrainState.Arrived and self._event_bus is not None:
+                self.__publish_arrival(train)
 
         # Updates the states of trains that are in queues
         for name in self._station_manager.get_station_names():
@@ -139,7 +238,10 @@ class TrainManager:
                     is_added = self._station_manager.add_train_to_station(buffer[0], name)
                     if is_added:
                         # for logging purposes
-                        self._trains_cargo_time[buffer[0].name] += 1
+                        self._trains_cargo_time[buffer[0].name] += hours
+                        del self._queued_hours[buffer[0].name]
                         buffer.pop(0)
                 else:
                     is_added = False
+            for train in buffer:
+                self._queued_hours[train.name] += hours
@@ -0,0 +1,436 @@
+import math
+
+import numpy as np
+
+from event_logic.event_bus import EventBus
+from event_logic.event_type import EventType
+from snapshot_logic.snapshot_buffer import SnapshotBuffer, NO_TRAIN, UNLOADER_TRAIN
+from station_logic.entrepot import UNLOADER_TRAIN_NAME
+from train_logic.train import Train
+from train_logic.train_state import TrainState
+
+
+class NumpyNormalStream:
+    """ Adapter of numpy random generator to the normalvariate interface of Terminal.
+
+    Terminals sharing one stream draw the same numbers as VectorizedStationManager with the same generator
+    """
+
+    def __init__(self, generator: np.random.Generator):
+        self._generator = generator
+
+    def normalvariate(self, mu: float, sigma: float) -> float:
+        return mu + self._generator.standard_normal() * sigma
+
+
+def reference_production_rngs(scenario: dict, seed: int) -> dict[str, NumpyNormalStream]:
+    """ Production streams for per-object terminals that reproduce VectorizedStationManager with the same seed """
+
+    stream = NumpyNormalStream(np.random.default_rng(seed))
+    return dict((param['station_name'], stream) for param in scenario['terminals'])
+
+
+class VectorizedStationManager:
+    """ Manages stations logic with station state kept in arrays.
+
+    Every simulation step mining, loading/unloading and departures run as batched array operations
+    per station type. Follows Terminal and Entrepot logic exactly. Trains on tracks get their oil
+    volume written back on departure. Oil amounts are integer, so only whole hour steps are supported
+    """
+
+    def __init__(self, terminals: list[dict], entrepots: list[dict], rng: np.random.Generator = None,
+                 event_bus: EventBus = None):
+        """
+        Parameters
+        ----------
+        terminals
+            Terminal parameters in the init data format. Only one track per terminal is supported
+        entrepots
+            Entrepot parameters in the init data format
+        rng
+            Random generator of oil production
+        event_bus
+            Event bus to publish station transitions to
+        """
+
+        station_names = [param['station_name'] for param in [*terminals, *entrepots]]
+        if len(set(station_names)) != len(station_names):
+            raise AttributeError('Station names must be unique')
+        if any(param['tracks_num'] != 1 for param in terminals):
+            raise AttributeError('Only one track per terminal is supported')
+
+        self._rng = rng if rng is not None else np.random.default_rng()
+        self._event_bus = event_bus
+        self._station_names = station_names
+        self._terminal_names = [param['station_name'] for param in terminals]
+        self._entrepot_names = [param['station_name'] for param in entrepots]
+        # Station name -> (is terminal, index in arrays of its type)
+        self._index = dict()
+        for i, param in enumerate(terminals):
+            self._index[param['station_name']] = (True, i)
+        for i, param in enumerate(entrepots):
+            self._index[param['station_name']] = (False, i)
+
+        # Terminals
+        n = len(terminals)
+        self._t_oil = np.array([param['oil_volume'] for param in terminals], dtype=np.int64)
+        self._t_emptying_speed = np.array([param['emptying_speed'] for param in terminals], dtype=np.int64)
+        self._t_mean_prod_speed = np.array([param['mean_prod_speed'] for param in terminals], dtype=np.float64)
+        self._t_std_prod_speed = np.array([param['std_prod_speed'] for param in terminals], dtype=np.float64)
+        self._t_last_oil_mined = np.zeros(n, dtype=np.int64)
+        self._t_has_mined = False
+        self._t_last_oil_given = np.zeros(n, dtype=np.int64)
+        self._t_has_given = np.zeros(n, dtype=bool)
+        self._t_occupied = np.zeros(n, dtype=bool)
+        self._t_train_oil = np.zeros(n, dtype=np.int64)
+        self._t_train_storage = np.zeros(n, dtype=np.int64)
+        self._t_trains = np.full(n, None, dtype=object)
+
+        # Entrepots, tracks are padded to the maximum number of tracks
+        m = len(entrepots)
+        k = max([param['tracks_num'] for param in entrepots], default=0)
+        self._e_oil = np.array([param['oil_volume'] for param in entrepots], dtype=np.int64)
+        self._e_emptying_speed = np.array([param['emptying_speed'] for param in entrepots], dtype=np.int64)
+        self._e_filling_speed = np.array([param['filling_speed'] for param in entrepots], dtype=np.int64)
+        self._e_storage_volume = np.array([param['storage_volume'] for param in entrepots], dtype=np.int64)
+        self._e_unload_limit = np.array([param['unload_limit'] for param in entrepots], dtype=np.int64)
+        self._e_has_unloader = np.zeros(m, dtype=bool)
+        self._e_track_exists = np.array([[j < param['tracks_num'] for j in range(k)] for param in entrepots],
+                                        dtype=bool).reshape(m, k)
+        self._e_occupied = np.zeros((m, k), dtype=bool)
+        self._e_is_unloader = np.zeros((m, k), dtype=bool)
+        self._e_train_oil = np.zeros((m, k), dtype=np.int64)
+        self._e_train_storage = np.zeros((m, k), dtype=np.int64)
+        self._e_last_collected = np.zeros((m, k), dtype=np.int64)
+        self._e_has_collected = np.zeros((m, k), dtype=bool)
+        # Tracks where unloader trains were loaded during the last step
+        self._e_collected_unloader = np.zeros((m, k), dtype=bool)
+        self._e_trains = np.full((m, k), None, dtype=object)
+
+    @classmethod
+    def from_scenario(cls, scenario: dict, seed: int = None, event_bus: EventBus = None) -> 'VectorizedStationManager':
+        return cls(scenario['terminals'], scenario['entrepots'], np.random.default_rng(seed), event_bus)
+
+    def __publish(self, event_type: EventType, station_name: str, train_name: str, track: int, value: float = None):
+        if self._event_bus is not None:
+            self._event_bus.publish(event_type, station_name, train_name, track, value)
+
+    def get_station_names(self) -> list[str]:
+        return list(self._station_names)
+
+    def get_tracks_nums(self) -> list[int]:
+        return [1] * len(self._terminal_names) + self._e_track_exists.sum(axis=1).tolist()
+
+    def add_train_to_station(self, train: Train, station_name: str) -> bool:
+        """ Add a train to the track of the current station
+
+        Parameters
+        ----------
+        train
+            Train to add
+        station_name
+            Name of station where train need to add
+
+        Returns
+        -------
+        bool
+            True if train was added successfully, False otherwise
+        """
+
+        if station_name not in self._index:
+            raise AttributeError('No such station name')
+        is_terminal, i = self._index[station_name]
+        if is_terminal:
+            return self.__add_train_to_terminal(train, i)
+        return self.__add_train_to_entrepot(train, i)
+
+    def __terminal_can_add(self, train: Train, i: int) -> bool:
+        """ Same preliminary simulation as Terminal """
+
+        if self._t_occupied[i]:
+            return False
+        oil = int(self._t_oil[i])
+        emptying_speed = int(self._t_emptying_speed[i])
+        can_add = False
+        if oil >= train.storage_volume:
+            can_add = True
+        else:
+            sum_speed = self._t_mean_prod_speed[i] - emptying_speed
+            if sum_speed < 0:
+                has_steps = oil // abs(sum_speed)
+                need_steps = -(-train.storage_volume // emptying_speed)
+                if has_steps >= need_steps:
+                    can_add = True
+            else:
+                can_add = True
+        return can_add
+
+    def __add_train_to_terminal(self, train: Train, i: int) -> bool:
+        can_add = self.__terminal_can_add(train, i)
+        if can_add:
+            train.state = TrainState.In_cargo_process
+            self._t_occupied[i] = True
+            self._t_trains[i] = train
+            self._t_train_oil[i] = train.oil_volume
+            self._t_train_storage[i] = train.storage_volume
+            self.__publish(EventType.Admitted, self._terminal_names[i], train.name, 0)
+        return can_add
+
+    def __entrepot_can_add(self, train: Train, i: int) -> bool:
+        """ Same preliminary simulation as Entrepot """
+
+        occupied = self._e_occupied[i]
+        free_tracks_num = int((self._e_track_exists[i] & ~occupied).sum())
+        sum_oil_volume = int(self._e_oil[i]) + train.oil_volume + int(self._e_train_oil[i][occupied].sum())
+
+        can_add = True
+        if free_tracks_num == 0:
+            can_add = False
+        elif sum_oil_volume <= self._e_storage_volume[i]:
+            if sum_oil_volume >= self._e_unload_limit[i] and not self._e_has_unloader[i] and free_tracks_num < 2:
+                can_add = False
+        else:
+            can_add = False
+        return can_add
+
+    def __add_train_to_entrepot(self, train: Train, i: int) -> bool:
+        can_add = self.__entrepot_can_add(train, i)
+        if can_add:
+            # First free track
+            j = int(np.argmax(self._e_track_exists[i] & ~self._e_occupied[i]))
+            train.state = TrainState.In_cargo_process
+            self._e_occupied[i, j] = True
+            self._e_trains[i, j] = train
+            self._e_train_oil[i, j] = train.oil_volume
+            self._e_train_storage[i, j] = train.storage_volume
+            self.__publish(EventType.Admitted, self._entrepot_names[i], train.name, j)
+        return can_add
+
+    def time_to_admission(self, train: Train, station_name: str) -> float:
+        """ Hours until the train can be added to the track of the station if nothing else happens """
+
+        if station_name not in self._index:
+            raise AttributeError('No such station name')
+        is_terminal, i = self._index[station_name]
+        if not is_terminal:
+            return 0 if self.__entrepot_can_add(train, i) else math.inf
+        if self._t_occupied[i]:
+            return math.inf
+        if self.__terminal_can_add(train, i):
+            return 0
+        # Same oil threshold as Terminal.time_to_admission
+        mean_prod_speed = self._t_mean_prod_speed[i]
+        emptying_speed = int(self._t_emptying_speed[i])
+        need_oil = min(train.storage_volume,
+                       math.ceil(train.storage_volume / emptying_speed) * abs(mean_prod_speed - emptying_speed))
+        if mean_prod_speed <= 0:
+            return math.inf
+        return float((need_oil - self._t_oil[i]) / mean_prod_speed)
+
+    def announce_train(self, train: Train, station_name: str, hours: float):
+        """ Stations have no storage forecast, so trains in transit are not used """
+
+        if station_name not in self._index:
+            raise AttributeError('No such station name')
+
+    def time_to_next_event(self) -> float:
+        """ Hours until the nearest station event, same as Terminal and Entrepot time_to_next_event """
+
+        times = [math.inf]
+        # Terminals: train is full or storage runs dry
+        occupied = self._t_occupied
+        if occupied.any():
+            times.append(((self._t_train_storage - self._t_train_oil)[occupied]
+                          / self._t_emptying_speed[occupied]).min())
+            sum_speed = self._t_mean_prod_speed - self._t_emptying_speed
+            is_draining = occupied & (sum_speed < 0)
+            if is_draining.any():
+                times.append((np.maximum(self._t_oil[is_draining], 0) / -sum_speed[is_draining]).min())
+
+        # Entrepots: train is empty, unloader train is full or storage has enough oil for the unloader train
+        is_unloader = self._e_occupied & self._e_is_unloader
+        is_unloading = self._e_occupied & ~self._e_is_unloader
+        if is_unloader.any():
+            free_space = self._e_train_storage - self._e_train_oil
+            times.append((free_space / self._e_emptying_speed[:, None])[is_unloader].min())
+        if is_unloading.any():
+            times.append((self._e_train_oil / self._e_filling_speed[:, None])[is_unloading].min())
+            unloading_trains_num = is_unloading.sum(axis=1)
+            sum_speed = self._e_filling_speed - self._e_emptying_speed
+            need_oil = np.ceil(self._e_unload_limit / self._e_emptying_speed) * np.abs(sum_speed)
+            is_waiting = ~self._e_has_unloader & (sum_speed < 0) & (unloading_trains_num > 0) & (need_oil > self._e_oil)
+            if is_waiting.any():
+                times.append(((need_oil - self._e_oil)[is_waiting]
+                              / (self._e_filling_speed * unloading_trains_num)[is_waiting]).min())
+        return float(min(times))
+
+    def __update_terminals(self, hours: int):
+        # Mine the oil
+        draws = self._rng.standard_normal(len(self._t_oil))
+        mean_prod = self._t_mean_prod_speed * hours
+        std_prod = self._t_std_prod_speed * math.sqrt(hours)
+        oil_mined = np.trunc(mean_prod + draws * std_prod).astype(np.int64)
+        self._t_last_oil_mined = oil_mined
+        self._t_has_mined = True
+        self._t_oil += oil_mined
+
+        # Fill the trains: a full step if there is enough oil, otherwise all the oil there is
+        occupied = self._t_occupied
+        emptying_amt = self._t_emptying_speed * hours
+        oil_amt = np.where(self._t_oil - emptying_amt > 0, emptying_amt, self._t_oil)
+        given = np.minimum(oil_amt, self._t_train_storage - self._t_train_oil)
+        given[~occupied] = 0
+        self._t_train_oil += given
+        self._t_oil -= given
+        self._t_last_oil_given = given
+        self._t_has_given = occupied.copy()
+
+        # Send full trains
+        for i in np.flatnonzero(occupied & (self._t_train_oil == self._t_train_storage)):
+            train = self._t_trains[i]
+            train.fill_storage(int(self._t_train_oil[i]) - train.oil_volume)
+            train.state = TrainState.Ready
+            self._t_trains[i] = None
+            self._t_occupied[i] = False
+
+    def __update_entrepots(self, hours: int):
+        occupied = self._e_occupied
+        free_tracks = self._e_track_exists & ~occupied
+
+        # Add unloader trains
+        sum_oil_volume = self._e_oil + np.where(occupied, self._e_train_oil, 0).sum(axis=1)
+        sum_speed = self._e_filling_speed - self._e_emptying_speed
+        has_steps = np.where(sum_speed < 0, self._e_oil // np.maximum(np.abs(sum_speed), 1), 0)
+        need_steps = np.ceil(self._e_unload_limit / self._e_emptying_speed)
+        is_added = (~self._e_has_unloader
+                    & free_tracks.any(axis=1)
+                    & (sum_oil_volume >= self._e_unload_limit)
+                    & ((sum_speed >= 0) | (has_steps >= need_steps)))
+        rows = np.flatnonzero(is_added)
+        cols = np.argmax(free_tracks[rows], axis=1)
+        occupied[rows, cols] = True
+        self._e_is_unloader[rows, cols] = True
+        self._e_train_oil[rows, cols] = 0
+        self._e_train_storage[rows, cols] = self._e_unload_limit[rows]
+        self._e_has_unloader[rows] = True
+        if self._event_bus is not None:
+            for i, j in zip(rows, cols):
+                self.__publish(EventType.Unloader_created, self._entrepot_names[i], UNLOADER_TRAIN_NAME, int(j))
+
+        # Load unloader trains and unload other trains
+        is_unloader = occupied & self._e_is_unloader
+        is_unloading = occupied & ~self._e_is_unloader
+        emptying_amt = self._e_emptying_speed[:, None] * hours
+        filling_amt = self._e_filling_speed[:, None] * hours
+        loaded = np.minimum(emptying_amt, self._e_train_storage - self._e_train_oil)
+        unloaded = np.minimum(filling_amt, self._e_train_oil)
+        collected = np.where(is_unloader, loaded, np.where(is_unloading, unloaded, 0))
+        self._e_train_oil = np.where(is_unloader, self._e_train_oil + loaded,
+                                     np.where(is_unloading, self._e_train_oil - unloaded, self._e_train_oil))
+        self._e_oil += np.where(is_unloader, -collected, collected).sum(axis=1)
+        self._e_last_collected = collected
+        self._e_has_collected = occupied.copy()
+        self._e_collected_unloader = is_unloader
+
+        # Send full unloader trains and empty trains
+        is_full = is_unloader & (self._e_train_oil == self._e_train_storage)
+        if self._event_bus is not None:
+            for i, j in zip(*np.nonzero(is_full)):
+                self.__publish(EventType.Unloader_filled, self._entrepot_names[i], UNLOADER_TRAIN_NAME, int(j),
+                               int(self._e_train_oil[i, j]))
+        self._e_has_unloader[is_full.any(axis=1)] = False
+        self._e_is_unloader[is_full] = False
+        occupied[is_full] = False
+        for i, j in zip(*np.nonzero(is_unloading & (self._e_train_oil == 0))):
+            train = self._e_trains[i, j]
+            train.empty_storage(train.oil_volume)
+            train.state = TrainState.Ready
+            self._e_trains[i, j] = None
+            occupied[i, j] = False
+
+    def update(self, hours: int = 1):
+        """ Updates stations state
+
+        Parameters
+        ----------
+        hours
+            Step length in whole hours
+        """
+
+        if hours != int(hours):
+            raise AttributeError('Only whole hour steps are supported')
+        self.__update_terminals(int(hours))
+        self.__update_entrepots(int(hours))
+
+    def write_snapshot(self, buffer: SnapshotBuffer):
+        """ Writes stations information into the snapshot buffer, same as StationManager.write_snapshot.
+        Stations go in the order of get_station_names: terminals first, so terminal track rows come first
+        and entrepot track rows follow in the order of existing tracks. Oil of trains on tracks is kept
+        in arrays until departure, so it is written over the train rows
+        """
+
+        n = len(self._terminal_names)
+        buffer.station_oil[:n] = self._t_oil
+        buffer.station_mined[:n] = self._t_last_oil_mined if self._t_has_mined else np.nan
+        buffer.station_oil[n:] = self._e_oil
+        buffer.station_mined[n:] = np.nan
+
+        occupied = self._t_occupied
+        buffer.track_collected[:n] = np.where(self._t_has_given, self._t_last_oil_given, np.nan)
+        buffer.track_storage[:n] = np.where(occupied, self._t_train_oil, np.nan)
+        buffer.track_train[:n] = NO_TRAIN
+        for i in np.flatnonzero(occupied).tolist():
+            train_id = buffer.train_id(self._t_trains[i].name)
+            buffer.track_train[i] = train_id
+            buffer.train_oil[train_id] = self._t_train_oil[i]
+
+        exists = self._e_track_exists
+        occupied = self._e_occupied[exists]
+        buffer.track_collected[n:] = np.where(self._e_has_collected[exists], self._e_last_collected[exists], np.nan)
+        buffer.track_storage[n:] = np.where(occupied, self._e_train_oil[exists], np.nan)
+        buffer.track_train[n:] = np.where(self._e_is_unloader[exists], UNLOADER_TRAIN, NO_TRAIN)
+        trains = self._e_trains[exists]
+        train_oil = self._e_train_oil[exists]
+        for row in np.flatnonzero(occupied & ~self._e_is_unloader[exists]).tolist():
+            train_id = buffer.train_id(trains[row].name)
+            buffer.track_train[n + row] = train_id
+            buffer.train_oil[train_id] = train_oil[row]
+
+    def get_stations_info(self) -> list[dict]:
+        """ Get stations logging info in the StationManager.get_stations_info format """
+
+        t_oil = self._t_oil.tolist()
+        t_mined = self._t_last_oil_mined.tolist()
+        t_given = self._t_last_oil_given.tolist()
+        t_train_oil = self._t_train_oil.tolist()
+        e_oil = self._e_oil.tolist()
+        e_collected = self._e_last_collected.tolist()
+        e_train_oil = self._e_train_oil.tolist()
+
+        info = []
+        for name in self._station_names:
+            is_terminal, i = self._index[name]
+            if is_terminal:
+                train = self._t_trains[i]
+                elem = {'oil_amt': t_oil[i],
+                        'oil_mined': t_mined[i] if self._t_has_mined else None,
+                        'train_name': train.name if train is not None else None,
+                        'oil_collected': t_given[i] if self._t_has_given[i] else None,
+                        'train_storage': t_train_oil[i] if train is not None else None}
+            else:
+                tracks = []
+                for j in range(int(self._e_track_exists[i].sum())):
+                    track = {'train_name': None,
+                             'oil_collected': e_collected[i][j] if self._e_has_collected[i, j] else None,
+                             'is_unloader': bool(self._e_collected_unloader[i, j]),
+                             'storage': None}
+                    if self._e_occupied[i, j]:
+                        if self._e_is_unloader[i, j]:
+                            track['train_name'] = UNLOADER_TRAIN_NAME
+                        else:
+                            track['train_name'] = self._e_trains[i, j].name
+                        track['storage'] = e_train_oil[i][j]
+                    tracks.append(track)
+                elem = {'oil_amt': e_oil[i], 'tracks': tracks}
+            info.append({name: elem})
+        return info
@@ -1,14 +1,35 @@
+import copy
+import math
+import random
 from datetime import datetime, timedelta
+from typing import Iterator, NamedTuple
 from manager.station_manager import StationManager
 from manager.train_manager import TrainManager
 from db_logger import Logger
+from event_logic.event_bus import EventBus
+from snapshot_logic.snapshot_buffer import SnapshotBuffer
+
+
+class StepRecord(NamedTuple):
+    """ Result of one simulation step """
+
+    time: datetime
+    """Simulation time of the step"""
+    hours: float
+    """Step length in hours"""
+    stations: list[dict]
+    """Stations info in StationManager.get_stations_info format. None if not requested"""
+    trains: list[dict]
+    """Trains departed during the step in TrainManager.get_trains_info format"""
 
 
 class Modeler:
     """ Runs a simulation for needed period of time """
 
     def __init__(self, starting_time: datetime, end_time: datetime,
-                 station_manager: StationManager, train_manager: TrainManager, logger: Logger = None):
+                 station_manager: StationManager, train_manager: TrainManager, logger: Logger = None,
+                 step: timedelta = timedelta(hours=1), adaptive: bool = False, max_step: timedelta = None,
+                 event_bus: EventBus = None, log_steps: bool = True):
         """
 
         Parameters
@@ -23,13 +44,32 @@ class Modeler:
             Train manager
         logger
             Logger to out to PostgreSQL
+        step
+            Simulation step length. All speeds are per hour and are scaled by the step length
+        adaptive
+            Take steps longer than step while no train or station is near an event
+            (arrival, full or empty train, empty storage, etc.)
+        max_step
+            Maximum step length in adaptive mode. Step multiplied by 24 if None
+        event_bus
+            Event bus shared with the managers. Its time is set at every step
+        log_steps
+            Print or log stations and trains info every step. Event bus subscribers can be used instead
         """
 
+        if step <= timedelta(0):
+            raise AttributeError('Step must be positive')
         self._station_manager = station_manager
         self._train_manager = train_manager
         self._starting_time = starting_time
         self._end_time = end_time
         self._logger = logger
+        self._step = step
+        self._adaptive = adaptive
+        self._max_step = max_step if max_step is not None else step * 24
+        self._event_bus = event_bus
+        self._log_steps = log_steps
+        self._simulation_time = starting_time
 
     def print_info(self, now: datetime):
         """ Prints stations and trains info to the console
@@ -48,28 +88,205 @@ class Modeler:
         for info in train_info:
             print(info)
 
-    def __add_info_to_db(self, now: datetime):
-        """ Out stations and trains info to the PostgreSQL
+    def __print_record(self, record: StepRecord):
+        print(record.time)
+        for info in record.stations:
+            print(info)
+        for info in record.trains:
+            print(info)
+
+    def __add_record_to_db(self, record: StepRecord):
+        """ Out stations and trains info to the PostgreSQL """
+
+        self._logger.insert_data(record.stations, record.trains, record.time)
+
+    def __next_step(self) -> timedelta:
+        """ Step length of the next simulation step """
+
+        if not self._adaptive:
+            return self._step
+        # Whole number of steps until the nearest event
+        time_to_event = min(self._train_manager.time_to_next_event(), self._station_manager.time_to_next_event())
+        if time_to_event == math.inf:
+            return self._max_step
+        steps_num = max(1, int(timedelta(hours=time_to_event) / self._step))
+        return min(self._step * steps_num, self._max_step)
+
+    def __advance(self) -> tuple[datetime, float]:
+        """ Runs the next simulation step. Returns the step time and length in hours, None if the simulation is over """
+
+        if self._simulation_time > self._end_time:
+            return None
+        simulation_time = self._simulation_time
+        step = self.__next_step()
+        hours = to_hours(step)
+        if self._event_bus is not None:
+            self._event_bus.time = simulation_time
+        self._train_manager.update(hours)
+        self._station_manager.update(hours)
+        self._simulation_time = simulation_time + step
+        return simulation_time, hours
+
+    @property
+    def simulation_time(self) -> datetime:
+        """datetime: Time of the next simulation step. Read only"""
+        return self._simulation_time
+
+    @property
+    def end_time(self) -> datetime:
+        """datetime: End time of simulation"""
+        return self._end_time
+
+    @end_time.setter
+    def end_time(self, value: datetime):
+        self._end_time = value
+
+    @property
+    def logger(self) -> Logger:
+        """Logger: Logger of simulation steps. Steps are printed if None"""
+        return self._logger
+
+    @logger.setter
+    def logger(self, value: Logger):
+        self._logger = value
+
+    @property
+    def station_manager(self) -> StationManager:
+        """StationManager: Station manager. Read only"""
+        return self._station_manager
+
+    @property
+    def train_manager(self) -> TrainManager:
+        """TrainManager: Train manager. Read only"""
+        return self._train_manager
+
+    def clone(self, logger: Logger = None) -> 'Modeler':
+        """ Structural copy of the running simulation: trains, stations, managers and random streams.
+
+        The clone continues from the current simulation time independently of the original, and both make
+        the same random draws. Cost depends on the number of trains and stations only, not on the simulated time.
+        Loggers and event bus subscribers are not copied: the clone gets the passed logger and an empty event bus
 
         Parameters
         ----------
-        now
-            Current step of simulation process
+        logger
+            Logger of the clone. Steps are printed if None
+        """
+
+        memo = dict()
+        # Terminals without their own stream draw from the global random module, which can not be copied.
+        # The clone gets a generator with the same state instead
+        rng = random.Random()
+        rng.setstate(random.getstate())
+        memo[id(random)] = rng
+        if self._logger is not None:
+            memo[id(self._logger)] = logger
+        if self._event_bus is not None:
+            event_bus = EventBus()
+            event_bus.time = self._event_bus.time
+            memo[id(self._event_bus)] = event_bus
+        clone = copy.deepcopy(self, memo)
+        clone._logger = logger
+        return clone
+
+    def iter_steps(self, include_stations: bool = True) -> Iterator[StepRecord]:
+        """ Runs the simulation lazily, one step per iteration.
+
+        Nothing is kept between steps, so runs of any length take constant memory. Stopping the iteration
+        stops the simulation, and the next call continues from the step where it stopped. For example,
+        itertools.islice(modeler.iter_steps(), 0, None, 24) takes every 24th step, and
+        itertools.takewhile(predicate, modeler.iter_steps()) stops at the first step that breaks predicate
+
+        Parameters
+        ----------
+        include_stations
+            Collect stations info every step
+
+        Yields
+        ------
+        StepRecord
+            Result of the step
+        """
+
+        while True:
+            advanced = self.__advance()
+            if advanced is None:
+                return
+            simulation_time, hours = advanced
+            stations_info = self._station_manager.get_stations_info() if include_stations else None
+            trains_info = self._train_manager.get_trains_info()
+            yield StepRecord(simulation_time, hours, stations_info, trains_info)
+
+    def create_snapshot_buffer(self) -> SnapshotBuffer:
+        """ Snapshot buffer sized for the stations and trains of the simulation """
+
+        return SnapshotBuffer(self._station_manager.get_station_names(),
+                              self._station_manager.get_tracks_nums(),
+                              self._train_manager.get_train_names())
+
+    def iter_snapshots(self, buffer: SnapshotBuffer = None) -> Iterator[SnapshotBuffer]:
+        """ Runs the simulation lazily like iter_steps, but stations and trains write their state into
+        the preallocated buffer instead of creating info dicts. The same buffer is yielded every step,
+        so consumers must copy what they want to keep before the next iteration
+
+        Parameters
+        ----------
+        buffer
+            Snapshot buffer to write to. Created with create_snapshot_buffer if None
+
+        Yields
+        ------
+        SnapshotBuffer
+            Buffer with the state after the step
         """
 
-        stations_info = self._station_manager.get_stations_info()
-        trains_info = self._train_manager.get_trains_info()
-        self._logger.insert_data(stations_info, trains_info, now)
-
-    def simulate(self):
-        """ Simulation cycle """
-
-        simulation_time = self._starting_time
-        while simulation_time <= self._end_time:
-            self._train_manager.update()
-            self._station_manager.update()
-            if self._logger is None:
-                self.print_info(simulation_time)
-            else:
-                self.__add_info_to_db(simulation_time)
-            simulation_time += timedelta(hours=1)
+        if buffer is None:
+            buffer = self.create_snapshot_buffer()
+        while True:
+            advanced = self.__advance()
+            if advanced is None:
+                return
+            # Stations write after trains: a station manager may keep the state of trains on its tracks
+            self._train_manager.write_snapshot(buffer)
+            self._station_manager.write_snapshot(buffer)
+            buffer.time, buffer.hours = advanced
+            yield buffer
+
+    def simulate_snapshots(self, sink):
+        """ Simulation cycle in snapshot mode
+
+        Parameters
+        ----------
+        sink
+            Object with insert_snapshot(buffer) method, e.g. SnapshotRecorder, called every step
+        """
+
+        for buffer in self.iter_snapshots():
+            sink.insert_snapshot(buffer)
+
+    def simulate(self, until: datetime = None):
+        """ Simulation cycle
+
+        Parameters
+        ----------
+        until
+            Stop before the first step after this time. Next call continues from there. Runs to the end if None
+        """
+
+        for record in self.iter_steps(include_stations=self._log_steps):
+            if self._log_steps:
+                if self._logger is None:
+                    self.__print_record(record)
+                else:
+                    self.__add_record_to_db(record)
+            if until is not None and self._simulation_time > until:
+                break
+
+
+def to_hours(step: timedelta):
+    """ Step length in hours. Whole hours are returned as int to keep oil amounts integer """
+
+    hours = step / timedelta(hours=1)
+    if hours.is_integer():
+        return int(hours)
+    return hours
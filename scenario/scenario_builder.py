@@ -0,0 +1,213 @@
+import copy
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+
+from station_logic.terminal import Terminal
+from station_logic.entrepot import Entrepot
+from train_logic.train import Train
+from train_logic.train_state import TrainState
+from train_logic.train_direction import TrainDirection
+from manager.station_manager import StationManager
+from manager.train_manager import TrainManager
+from modeler import Modeler
+from event_logic.event_bus import EventBus
+
+# Scenario section name -> file name in the init data directory
+SCENARIO_FILES = {'terminals': 'terminals.json',
+                  'entrepots': 'entrepot.json',
+                  'trains': 'trains.json',
+                  'distances': 'distances.json'}
+
+
+def load_scenario(data_dir: str = 'init_data') -> dict:
+    """ Loads scenario parameters from the init data directory
+
+    Parameters
+    ----------
+    data_dir
+        Directory with terminals.json, entrepot.json, trains.json and distances.json
+
+    Returns
+    -------
+    dict
+        <terminals> list: terminal parameters
+        <entrepots> list: entrepot parameters
+        <trains> list: train parameters
+        <distances> list: distances between stations
+    """
+
+    scenario = dict()
+    for section, file_name in SCENARIO_FILES.items():
+        with open(os.path.join(data_dir, file_name), 'r', encoding='utf-8') as f:
+            scenario[section] = json.load(f)
+    return scenario
+
+
+def scenario_key(scenario: dict) -> str:
+    """ Returns a stable hash of scenario parameters. Used to memoize simulation results """
+
+    dump = json.dumps(scenario, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(dump.encode('utf-8')).hexdigest()
+
+
+def build_station_manager(scenario: dict, production_rngs: dict = None, event_bus: EventBus = None,
+                          forecast_hours: int = None) -> StationManager:
+    if production_rngs is None:
+        production_rngs = dict()
+    terminals = [Terminal(**param, rng=production_rngs.get(param['station_name']), forecast_hours=forecast_hours)
+                 for param in scenario['terminals']]
+    entrepots = [Entrepot(**param, forecast_hours=forecast_hours) for param in scenario['entrepots']]
+    return StationManager(stations=[*terminals, *entrepots], event_bus=event_bus)
+
+
+def build_trains(scenario: dict) -> list[Train]:
+    trains = []
+    for param in scenario['trains']:
+        param = dict(param)
+        param['state'] = TrainState(param['state'])
+        param['direction'] = TrainDirection(param['direction'])
+        trains.append(Train(**param))
+    return trains
+
+
+def build_distances(scenario: dict) -> list[list]:
+    return [[param['point_a_name'], param['point_b_name'], param['distance']]
+            for param in scenario['distances']]
+
+
+def build_modeler(scenario: dict, starting_time: datetime, end_time: datetime, logger=None,
+                  production_rngs: dict = None, station_manager=None, step: timedelta = timedelta(hours=1),
+                  adaptive: bool = False, max_step: timedelta = None, event_bus: EventBus = None,
+                  log_steps: bool = True, forecast_hours: int = None) -> Modeler:
+    """ Creates simulation object from scenario parameters
+
+    Parameters
+    ----------
+    scenario
+        Scenario parameters in the init data format (see load_scenario)
+    starting_time
+        Starting time of simulation
+    end_time
+        End time of simulation
+    logger
+        Object with insert_data(stations_info, trains_info, time) method. Prints to the console if None
+    production_rngs
+        Terminal name -> random stream of oil production. Terminals without a stream use the global random module
+    station_manager
+        Prebuilt station manager, e.g. VectorizedStationManager. Built from scenario if None
+    step
+        Simulation step length
+    adaptive
+        Take longer steps while nothing is near an event
+    max_step
+        Maximum step length in adaptive mode
+    event_bus
+        Event bus for train and station transitions. A prebuilt station manager must be created with it
+    log_steps
+        Print or log stations and trains info every step
+    forecast_hours
+        Horizon of station storage forecasts used for admission and unloader trains. Step count estimates
+        are used if None and for decisions that depend on loading or unloading longer than the horizon, e.g.
+        a train filling for storage_volume / emptying_speed hours. Not used with a prebuilt station manager
+
+    Returns
+    -------
+    Modeler
+        Simulation object
+    """
+
+    if station_manager is None:
+        station_manager = build_station_manager(scenario, production_rngs, event_bus, forecast_hours)
+    train_manager = TrainManager(trains=build_trains(scenario),
+                                 station_manager=station_manager,
+                                 distances=build_distances(scenario),
+                                 event_bus=event_bus)
+    return Modeler(starting_time=starting_time,
+                   end_time=end_time,
+                   station_manager=station_manager,
+                   train_manager=train_manager,
+                   logger=logger,
+                   step=step,
+                   adaptive=adaptive,
+                   max_step=max_step,
+                   event_bus=event_bus,
+                   log_steps=log_steps)
+
+
+def apply_overrides(scenario: dict, overrides: dict) -> dict:
+    """ Returns a copy of scenario with changed parameters
+
+    Parameters
+    ----------
+    scenario
+        Scenario parameters in the init data format
+    overrides
+        Mapping of parameter path to value. Path formats:
+            terminals/<station name>/<field>
+            entrepots/<station name>/<field>
+            trains/<train name or load station name>/<field> - load station name changes all trains of the route
+            routes/<load station name>/fleet_size - number of trains on the route
+            distances/<station name A>/<station name B>
+
+    Returns
+    -------
+    dict
+        Changed scenario
+    """
+
+    scenario = copy.deepcopy(scenario)
+    # Fleet size goes first so that train parameters are applied to the added trains too
+    for path in sorted(overrides, key=lambda p: not p.startswith('routes/')):
+        section, selector, field = path.split('/')
+        value = overrides[path]
+        if section in ['terminals', 'entrepots']:
+            for param in scenario[section]:
+                if param['station_name'] == selector:
+                    param[field] = value
+                    break
+            else:
+                raise AttributeError(f'No such station name: {selector}')
+        elif section == 'trains':
+            matched = [param for param in scenario['trains']
+                       if selector in [param['name'], param['load_station_name']]]
+            if len(matched) == 0:
+                raise AttributeError(f'No such train or route: {selector}')
+            for param in matched:
+                param[field] = value
+        elif section == 'routes':
+            if field != 'fleet_size':
+                raise AttributeError(f'No such route parameter: {field}')
+            _set_fleet_size(scenario, selector, value)
+        elif section == 'distances':
+            for param in scenario['distances']:
+                if {param['point_a_name'], param['point_b_name']} == {selector, field}:
+                    param['distance'] = value
+                    break
+            else:
+                raise AttributeError(f'No distance between {selector} and {field}')
+        else:
+            raise AttributeError(f'No such scenario section: {section}')
+    return scenario
+
+
+def _set_fleet_size(scenario: dict, load_station_name: str, fleet_size: int):
+    """ Removes trains from the end of the route or adds copies of its last train """
+
+    route = [param for param in scenario['trains'] if param['load_station_name'] == load_station_name]
+    if len(route) == 0:
+        raise AttributeError(f'No such route: {load_station_name}')
+
+    for param in route[fleet_size:]:
+        scenario['trains'].remove(param)
+    template = route[-1]
+    for i in range(len(route), fleet_size):
+        # New trains start empty at the load station
+        param = dict(template)
+        param.update({'name': f'{template["name"]} ({i + 1})',
+                      'coord': 0,
+                      'state': TrainState.Arrived.value,
+                      'direction': TrainDirection.To_load_station.value,
+                      'oil_volume': 0})
+        scenario['trains'].append(param)
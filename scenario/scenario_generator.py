@@ -0,0 +1,69 @@
+import random
+
+from train_logic.train_state import TrainState
+from train_logic.train_direction import TrainDirection
+
+
+def generate_scenario(terminals_num: int, entrepots_num: int = 1, seed: int = 0,
+                      max_trains_per_terminal: int = 4) -> dict:
+    """ Generates a random scenario in the init data format with parameters in the range of init_data.
+
+    Every terminal is connected with one entrepot, entrepots get enough tracks and storage for their terminals
+
+    Parameters
+    ----------
+    terminals_num
+        Number of terminals
+    entrepots_num
+        Number of entrepots
+    seed
+        Random seed
+    max_trains_per_terminal
+        Each terminal gets from 1 to this number of trains
+
+    Returns
+    -------
+    dict
+        Scenario parameters
+    """
+
+    rnd = random.Random(seed)
+    scenario = {'terminals': [], 'entrepots': [], 'trains': [], 'distances': []}
+    entrepot_terminals_num = [0] * entrepots_num
+    for i in range(terminals_num):
+        terminal_name = f'Терминал {i + 1}'
+        entrepot_id = i % entrepots_num
+        entrepot_terminals_num[entrepot_id] += 1
+        scenario['terminals'].append({'station_name': terminal_name,
+                                      'oil_volume': rnd.randrange(0, 8000, 100),
+                                      'tracks_num': 1,
+                                      'emptying_speed': rnd.randrange(150, 300, 10),
+                                      'mean_prod_speed': rnd.randrange(30, 200, 5),
+                                      'std_prod_speed': rnd.randrange(1, 20)})
+        scenario['distances'].append({'point_a_name': terminal_name,
+                                      'point_b_name': f'Склад {entrepot_id + 1}',
+                                      'distance': rnd.randrange(500, 5000, 100)})
+        for j in range(rnd.randint(1, max_trains_per_terminal)):
+            storage_volume = rnd.randrange(3000, 7000, 500)
+            is_loaded = rnd.random() < 0.5
+            scenario['trains'].append({'name': f'Поезд {i + 1}-{j + 1}',
+                                       'load_station_name': terminal_name,
+                                       'unload_station_name': f'Склад {entrepot_id + 1}',
+                                       'velocity': rnd.randrange(30, 50, 5),
+                                       'storage_volume': storage_volume,
+                                       'coord': 0,
+                                       'state': TrainState.Arrived.value,
+                                       'direction': (TrainDirection.To_unload_station.value if is_loaded
+                                                     else TrainDirection.To_load_station.value),
+                                       'oil_volume': storage_volume if is_loaded else 0})
+
+    for i in range(entrepots_num):
+        tracks_num = max(3, entrepot_terminals_num[i] // 2)
+        scenario['entrepots'].append({'station_name': f'Склад {i + 1}',
+                                      'oil_volume': 0,
+                                      'tracks_num': tracks_num,
+                                      'emptying_speed': 100 * tracks_num,
+                                      'filling_speed': 200,
+                                      'storage_volume': 5000 * tracks_num,
+                                      'unload_limit': 10000})
+    return scenario
@@ -0,0 +1,143 @@
+import json
+import os
+import time
+import uuid
+
+QUEUE_DIRS = ('pending', 'running', 'done')
+
+
+class FileJobQueue:
+    """ Job queue in a local directory, shared by any number of submitting processes and one service.
+
+    A job is a JSON file moving from pending/ to running/ when the service claims it, and its result is
+    written to done/. Files are written under a temporary name and renamed, so readers never see partial files,
+    and claiming by rename is atomic. Jobs are claimed in submission order
+    """
+
+    def __init__(self, directory: str):
+        """
+        Parameters
+        ----------
+        directory
+            Queue directory. Created if it does not exist
+        """
+
+        self._directory = directory
+        for name in QUEUE_DIRS:
+            os.makedirs(os.path.join(directory, name), exist_ok=True)
+
+    @property
+    def directory(self) -> str:
+        """str: Queue directory. Read only"""
+        return self._directory
+
+    def __path(self, state: str, job_id: str) -> str:
+        return os.path.join(self._directory, state, f'{job_id}.json')
+
+    def __write(self, path: str, record: dict):
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False, default=str)
+        os.replace(temp_path, path)
+
+    def submit(self, job: dict) -> str:
+        """ Adds a job to the queue
+
+        Parameters
+        ----------
+        job
+            Job description, see SimulationService
+
+        Returns
+        -------
+        str
+            Job id. Names are ordered by submission time
+        """
+
+        job_id = f'{time.time_ns():020d}-{uuid.uuid4().hex[:8]}'
+        self.__write(self.__path('pending', job_id), {'id': job_id, 'submitted': time.time(), 'job': job})
+        return job_id
+
+    def pending_ids(self) -> list[str]:
+        names = os.listdir(os.path.join(self._directory, 'pending'))
+        return sorted(name[:-len('.json')] for name in names if name.endswith('.json'))
+
+    def claim(self) -> dict:
+        """ Takes the oldest pending job
+
+        Returns
+        -------
+        dict
+            Job record: <id>, <submitted> time in seconds since the epoch and <job>. None if nothing is pending
+        """
+
+        for job_id in self.pending_ids():
+            running_path = self.__path('running', job_id)
+            try:
+                os.rename(self.__path('pending', job_id), running_path)
+            except FileNotFoundError:  # claimed by somebody else
+                continue
+            with open(running_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return None
+
+    def complete(self, record: dict, result: dict = None, error: str = None):
+        """ Stores the result of a claimed job
+
+        Parameters
+        ----------
+        record
+            Job record returned by claim
+        result
+            Job result
+        error
+            Error message if the job failed
+        """
+
+        self.__write(self.__path('done', record['id']),
+                     {'id': record['id'], 'job': record['job'], 'result': result, 'error': error})
+        running_path = self.__path('running', record['id'])
+        if os.path.exists(running_path):
+            os.remove(running_path)
+
+    def requeue_running(self) -> int:
+        """ Returns jobs left running by a stopped service to the queue
+
+        Returns
+        -------
+        int
+            Number of returned jobs
+        """
+
+        running_dir = os.path.join(self._directory, 'running')
+        names = [name for name in os.listdir(running_dir) if name.endswith('.json')]
+        for name in names:
+            os.replace(os.path.join(running_dir, name), os.path.join(self._directory, 'pending', name))
+        return len(names)
+
+    def result(self, job_id: str, timeout: float = None, poll_interval: float = 0.05) -> dict:
+        """ Waits for the job result
+
+        Parameters
+        ----------
+        job_id
+            Id returned by submit
+        timeout
+            Seconds to wait. Waits forever if None
+        poll_interval
+            Seconds between checks
+
+        Returns
+        -------
+        dict
+            Done record: <id>, <job>, <result> and <error>. None on timeout
+        """
+
+        path = self.__path('done', job_id)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not os.path.exists(path):
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(poll_interval)
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
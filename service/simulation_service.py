@@ -0,0 +1,216 @@
+import math
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from datetime import timedelta
+
+import numpy as np
+
+from analysis.replication import STARTING_TIME, run_replication
+from analysis.rollups import RollupLogger
+from scenario.scenario_builder import build_modeler, load_scenario
+from service.job_queue import FileJobQueue
+from snapshot_logic.snapshot_recorder import SnapshotRecorder
+from station_logic.production_random import create_production_rngs
+
+SINK_TYPES = ('metrics', 'rollups', 'snapshots')
+
+# Scenarios loaded by the worker process: init data directory -> scenario
+_scenarios = dict()
+
+
+class SimulationService:
+    """ Long-lived local service running simulation jobs from a FileJobQueue on a pool of warm worker processes.
+
+    Workers import the simulation modules and load the preloaded scenarios once at start, so a job costs
+    only its simulation. Scenarios given by path are also cached by the worker on first use.
+
+    A job is a dict:
+        <scenario> str or dict: init data directory or inline scenario in the init data format
+        <seed> int: random seed of oil production, 0 if missing
+        <horizon_hours> int: simulation length in hours, 720 if missing
+        <sink> dict: output, {'type': 'metrics'} if missing -
+            {'type': 'metrics'}: RunMetrics result with production control, as run_replication
+            {'type': 'rollups', 'resolution': 'daily'}: rollups of station oil and tracks at the resolution
+            {'type': 'snapshots', 'path': 'run.npz'}: SnapshotRecorder history saved with numpy.savez
+    """
+
+    def __init__(self, queue: FileJobQueue, workers: int = None, preload: list[str] = None,
+                 poll_interval: float = 0.05):
+        """
+        Parameters
+        ----------
+        queue
+            Job queue
+        workers
+            Number of worker processes. CPU count if None
+        preload
+            Init data directories to load in every worker at start
+        poll_interval
+            Seconds between queue checks while there is nothing to do
+        """
+
+        self._queue = queue
+        self._workers = workers if workers is not None else os.cpu_count() or 1
+        self._preload = list(preload) if preload is not None else []
+        self._poll_interval = poll_interval
+        self._jobs = []
+        self._first_claim = None
+        self._last_done = None
+
+    def serve(self, max_jobs: int = None, idle_timeout: float = None):
+        """ Runs jobs until stopped
+
+        Parameters
+        ----------
+        max_jobs
+            Stop after this number of jobs. Never if None
+        idle_timeout
+            Stop after this number of seconds with an empty queue. Never if None
+        """
+
+        self._queue.requeue_running()
+        # A few jobs wait in the pool queue so workers never idle between jobs
+        max_in_flight = self._workers * 2
+        claimed = 0
+        in_flight = dict()
+        idle_since = time.monotonic()
+        with ProcessPoolExecutor(max_workers=self._workers, initializer=_init_worker,
+                                 initargs=(self._preload,)) as executor:
+            try:
+                while max_jobs is None or claimed < max_jobs or len(in_flight) > 0:
+                    while len(in_flight) < max_in_flight and (max_jobs is None or claimed < max_jobs):
+                        record = self._queue.claim()
+                        if record is None:
+                            break
+                        claimed += 1
+                        if self._first_claim is None:
+                            self._first_claim = time.time()
+                        in_flight[executor.submit(run_job, record['job'])] = record
+
+                    if len(in_flight) == 0:
+                        if idle_timeout is not None and time.monotonic() - idle_since >= idle_timeout:
+                            break
+                        time.sleep(self._poll_interval)
+                        continue
+                    done, _ = wait(in_flight, timeout=self._poll_interval, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.__complete(in_flight.pop(future), future)
+                    idle_since = time.monotonic()
+            except KeyboardInterrupt:
+                for future in in_flight:
+                    future.cancel()
+                self._queue.requeue_running()
+
+    def __complete(self, record: dict, future: Future):
+        error = None
+        try:
+            result, run_seconds = future.result()
+        except Exception as e:
+            result, run_seconds = None, math.nan
+            error = f'{type(e).__name__}: {e}'
+        self._last_done = time.time()
+        stats = {'id': record['id'],
+                 'latency_seconds': self._last_done - record['submitted'],
+                 'run_seconds': run_seconds,
+                 'failed': error is not None}
+        self._jobs.append(stats)
+        if result is not None:
+            result = dict(result, latency_seconds=stats['latency_seconds'], run_seconds=run_seconds)
+        self._queue.complete(record, result, error)
+
+    def stats(self) -> dict:
+        """ Statistics of the jobs run so far
+
+        Returns
+        -------
+        dict
+            <jobs> int: number of finished jobs
+            <failed> int: number of failed jobs
+            <throughput> float: jobs per second from the first claim to the last finished job
+            <latency_mean> float: mean seconds from submission to result
+            <latency_p50> float: median latency
+            <latency_p95> float: 95th percentile of latency
+            <run_mean> float: mean seconds of simulation in the worker
+            <per_job> list: per job <id>, <latency_seconds>, <run_seconds> and <failed>
+        """
+
+        latencies = np.array([job['latency_seconds'] for job in self._jobs])
+        runs = np.array([job['run_seconds'] for job in self._jobs if not job['failed']])
+        elapsed = self._last_done - self._first_claim if len(self._jobs) > 0 else 0.0
+        return {'jobs': len(self._jobs),
+                'failed': sum(job['failed'] for job in self._jobs),
+                'throughput': len(self._jobs) / elapsed if elapsed > 0 else math.nan,
+                'latency_mean': float(latencies.mean()) if len(latencies) > 0 else math.nan,
+                'latency_p50': float(np.percentile(latencies, 50)) if len(latencies) > 0 else math.nan,
+                'latency_p95': float(np.percentile(latencies, 95)) if len(latencies) > 0 else math.nan,
+                'run_mean': float(runs.mean()) if len(runs) > 0 else math.nan,
+                'per_job': list(self._jobs)}
+
+
+def _init_worker(preload: list[str]):
+    for data_dir in preload:
+        _scenario(data_dir)
+
+
+def _scenario(scenario) -> dict:
+    if isinstance(scenario, dict):
+        return scenario
+    path = os.path.abspath(scenario)
+    if path not in _scenarios:
+        _scenarios[path] = load_scenario(path)
+    return _scenarios[path]
+
+
+def run_job(job: dict) -> tuple[dict, float]:
+    """ Runs a job in the current process
+
+    Returns
+    -------
+    tuple[dict, float]
+        Job result and seconds spent
+    """
+
+    started = time.perf_counter()
+    scenario = _scenario(job.get('scenario', 'init_data'))
+    seed = job.get('seed', 0)
+    horizon_hours = job.get('horizon_hours', 24 * 30)
+    sink = job.get('sink', {'type': 'metrics'})
+    if sink['type'] not in SINK_TYPES:
+        raise AttributeError(f'Unknown sink type {sink["type"]}')
+
+    if sink['type'] == 'metrics':
+        result = run_replication(scenario, seed, horizon_hours)
+    else:
+        rngs = create_production_rngs(seed, [param['station_name'] for param in scenario['terminals']])
+        modeler = build_modeler(scenario, STARTING_TIME, STARTING_TIME + timedelta(hours=horizon_hours),
+                                production_rngs=rngs, log_steps=False)
+        if sink['type'] == 'rollups':
+            resolution = sink.get('resolution', 'daily')
+            rollups = RollupLogger()
+            modeler.simulate_snapshots(rollups)
+            result = {'rollups': [{'station': station_name, 'track': track, 'field': field,
+                                   'rows': rollups.rollup((station_name, track, field), resolution).rows()}
+                                  for station_name, track, field in rollups.series()]}
+        else:
+            recorder = SnapshotRecorder(modeler.create_snapshot_buffer(), horizon_hours + 1)
+            modeler.simulate_snapshots(recorder)
+            steps_num = recorder.steps_num
+            np.savez(sink['path'], times=recorder.times[:steps_num], stations=recorder.stations[:steps_num],
+                     tracks=recorder.tracks[:steps_num], trains=recorder.trains[:steps_num])
+            result = {'path': sink['path'], 'steps': steps_num}
+    return result, time.perf_counter() - started
+
+
+def main(queue_dir: str = 'jobs', workers: int = None, preload: list[str] = None):
+    service = SimulationService(FileJobQueue(queue_dir), workers, preload if preload is not None else ['init_data'])
+    try:
+        service.serve()
+    finally:
+        stats = service.stats()
+        print(f'{stats["jobs"]} jobs, {stats["failed"]} failed, {stats["throughput"]:.1f} jobs/s, '
+              f'latency mean {stats["latency_mean"]:.3f} s, p95 {stats["latency_p95"]:.3f} s')
+
+
+if __name__ == '__main__':
+    main()
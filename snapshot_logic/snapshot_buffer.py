@@ -0,0 +1,78 @@
+from datetime import datetime
+
+import numpy as np
+
+# Train id of a free track and of an unloader train
+NO_TRAIN = -1
+UNLOADER_TRAIN = -2
+
+STATION_DTYPE = np.dtype([('oil_amt', np.float64),
+                          ('oil_mined', np.float64)])
+TRACK_DTYPE = np.dtype([('station', np.int32),
+                        ('track', np.int32),
+                        ('train', np.int32),
+                        ('oil_collected', np.float64),
+                        ('storage', np.float64)])
+TRAIN_DTYPE = np.dtype([('state', np.int8),
+                        ('direction', np.int8),
+                        ('oil', np.float64),
+                        ('coord', np.float64),
+                        ('cargo_time', np.float64)])
+
+
+class SnapshotBuffer:
+    """ Preallocated structured arrays with the state of stations, tracks and trains after a simulation step.
+
+    The same buffer is overwritten every step, so no info dicts are created per step. Missing values
+    (no mined oil yet, free track, train has not departed during the step) are NaN, train ids of free tracks
+    are NO_TRAIN and of unloader trains UNLOADER_TRAIN
+    """
+
+    def __init__(self, station_names: list[str], tracks_nums: list[int], train_names: list[str]):
+        """
+        Parameters
+        ----------
+        station_names
+            Station names in the order of station manager
+        tracks_nums
+            Number of tracks of every station
+        train_names
+            Train names in the order of train manager
+        """
+
+        self.station_names = list(station_names)
+        self.train_names = list(train_names)
+        self.train_ids = dict((name, i) for i, name in enumerate(train_names))
+        self.time: datetime = None
+        self.hours: float = None
+
+        self.stations = np.zeros(len(station_names), dtype=STATION_DTYPE)
+        self.tracks = np.zeros(sum(tracks_nums), dtype=TRACK_DTYPE)
+        self.trains = np.zeros(len(train_names), dtype=TRAIN_DTYPE)
+        # First track row of every station
+        self.track_offsets = np.concatenate([[0], np.cumsum(tracks_nums)[:-1]]).astype(np.int64).tolist()
+        for i, (offset, tracks_num) in enumerate(zip(self.track_offsets, tracks_nums)):
+            self.tracks['station'][offset:offset + tracks_num] = i
+            self.tracks['track'][offset:offset + tracks_num] = np.arange(tracks_num)
+
+        # Column views for fast per-element writes
+        self.station_oil = self.stations['oil_amt']
+        self.station_mined = self.stations['oil_mined']
+        self.track_train = self.tracks['train']
+        self.track_collected = self.tracks['oil_collected']
+        self.track_storage = self.tracks['storage']
+        self.train_state = self.trains['state']
+        self.train_direction = self.trains['direction']
+        self.train_oil = self.trains['oil']
+        self.train_coord = self.trains['coord']
+        self.train_cargo_time = self.trains['cargo_time']
+
+    def track_rows(self, station_id: int) -> slice:
+        """ Track rows of the station """
+
+        start = self.track_offsets[station_id]
+        end = self.track_offsets[station_id + 1] if station_id + 1 < len(self.track_offsets) else len(self.tracks)
+        return slice(start, end)
+
+    def train_id(self, name: str) -> int:
+        return self.train_ids.get(name, UNLOADER_TRAIN)
@@ -0,0 +1,32 @@
+import numpy as np
+
+from snapshot_logic.snapshot_buffer import SnapshotBuffer
+
+
+class SnapshotRecorder:
+    """ Copies snapshots of every step into preallocated history arrays """
+
+    def __init__(self, buffer: SnapshotBuffer, steps_num: int):
+        """
+        Parameters
+        ----------
+        buffer
+            Snapshot buffer the simulation writes to
+        steps_num
+            Maximum number of steps to record
+        """
+
+        self.times = np.zeros(steps_num, dtype='datetime64[s]')
+        self.stations = np.zeros((steps_num, len(buffer.stations)), dtype=buffer.stations.dtype)
+        self.tracks = np.zeros((steps_num, len(buffer.tracks)), dtype=buffer.tracks.dtype)
+        self.trains = np.zeros((steps_num, len(buffer.trains)), dtype=buffer.trains.dtype)
+        self.steps_num = 0
+
+    def insert_snapshot(self, buffer: SnapshotBuffer):
+        if self.steps_num == len(self.times):
+            raise OverflowError('Recorder is full')
+        self.times[self.steps_num] = buffer.time
+        self.stations[self.steps_num] = buffer.stations
+        self.tracks[self.steps_num] = buffer.tracks
+        self.trains[self.steps_num] = buffer.trains
+        self.steps_num += 1
@@ -1,12 +1,24 @@
 import math
 
+from event_logic.event_type import EventType
+from station_logic.storage_forecast import StorageForecast
 from station_logic.train_station import TrainStation
 from train_logic.train import Train
 from train_logic.train_state import TrainState
 
+UNLOADER_TRAIN_NAME = 'Разгрузочный'
+
 
 class Entrepot(TrainStation):
-    """ Entrepot station where oil is unloaded """
+    """ Entrepot station where oil is unloaded.
+
+    With a forecast horizon the entrepot keeps a storage forecast with the unloading of trains on the tracks,
+    the loading of the unloader train and, tentatively, the unloading of loaded trains announced in transit.
+    A train is admitted if the forecast with its oil stays within the storage volume, and the last free track
+    is kept for the unloader train if the forecast reaches the unload limit. The unloader train is added if the
+    forecast with trains in transit does not run dry while it is loaded. Decisions that depend on flows ending
+    after the horizon are taken by step counts
+    """
 
     def __init__(self,
                  station_name: str,
@@ -15,7 +27,8 @@ class Entrepot(TrainStation):
                  emptying_speed: int,
                  filling_speed: int,
                  storage_volume: int,
-                 unload_limit: int):
+                 unload_limit: int,
+                 forecast_hours: int = None):
         """
         Parameters
         ----------
@@ -33,6 +46,10 @@ class Entrepot(TrainStation):
             Maximum oil amount that station can store
         unload_limit
             Unloader train storage size
+        forecast_hours
+            Horizon of the storage forecast used for admission and the unloader train. Step count estimates
+            are used if None and when unloading a train or loading the unloader train takes longer than
+            the horizon, so it should cover storage_volume / filling_speed and unload_limit / emptying_speed
         """
 
         super().__init__(station_name, oil_volume, tracks_num)
@@ -42,6 +59,30 @@ class Entrepot(TrainStation):
         self._unload_limit = unload_limit
         self._unloader_train = None
         self._last_collected_oil_per_track = [None] * tracks_num
+        # Track where the unloader train was loaded during the last step. The train may have left already
+        self._last_unloader_track = None
+        self._forecast = None
+        if forecast_hours is not None:
+            self._forecast = StorageForecast(oil_volume, 0, forecast_hours)
+
+    @property
+    def storage_volume(self) -> int:
+        """int: Maximum oil amount that station can store. Read only"""
+        return self._storage_volume
+
+    @property
+    def forecast(self) -> StorageForecast:
+        """StorageForecast: Storage forecast. None without a forecast horizon. Read only"""
+        return self._forecast
+
+    @property
+    def last_track_oil(self) -> list[int]:
+        """list[int]: Oil collected from the train on every track during the last step. Read only"""
+        return self._last_collected_oil_per_track
+
+    def add_tracks(self, tracks_num: int):
+        super().add_tracks(tracks_num)
+        self._last_collected_oil_per_track.extend([None] * tracks_num)
 
     def get_info(self) -> dict:
         """ Get entrepot condition info
@@ -53,12 +94,14 @@ class Entrepot(TrainStation):
             <tracks> list: list of tracks where elements consist of -
                     <train_name> str: name of train on the track. None if track is free
                     <oil_collected> int: amount of train's collected oil during the last step
+                    <is_unloader> bool: the oil was collected by the unloader train, which may have left the track
                     <storage> int: amount of oil in train storage
         """
 
         tracks_info = []
         for i, track in enumerate(self._tracks):
-            elem = {'train_name': None, 'oil_collected': self._last_collected_oil_per_track[i], 'storage': None}
+            elem = {'train_name': None, 'oil_collected': self._last_collected_oil_per_track[i],
+                    'is_unloader': i == self._last_unloader_track, 'storage': None}
             if track is not None:
                 elem['train_name'] = track.name
                 elem['storage'] = track.oil_volume
@@ -81,6 +124,11 @@ class Entrepot(TrainStation):
             True if train can be added successfully, False otherwise
         """
 
+        if (self._forecast is not None
+                and max(self._forecast.end_hour, train.oil_volume / self._filling_speed)
+                <= self._forecast.horizon_hours):
+            return self.__forecast_can_add(train)
+
         # Calculating the total amount of oil (the amount of oil in trains + storage + arriving train)
         # and the number of free railway tracks
         sum_oil_volume = self._oil_volume + train.oil_volume
@@ -106,6 +154,26 @@ class Entrepot(TrainStation):
             can_add = False
         return can_add
 
+    def __forecast_can_add(self, train: Train) -> bool:
+        """ Preliminary simulation of train adding process by the storage forecast """
+
+        free_tracks_num = self._tracks.count(None)
+        if free_tracks_num == 0:
+            return False
+        peak = self._forecast.max_level(rate=self._filling_speed, amount=train.oil_volume)
+        if peak > self._storage_volume:
+            return False
+        # The last free track is kept for the unloader train if the oil will be enough for it
+        if self._unloader_train is None and free_tracks_num < 2 and peak >= self._unload_limit:
+            return False
+        return True
+
+    def announce_train(self, train: Train, hours: float):
+        """ Adds the oil of a loaded train arriving in the given hours to the forecast as tentative """
+
+        if self._forecast is not None and train.oil_volume > 0:
+            self._forecast.add_flow(train.name, hours, self._filling_speed, train.oil_volume, tentative=True)
+
     def add_train_to_track(self, train: Train) -> bool:
         """ Add a train to the track
 
@@ -121,6 +189,9 @@ class Entrepot(TrainStation):
         """
 
         is_added = False
+        if self._forecast is not None:
+            # The train has arrived, so it is not in transit anymore
+            self._forecast.remove_flow(train.name)
         # Trying to add a train to the track by doing a presimulation
         if self.__pre_simulate(train):
             is_added = True
@@ -130,12 +201,25 @@ class Entrepot(TrainStation):
                     # Put a train to this track
                     train.state = TrainState.In_cargo_process
                     self._tracks[i] = train
+                    if self._forecast is not None:
+                        self._forecast.add_flow(train.name, 0, self._filling_speed, train.oil_volume)
+                    self._publish(EventType.Admitted, train.name, i)
                     break
         return is_added
 
     def __unloader_train_adding_logic(self):
         """ Logic of adding an unloader train to the station """
 
+        loading_hours = self._unload_limit / self._emptying_speed
+        if self._forecast is not None and loading_hours <= self._forecast.horizon_hours:
+            if self._unloader_train is None and None in self._tracks:
+                # The oil must suffice for the whole unloader train before the trajectory is looked at
+                if (self._forecast.level(loading_hours, tentative=True) >= self._unload_limit
+                        and self._forecast.min_level(until=loading_hours, tentative=True, rate=-self._emptying_speed,
+                                                     amount=self._unload_limit) >= 0):
+                    self.__add_unloader_train()
+            return
+
         # Calculating the total amount of oil (the volume of oil in trains + storage)
         # and the number of free railway tracks
         sum_oil_volume = self._oil_volume
@@ -164,36 +248,48 @@ class Entrepot(TrainStation):
                     is_added = True
 
             if is_added:
-                # Create an unloader train
-                unloader_train = create_unload_train(self._station_name, self._unload_limit)
-
-                for i, track in enumerate(self._tracks):
-                    # Looking for the first free track
-                    if track is None:
-                        # Adding an unloader train
-                        self._unloader_train = unloader_train
-                        # Put unloader train to the track
-                        self._tracks[i] = unloader_train
-                        break
-
-    def __fill_storage(self):
+                self.__add_unloader_train()
+
+    def __add_unloader_train(self):
+        """ Puts a new unloader train to the first free track """
+
+        # Create an unloader train
+        unloader_train = create_unload_train(self._station_name, self._unload_limit)
+
+        for i, track in enumerate(self._tracks):
+            # Looking for the first free track
+            if track is None:
+                # Adding an unloader train
+                self._unloader_train = unloader_train
+                # Put unloader train to the track
+                self._tracks[i] = unloader_train
+                if self._forecast is not None:
+                    self._forecast.add_flow(unloader_train.name, 0, -self._emptying_speed, self._unload_limit)
+                self._publish(EventType.Unloader_created, unloader_train.name, i)
+                break
+
+    def __fill_storage(self, hours: float):
         """ Fill the station storage """
 
+        emptying_amt = self._emptying_speed * hours
+        filling_amt = self._filling_speed * hours
         # Collecting the oil
         collected_oil = 0
         self._last_collected_oil_per_track = [None] * len(self._tracks)
+        self._last_unloader_track = None
         for i, train in enumerate(self._tracks):
             if train is not None:
                 # Checking if the train is an unloader train
                 if train == self._unloader_train:
                     # Loading oil into the unloader train
-                    oil_amt = self._emptying_speed - train.fill_storage(self._emptying_speed)
+                    oil_amt = emptying_amt - train.fill_storage(emptying_amt)
                     collected_oil -= oil_amt
                     # Logging logic
                     self._last_collected_oil_per_track[i] = oil_amt
+                    self._last_unloader_track = i
                 else:
                     # Unloading oil from train
-                    oil_amt = train.empty_storage(self._filling_speed)
+                    oil_amt = train.empty_storage(filling_amt)
                     collected_oil += oil_amt
                     # Logging logic
                     self._last_collected_oil_per_track[i] = oil_amt
@@ -211,6 +307,7 @@ class Entrepot(TrainStation):
                     if train.is_full():
                         # Removing the train from the track
                         self._tracks[i] = None
+                        self._publish(EventType.Unloader_filled, train.name, i, train.oil_volume)
                         # Removing the unloader train
                         self._unloader_train = None
                 else:
@@ -221,13 +318,52 @@ class Entrepot(TrainStation):
                         # Removing the train from the track
                         self._tracks[i] = None
 
-    def update(self):
+    def time_to_next_event(self) -> float:
+        """ Hours until a train on the track is empty, the unloader train is full
+        or the storage has enough oil to add the unloader train
+        """
+
+        time = math.inf
+        unloading_trains_num = 0
+        for train in self._tracks:
+            if train is None:
+                continue
+            if train == self._unloader_train:
+                time = min(time, train.get_free_storage_space() / self._emptying_speed)
+            else:
+                time = min(time, train.oil_volume / self._filling_speed)
+                unloading_trains_num += 1
+
+        # The unloader train waits for enough oil in the storage
+        sum_speed = self._filling_speed - self._emptying_speed
+        if self._unloader_train is None and sum_speed < 0 and unloading_trains_num > 0:
+            need_oil = math.ceil(self._unload_limit / self._emptying_speed) * abs(sum_speed)
+            if need_oil > self._oil_volume:
+                time = min(time, (need_oil - self._oil_volume) / (self._filling_speed * unloading_trains_num))
+        return time
+
+    def time_to_admission(self, train: Train) -> float:
+        """ Hours until the train can be added to the track. The answer changes only with station events """
+
+        return 0 if self.__pre_simulate(train) else math.inf
+
+    def update(self, hours: float = 1):
+        """ Updates station state
+
+        Parameters
+        ----------
+        hours
+            Step length in hours
+        """
+
         # Add unloader train
         self.__unloader_train_adding_logic()
         # Loading/unloading trains and fill the station storage
-        self.__fill_storage()
+        self.__fill_storage(hours)
         # Trains departing
         self.__send_trains()
+        if self._forecast is not None:
+            self._forecast.advance(hours, self._oil_volume)
 
 
 def create_unload_train(station_name: str, storage_volume: int):
@@ -245,7 +381,7 @@ def create_unload_train(station_name: str, storage_volume: int):
         New unloader train with 0 oil volume
     """
 
-    train = Train(name='Разгрузочный',
+    train = Train(name=UNLOADER_TRAIN_NAME,
                   load_station_name=station_name,
                   unload_station_name='',
                   velocity=0,
@@ -0,0 +1,63 @@
+import hashlib
+import random
+
+
+def production_stream_seed(seed: int, station_name: str) -> int:
+    """ Seed of the station's own random stream. Depends only on the base seed and the station name,
+    so the station gets the same stream in any scenario
+    """
+
+    digest = hashlib.sha1(f'{seed}:{station_name}'.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'little')
+
+
+class ProductionRandom(random.Random):
+    """ Random stream of oil production.
+
+    Keeps the sum of standard normal draws, whose expectation is 0, to be used as a control variate.
+    In antithetic mode every standard normal draw is negated
+    """
+
+    def __init__(self, seed: int = None, antithetic: bool = False):
+        """
+        Parameters
+        ----------
+        seed
+            Stream seed
+        antithetic
+            Negate standard normal draws
+        """
+
+        super().__init__(seed)
+        self._antithetic = antithetic
+        self.draws = 0
+        self.z_sum = 0.0
+
+    def normalvariate(self, mu: float = 0.0, sigma: float = 1.0) -> float:
+        z = super().normalvariate(0.0, 1.0)
+        if self._antithetic:
+            z = -z
+        self.draws += 1
+        self.z_sum += z
+        return mu + z * sigma
+
+
+def create_production_rngs(seed: int, station_names: list[str], antithetic: bool = False) -> dict[str, ProductionRandom]:
+    """ Creates independent production streams for stations
+
+    Parameters
+    ----------
+    seed
+        Base seed
+    station_names
+        Station names
+    antithetic
+        Create antithetic streams
+
+    Returns
+    -------
+    dict[str, ProductionRandom]
+        Station name -> random stream
+    """
+
+    return dict((name, ProductionRandom(production_stream_seed(seed, name), antithetic)) for name in station_names)
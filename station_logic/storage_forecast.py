@@ -0,0 +1,192 @@
+import numpy as np
+
+
+class StorageForecast:
+    """ Expected storage level of a station for the next hours at mean rates.
+
+    The level changes by a constant base rate (terminal production) and by flows: oil moved at a constant rate
+    from a start hour until an amount is moved, like a train loading or unloading on a track. Levels are kept
+    per hour and changed by the profile of a flow when it is added or removed, and shifted when time passes,
+    so lookups do not rebuild the trajectory. Tentative flows (trains announced in transit) are kept apart
+    and only count in lookups that ask for them
+    """
+
+    def __init__(self, level: float, base_rate: float, horizon_hours: int):
+        """
+        Parameters
+        ----------
+        level
+            Current storage level
+        base_rate
+            Level change per hour without flows
+        horizon_hours
+            Forecast length in whole hours
+        """
+
+        if horizon_hours < 1:
+            raise AttributeError('Forecast horizon must be at least one hour')
+        self._base_rate = base_rate
+        self._hours = np.arange(horizon_hours + 1, dtype=np.float64)
+        # Levels at whole hours are kept in a buffer several horizons long: the forecast starts at the head, which
+        # moves when time passes, and the buffer is compacted when the head reaches its end. The actual level is
+        # kept as an offset, so anchoring to it does not touch the buffer either
+        self._buffer = np.zeros(4 * (horizon_hours + 1))
+        self._buffer[:horizon_hours + 1] = base_rate * self._hours
+        # Change of the level by tentative flows
+        self._tentative_buffer = np.zeros(len(self._buffer))
+        self._head = 0
+        self._offset = level
+        self._tentative_offset = 0.0
+        # Key -> [start, rate, amount, is tentative]. Start is in hours from now and is negative for running flows
+        self._flows = dict()
+
+    @property
+    def horizon_hours(self) -> int:
+        """int: Forecast length in hours. Read only"""
+        return len(self._hours) - 1
+
+    @property
+    def end_hour(self) -> float:
+        """float: Hours from now until all flows that are not tentative are over. Read only"""
+        return max([start + amount / abs(rate) for start, rate, amount, tentative in self._flows.values()
+                    if not tentative], default=0.0)
+
+    def __profile(self, start: float, rate: float, amount: float, hours: np.ndarray) -> np.ndarray:
+        """ Oil moved by the flow from now until every hour, signed like the rate """
+
+        moved = np.clip(abs(rate) * (hours - start), 0, amount) - min(max(-abs(rate) * start, 0), amount)
+        return moved if rate > 0 else -moved
+
+    def __view(self, tentative: bool) -> np.ndarray:
+        buffer = self._tentative_buffer if tentative else self._buffer
+        return buffer[self._head:self._head + len(self._hours)]
+
+    def add_flow(self, key, start: float, rate: float, amount: float, tentative: bool = False):
+        """ Adds a flow. A flow with the same key is replaced
+
+        Parameters
+        ----------
+        key
+            Flow key, e.g. train name
+        start
+            Hours from now when the flow starts
+        rate
+            Oil moved per hour: positive into the storage, negative out of it
+        amount
+            Oil amount moved by the flow
+        tentative
+            Counts only in lookups with tentative flows
+        """
+
+        self.remove_flow(key)
+        if rate == 0 or amount <= 0:
+            return
+        self._flows[key] = [start, rate, amount, tentative]
+        self.__view(tentative)[:] += self.__profile(start, rate, amount, self._hours)
+
+    def remove_flow(self, key):
+        """ Removes the rest of the flow. Does nothing if there is no such flow """
+
+        flow = self._flows.pop(key, None)
+        if flow is None:
+            return
+        start, rate, amount, tentative = flow
+        self.__view(tentative)[:] -= self.__profile(start, rate, amount, self._hours)
+
+    def advance(self, hours: float, level: float):
+        """ Moves the forecast hours ahead and sets the current level to the actual one.
+        Flows that are over are dropped, tentative flows that have started too
+
+        Parameters
+        ----------
+        hours
+            Passed hours
+        level
+            Actual storage level
+        """
+
+        horizon_hours = len(self._hours) - 1
+        shift = int(hours)
+        if shift == hours and shift <= horizon_hours:
+            # Whole hours: the head moves and only the new tail is computed. Flows that are over within
+            # the horizon do not change the tail
+            if self._head + horizon_hours + shift >= len(self._buffer):
+                self._buffer[:horizon_hours + 1] = self.__view(False)
+                self._tentative_buffer[:horizon_hours + 1] = self.__view(True)
+                self._head = 0
+            last = self._head + horizon_hours
+            level_last = float(self._buffer[last])
+            tentative_last = float(self._tentative_buffer[last])
+            for k in range(1, shift + 1):
+                self._buffer[last + k] = level_last + self._base_rate * k
+                self._tentative_buffer[last + k] = tentative_last
+            for start, rate, amount, tentative in self._flows.values():
+                if start + amount / abs(rate) > horizon_hours:
+                    buffer = self._tentative_buffer if tentative else self._buffer
+                    moved_before = _moved(start, rate, amount, horizon_hours)
+                    for k in range(1, shift + 1):
+                        buffer[last + k] += _moved(start, rate, amount, horizon_hours + k) - moved_before
+            self._head += shift
+        else:
+            self._head = 0
+            self._buffer[:horizon_hours + 1] = self._base_rate * self._hours
+            self._tentative_buffer[:horizon_hours + 1] = 0
+            for start, rate, amount, tentative in self._flows.values():
+                self.__view(tentative)[:] += self.__profile(start - hours, rate, amount, self._hours)
+        self._offset = level - self._buffer[self._head]
+        self._tentative_offset = -self._tentative_buffer[self._head]
+
+        is_over = []
+        for key, flow in self._flows.items():
+            flow[0] -= hours
+            start, rate, amount, tentative = flow
+            if start + amount / abs(rate) <= 0 or (tentative and start < 0):
+                is_over.append(key)
+        for key in is_over:
+            self.remove_flow(key)
+
+    def level(self, hour: float, tentative: bool = False) -> float:
+        """ Level at the first whole hour not earlier than the given one, at the horizon if it is beyond """
+
+        index = self._head + min(int(np.ceil(hour)), len(self._hours) - 1)
+        level = self._buffer[index] + self._offset
+        if tentative:
+            level += self._tentative_buffer[index] + self._tentative_offset
+        return float(level)
+
+    def levels(self, tentative: bool = False) -> np.ndarray:
+        """ Level at every whole hour from now, the first element is the current level """
+
+        return self.__window(None, tentative, 0, 0, 0)
+
+    def min_level(self, until: float = None, tentative: bool = False, start: float = 0, rate: float = 0,
+                  amount: float = 0) -> float:
+        """ Lowest level in the hours until the given hour, or over the horizon if None. A flow given by start,
+        rate and amount is added to the forecast for the lookup only
+        """
+
+        return float(self.__window(until, tentative, start, rate, amount).min())
+
+    def max_level(self, until: float = None, tentative: bool = False, start: float = 0, rate: float = 0,
+                  amount: float = 0) -> float:
+        """ Highest level in the hours until the given hour, or over the horizon if None. A flow given by start,
+        rate and amount is added to the forecast for the lookup only
+        """
+
+        return float(self.__window(until, tentative, start, rate, amount).max())
+
+    def __window(self, until: float, tentative: bool, start: float, rate: float, amount: float) -> np.ndarray:
+        end = len(self._hours) if until is None else min(int(np.ceil(until)) + 1, len(self._hours))
+        levels = self._buffer[self._head:self._head + end] + self._offset
+        if tentative:
+            levels += self._tentative_buffer[self._head:self._head + end] + self._tentative_offset
+        if rate != 0 and amount > 0:
+            levels += self.__profile(start, rate, amount, self._hours[:end])
+        return levels
+
+
+def _moved(start: float, rate: float, amount: float, hour: float) -> float:
+    """ Oil moved by the flow from its start until the hour, signed like the rate """
+
+    moved = min(max(abs(rate) * (hour - start), 0), amount)
+    return moved if rate > 0 else -moved
@@ -1,13 +1,24 @@
+import heapq
 import math
-from random import normalvariate
+import random
 
+from event_logic.event_type import EventType
+from station_logic.storage_forecast import StorageForecast
 from station_logic.train_station import TrainStation
 from train_logic.train import Train
 from train_logic.train_state import TrainState
 
 
 class Terminal(TrainStation):
-    """ Terminal station where oil is produced """
+    """ Terminal station where oil is produced.
+
+    Pumping rate is shared by the trains loading on all tracks. Free tracks, loading tracks and the oil still
+    needed by loading trains are kept up to date on every change, so no step scans all tracks.
+
+    With a forecast horizon the terminal keeps a storage forecast with the pumping of trains on the tracks
+    and admits a train if the forecast stays non-negative until the train is full. Trains that would be full
+    after the horizon are checked by step counts
+    """
 
     def __init__(self,
                  station_name: str,
@@ -15,7 +26,9 @@ class Terminal(TrainStation):
                  tracks_num: int,
                  emptying_speed: int,
                  mean_prod_speed: int,
-                 std_prod_speed: int):
+                 std_prod_speed: int,
+                 rng: random.Random = None,
+                 forecast_hours: int = None):
         """
         Parameters
         ----------
@@ -26,20 +39,77 @@ class Terminal(TrainStation):
         tracks_num
             Number of railway tracks
         emptying_speed
-            Speed of station storage emptying
+            Speed of station storage emptying. Shared by all loading trains
         mean_prod_speed
             Mean of oil producing speed
         std_prod_speed
             Std of oil producing speed
+        rng
+            Random stream of oil production. Global random module if None
+        forecast_hours
+            Horizon of the storage forecast used for admission. Step count estimates are used if None
+            and for trains that take longer than the horizon to fill, so it should cover the longest fill
         """
 
+        if tracks_num < 1:
+            raise AttributeError('Terminal needs at least one track')
         super().__init__(station_name, oil_volume, tracks_num)
         self._emptying_speed = emptying_speed
         self._mean_prod_speed = mean_prod_speed
         self._std_prod_speed = std_prod_speed
         self._last_oil_mined = None
-        self._last_oil_given = None
-        assert(tracks_num == 1)
+        self._last_oil_given_per_track = [None] * tracks_num
+        # Tracks with oil given during the last step, to reset only them
+        self._given_tracks = []
+        self._rng = rng if rng is not None else random
+        # Heap of free track numbers: trains take the first free track
+        self._free_tracks = list(range(tracks_num))
+        # Occupied track numbers in the order of admission
+        self._loading_tracks = []
+        # Oil needed to fill all trains on the tracks
+        self._loading_need = 0
+        self._forecast = None
+        if forecast_hours is not None:
+            self._forecast = StorageForecast(oil_volume, mean_prod_speed, forecast_hours)
+
+    @property
+    def mean_prod_speed(self) -> int:
+        """int: Mean of oil producing speed. Read only"""
+        return self._mean_prod_speed
+
+    @property
+    def forecast(self) -> StorageForecast:
+        """StorageForecast: Storage forecast. None without a forecast horizon. Read only"""
+        return self._forecast
+
+    @property
+    def last_oil_mined(self) -> int:
+        """int: Oil mined during the last step. None before the first step. Read only"""
+        return self._last_oil_mined
+
+    @property
+    def last_track_oil(self) -> list[int]:
+        """list[int]: Oil given to the train on every track during the last step. Read only"""
+        return self._last_oil_given_per_track
+
+    @property
+    def rng(self) -> random.Random:
+        """random.Random: Random stream of oil production"""
+        return self._rng
+
+    @rng.setter
+    def rng(self, value: random.Random):
+        self._rng = value
+
+    def add_tracks(self, tracks_num: int):
+        first_track = len(self._tracks)
+        super().add_tracks(tracks_num)
+        self._last_oil_given_per_track.extend([None] * tracks_num)
+        for track in range(first_track, first_track + tracks_num):
+            heapq.heappush(self._free_tracks, track)
+
+    def has_free_tracks(self) -> bool:
+        return len(self._free_tracks) > 0
 
     def get_info(self) -> dict:
         """ Get terminal condition info
@@ -49,9 +119,13 @@ class Terminal(TrainStation):
         dict
             <oil_amt> int: amount of oil in station storage
             <oil_mined> int: amount of mined oil during the last step
-            <train_name> str: name of train
-            <oil_collected> int: amount of train's collected oil during the last step
-            <train_storage> int: amount of oil in train storage
+            <train_name> str: name of train on the first track
+            <oil_collected> int: amount of train's collected oil on the first track during the last step
+            <train_storage> int: amount of oil in train storage on the first track
+            <tracks> list: only for terminals with several tracks, list of tracks where elements consist of -
+                    <train_name> str: name of train on the track. None if track is free
+                    <oil_collected> int: amount of train's collected oil during the last step
+                    <storage> int: amount of oil in train storage
         """
 
         train_name = None
@@ -63,12 +137,22 @@ class Terminal(TrainStation):
         info = {'oil_amt': self._oil_volume,
                 'oil_mined': self._last_oil_mined,
                 'train_name': train_name,
-                'oil_collected': self._last_oil_given,
+                'oil_collected': self._last_oil_given_per_track[0],
                 'train_storage': train_storage }
+        if len(self._tracks) > 1:
+            tracks_info = []
+            for i, track in enumerate(self._tracks):
+                elem = {'train_name': None, 'oil_collected': self._last_oil_given_per_track[i], 'storage': None}
+                if track is not None:
+                    elem['train_name'] = track.name
+                    elem['storage'] = track.oil_volume
+                tracks_info.append(elem)
+            info['tracks'] = tracks_info
         return info
 
     def __pre_simulate(self, train: Train) -> bool:
-        """ Preliminary simulation of train adding process to the track
+        """ Preliminary simulation of train adding process to the track.
+        The oil must suffice for the train and for the rest of loading of trains already on the tracks
 
         Parameters
         ----------
@@ -81,16 +165,22 @@ class Terminal(TrainStation):
             True if train can be added successfully, False otherwise
         """
 
+        if self._forecast is not None:
+            deficit = self.__forecast_deficit(train)
+            if deficit is not None:
+                return deficit <= 0
+
         can_add = False
-        # Checking if there is enough oil to fully load the train
-        if self._oil_volume >= train.storage_volume:
+        need_oil = self._loading_need + train.storage_volume
+        # Checking if there is enough oil to fully load the trains
+        if self._oil_volume >= need_oil:
             can_add = True
         else:
             # Calculating average speed of filling the storage
             sum_speed = self._mean_prod_speed - self._emptying_speed
             if sum_speed < 0:
                 has_steps = self._oil_volume // abs(sum_speed)
-                need_steps = math.ceil(train.storage_volume / self._emptying_speed)
+                need_steps = math.ceil(need_oil / self._emptying_speed)
                 # Checking that there are enough steps to fill the storage for the required number
                 if has_steps >= need_steps:
                     can_add = True
@@ -98,8 +188,28 @@ class Terminal(TrainStation):
                 can_add = True
         return can_add
 
+    def __forecast_deficit(self, train: Train) -> float:
+        """ Oil missing in the storage forecast until the train is full if it is pumped after the trains on the
+        tracks. Not positive if the train can be loaded without running the storage dry. None if the train
+        is full after the forecast horizon
+        """
+
+        if self._mean_prod_speed >= self._emptying_speed:
+            return 0
+        start = self._loading_need / self._emptying_speed
+        end = start + train.get_free_storage_space() / self._emptying_speed
+        if end > self._forecast.horizon_hours:
+            return None
+        return -self._forecast.min_level(until=end, start=start, rate=-self._emptying_speed,
+                                         amount=train.get_free_storage_space())
+
+    def __plan_pumping(self):
+        """ Puts the pumping of the oil still needed by loading trains into the forecast """
+
+        self._forecast.add_flow('pumping', 0, -self._emptying_speed, self._loading_need)
+
     def add_train_to_track(self, train: Train) -> bool:
-        """ Add a train to the track
+        """ Add a train to the first free track
 
         Parameters
         ----------
@@ -113,61 +223,133 @@ class Terminal(TrainStation):
         """
 
         is_added = False
-        track = self._tracks[0]
-        # Checking if the track is free
-        if track is None:
+        # Checking if there is a free track
+        if len(self._free_tracks) > 0:
             # Pre-simulation of train loading process
             if self.__pre_simulate(train):
+                track = heapq.heappop(self._free_tracks)
                 # Update the state of the train to "In_cargo_process"
                 train.state = TrainState.In_cargo_process
                 # Putting the train on track
-                self._tracks[0] = train
+                self._tracks[track] = train
+                self._loading_tracks.append(track)
+                self._loading_need += train.get_free_storage_space()
+                if self._forecast is not None:
+                    self.__plan_pumping()
+                self._publish(EventType.Admitted, train.name, track)
                 is_added = True
         return is_added
 
-    def __mine_oil(self):
-        """ Mines oil according to normal distribution """
+    def __mine_oil(self, hours: float):
+        """ Mines oil according to normal distribution. Production of several hours is a sum of hourly
+        productions, so its std grows as a square root of the step length
+        """
 
-        oil_mined = int(normalvariate(self._mean_prod_speed, self._std_prod_speed))
+        oil_mined = int(self._rng.normalvariate(self._mean_prod_speed * hours,
+                                                self._std_prod_speed * math.sqrt(hours)))
         self._last_oil_mined = oil_mined
         self._oil_volume += oil_mined
 
-    def __fill_trains(self):
-        """ Fill trains on tracks with oil """
-
-        self._last_oil_given = None
-        train = self._tracks[0]
-        # Checking if there is a train on the track
-        if train is not None:
-            # Checking whether it is possible to load the requested amount of oil in one step
-            if self._oil_volume - self._emptying_speed > 0:
-                overfilled_oil = train.fill_storage(self._emptying_speed)
-                self._oil_volume -= self._emptying_speed
-                self._oil_volume += overfilled_oil
-                self._last_oil_given = self._emptying_speed - overfilled_oil # logging logic
-            else:  # otherwise give as much as we can
-                overfilled_oil = train.fill_storage(self._oil_volume)
-                self._last_oil_given = self._oil_volume - overfilled_oil # logging logic
-                self._oil_volume = 0
-                self._oil_volume += overfilled_oil
+    def __fill_trains(self, hours: float):
+        """ Fill trains on tracks with oil. Pumped oil is split equally between loading trains,
+        and the share a train can not take goes to the trains with more free space
+        """
+
+        for track in self._given_tracks:
+            self._last_oil_given_per_track[track] = None
+        self._given_tracks = []
+        if len(self._loading_tracks) == 0:
+            return
+
+        emptying_amt = self._emptying_speed * hours
+        # Checking whether it is possible to pump the requested amount of oil in one step
+        if self._oil_volume - emptying_amt > 0:
+            pumped_oil = emptying_amt
+        else:  # otherwise give as much as we can
+            pumped_oil = self._oil_volume
+        is_dry = pumped_oil < emptying_amt
+        tracks = sorted(self._loading_tracks, key=lambda i: self._tracks[i].get_free_storage_space())
+        for i, track in enumerate(tracks):
+            trains_left = len(tracks) - i
+            share = pumped_oil if trains_left == 1 else pumped_oil // trains_left
+            overfilled_oil = self._tracks[track].fill_storage(share)
+            oil_given = share - overfilled_oil
+            pumped_oil -= oil_given
+            self._oil_volume -= oil_given
+            self._loading_need -= oil_given
+            self._last_oil_given_per_track[track] = oil_given  # logging logic
+            self._given_tracks.append(track)
+        if self._forecast is not None and is_dry:
+            # The storage ran dry, so the pumping takes longer than planned
+            self.__plan_pumping()
 
     def __send_trains(self):
         """ Departure trains from the tracks """
 
-        train = self._tracks[0]
-        # Checking if there is a train on the track and it is full
-        if (train is not None) and train.is_full():
-            # Update the state of the train to "Ready"
-            train.state = TrainState.Ready
-            # Removing the train from the track
-            self._tracks[0] = None
+        loading_tracks = []
+        for track in self._loading_tracks:
+            train = self._tracks[track]
+            # Checking if the train is full
+            if train.is_full():
+                # Update the state of the train to "Ready"
+                train.state = TrainState.Ready
+                # Removing the train from the track
+                self._tracks[track] = None
+                heapq.heappush(self._free_tracks, track)
+            else:
+                loading_tracks.append(track)
+        self._loading_tracks = loading_tracks
+
+    def time_to_next_event(self) -> float:
+        """ Hours until a train on the tracks may be full or the storage runs dry at mean production speed.
+        With several loading trains a train is full not earlier than if it got all the pumped oil
+        """
 
-    def update(self):
-        """ Updates station state """
+        if len(self._loading_tracks) == 0:
+            return math.inf
+        time = min(self._tracks[track].get_free_storage_space() for track in self._loading_tracks) \
+            / self._emptying_speed
+        sum_speed = self._mean_prod_speed - self._emptying_speed
+        if sum_speed < 0:
+            time = min(time, max(self._oil_volume, 0) / abs(sum_speed))
+        return time
+
+    def time_to_admission(self, train: Train) -> float:
+        """ Hours until the train can be added to the track at mean production speed """
+
+        if len(self._free_tracks) == 0:
+            # Changes only when a track is free, which is a station event
+            return math.inf
+        if self.__pre_simulate(train):
+            return 0
+        if self._forecast is not None:
+            deficit = self.__forecast_deficit(train)
+            if deficit is not None:
+                # Every hour of waiting adds the mean production to the forecast
+                return deficit / self._mean_prod_speed if self._mean_prod_speed > 0 else math.inf
+        # Oil level when the train passes the preliminary simulation. Trains already loading make it an estimate,
+        # their departures are station events anyway
+        need_oil = self._loading_need + train.storage_volume
+        sum_speed = self._mean_prod_speed - self._emptying_speed
+        need_oil = min(need_oil, math.ceil(need_oil / self._emptying_speed) * abs(sum_speed))
+        if self._mean_prod_speed <= 0:
+            return math.inf
+        return (need_oil - self._oil_volume) / self._mean_prod_speed
+
+    def update(self, hours: float = 1):
+        """ Updates station state
+
+        Parameters
+        ----------
+        hours
+            Step length in hours
+        """
 
         # Mine the oil
-        self.__mine_oil()
+        self.__mine_oil(hours)
         # Fill the trains on the tracks
-        self.__fill_trains()
+        self.__fill_trains(hours)
         # Trains departing
         self.__send_trains()
+        if self._forecast is not None:
+            self._forecast.advance(hours, self._oil_volume)
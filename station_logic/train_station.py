@@ -1,4 +1,6 @@
 from abc import ABC, abstractmethod
+from event_logic.event_bus import EventBus
+from event_logic.event_type import EventType
 from train_logic.train import Train
 from train_logic.train_state import TrainState
 
@@ -24,12 +26,66 @@ class TrainStation(ABC):
         self._station_name = station_name
         self._oil_volume = oil_volume
         self._tracks = [None] * tracks_num
+        self._event_bus = None
 
     @property
     def station_name(self) -> str:
         """str:  A name of the station. Must be unique. Read only"""
         return self._station_name
 
+    @property
+    def oil_volume(self) -> int:
+        """int: Oil amount in storage. Read only"""
+        return self._oil_volume
+
+    @property
+    def tracks_num(self) -> int:
+        """int: Number of railway tracks. Read only"""
+        return len(self._tracks)
+
+    @property
+    def tracks(self) -> list[Train]:
+        """list[Train]: Train on every track, None on free tracks. Read only, the list is not copied"""
+        return self._tracks
+
+    @property
+    def last_oil_mined(self) -> int:
+        """int: Oil mined during the last step. None for stations without production. Read only"""
+        return None
+
+    @property
+    @abstractmethod
+    def last_track_oil(self) -> list[int]:
+        """list[int]: Oil moved between the storage and the train on every track during the last step,
+        None for tracks without moved oil. Read only
+
+        Need to implement
+        """
+
+        pass
+
+    def add_tracks(self, tracks_num: int):
+        """ Adds free railway tracks after the existing ones
+
+        Parameters
+        ----------
+        tracks_num
+            Number of tracks to add
+        """
+
+        if tracks_num < 0:
+            raise AttributeError('Number of tracks to add must not be negative')
+        self._tracks.extend([None] * tracks_num)
+
+    def attach_event_bus(self, event_bus: EventBus):
+        """ Sets event bus to publish station transitions to """
+
+        self._event_bus = event_bus
+
+    def _publish(self, event_type: EventType, train_name: str = None, track: int = None, value: float = None):
+        if self._event_bus is not None:
+            self._event_bus.publish(event_type, self._station_name, train_name, track, value)
+
     def has_free_tracks(self) -> bool:
         """ Checks station for free tracks
 
@@ -63,6 +119,7 @@ class TrainStation(ABC):
             if track is None:
                 train.state = TrainState.In_cargo_process
                 self._tracks[i] = train
+                self._publish(EventType.Admitted, train.name, i)
                 is_added = True
                 break
         return is_added
@@ -76,11 +133,35 @@ class TrainStation(ABC):
 
         pass
 
+    def time_to_next_event(self) -> float:
+        """ Hours until the station state crosses a threshold (a train is loaded, storage is empty, etc.).
+        Used to choose adaptive step length. 0 means the station needs the smallest step
+        """
+
+        return 0
+
+    def time_to_admission(self, train: Train) -> float:
+        """ Hours until the train can be added to the track if nothing else happens """
+
+        return 0
+
+    def announce_train(self, train: Train, hours: float):
+        """ Tells the station that the train is in transit to it and arrives in the given hours.
+        Used by stations with a storage forecast
+        """
+
+        pass
+
     @abstractmethod
-    def update(self):
+    def update(self, hours: float = 1):
         """ Implements simulation step logic: fills trains storages and mine the oil.
 
         Need to implement
+
+        Parameters
+        ----------
+        hours
+            Step length in hours
         """
 
         pass
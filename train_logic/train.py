@@ -1,3 +1,5 @@
+import math
+
 from train_logic.train_state import TrainState
 from train_logic.train_direction import TrainDirection
 
@@ -58,6 +60,10 @@ class Train:
     def unload_station_name(self) -> str:
         return self._unload_station_name
 
+    @property
+    def velocity(self) -> int:
+        return self._velocity
+
     @property
     def oil_volume(self) -> int:
         return self._oil_volume
@@ -114,7 +120,7 @@ class Train:
             self._oil_volume -= value
             return value
         else:
-            diff = value - self._oil_volume
+            diff = self._oil_volume
             self._oil_volume = 0
             return diff
 
@@ -149,17 +155,31 @@ class Train:
         else:
             raise NotImplementedError('No such direction')
 
-    def __drive_step(self):
-        if self._coord - self._velocity >= 0:
-            self._coord -= self._velocity
+    def __drive_step(self, hours: float):
+        distance = self._velocity * hours
+        if self._coord - distance >= 0:
+            self._coord -= distance
         else:
             self._coord = 0
 
-    def update(self):
-        """ Updates train condition due to its state """
+    def time_to_arrival(self) -> float:
+        """ Hours left to the destination. Infinite if the train is not in transit """
+
+        if self._state != TrainState.Transit:
+            return math.inf
+        return self._coord / self._velocity
+
+    def update(self, hours: float = 1):
+        """ Updates train condition due to its state
+
+        Parameters
+        ----------
+        hours
+            Step length in hours
+        """
 
         if self._state == TrainState.Transit:
-            self.__drive_step()
+            self.__drive_step(hours)
             if self._coord == 0:
                 self._state = TrainState.Arrived
         elif self._state in [TrainState.Wait, TrainState.Ready,